@@ -25,6 +25,11 @@ urlpatterns = [
     # message management
     path('message/<str:id>/<str:action>/', api_views.MessageActionView.as_view(), name="api_message_action"),
 
+    # batch runs
+    path('batch/', api_views.BatchRunListView.as_view(), name="api_batch"),  # GET, POST
+    path('batch/<str:id>/', api_views.BatchRunDetailView.as_view(), name="api_batch_detail"),  # GET
+    path('batch/<str:id>/<str:action>/', api_views.BatchRunDetailView.as_view(), name="api_batch_action"),  # GET
+
     # Pipeline management
     path('pipeline/', api_views.PipelineListView.as_view(), name="api_pipeline"),  # GET, POST
     path('pipeline/<str:alias>/', api_views.PipelineDetailView.as_view(), name="api_pipeline"),  # GET, POST
@@ -4,11 +4,12 @@ import logging
 import requests
 
 from django.conf import settings
-from django.http import JsonResponse, HttpResponse, Http404
+from django.http import JsonResponse, HttpResponse, Http404, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.contrib.auth import authenticate, login
 from django.middleware.csrf import get_token
 from django.contrib.auth.models import Group, User
+from django.core.exceptions import ValidationError
 
 from rest_framework import status
 from rest_framework.views import APIView
@@ -18,19 +19,27 @@ from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.authentication import SessionAuthentication, BasicAuthentication
 
 from core.models import ChatSession, ChatSessionMessage, ChatSessionFile, UserPreference, UserPrompt, DynamicPipeline
+from core.models import MESSAGES_PAGE_SIZE, BatchRun
+from core.batch import create_batch_run, iter_batch_results
+from core.batch import DEFAULT_BATCH_CONCURRENCY, DEFAULT_BATCH_MAX_CONCURRENCY, DEFAULT_BATCH_MAX_SIZE
 from core.serializers import ChatSessionSerializer
 
 from lib.utils import get_best_suggestion, generate_pipeline_dict
 from lib.app_requests import SearchRequest
 
 from machinery.router import get_pipeline_dict, get_factory_dict, get_pipeline_class, get_output_kind_to_pipeline_dict
+from machinery.router import get_pipeline_aliases
 from machinery.factories.common_schema import BaseFactorySchema
+from machinery.factories.ollama.history import ConversationHistory
 from machinery.router import get_factory_class
 
 from .permissions import PipelinePermission
+from .pagination import ChatSessionPagination
 
 logger = logging.getLogger("django")
 
+MESSAGES_MAX_PAGE_SIZE = 200
+
 
 ###################
 # USER MANAGEMENT #
@@ -242,9 +251,16 @@ class ChatSessionListView(APIView):
     List all chat sessions.
     """
     def get(self, request, format=None):
-        chat_session = ChatSession.objects.filter(user=request.user).order_by('-datetime')
-        serializer = ChatSessionSerializer(chat_session, many=True)
+        pipeline_aliases = get_pipeline_aliases(request.user)
+        chat_sessions = ChatSession.objects.filter(user=request.user).for_listing(pipeline_aliases).order_by('-datetime')
+
+        if 'page' in request.GET:
+            paginator = ChatSessionPagination()
+            page = paginator.paginate_queryset(chat_sessions, request, view=self)
+            serializer = ChatSessionSerializer(page, many=True)
+            return paginator.get_paginated_response(serializer.data)
 
+        serializer = ChatSessionSerializer(chat_sessions, many=True)
         return Response(serializer.data)
 
     def post(self, request):
@@ -333,6 +349,14 @@ class ChatSessionActionView(APIView):
     def get(self, request, id, action):
         session = ChatSession.objects.get(id=id, user=request.user)
         if action == "messages":
+            if 'cursor' in request.GET or 'limit' in request.GET:
+                # paginated version : newest messages first, older pages are loaded using next_cursor
+                try:
+                    limit = min(int(request.GET.get('limit', MESSAGES_PAGE_SIZE)), MESSAGES_MAX_PAGE_SIZE)
+                    messages, next_cursor = session.serialize_messages_page(request.GET.get('cursor'), max(limit, 1))
+                except ValueError:
+                    return Response({'error': 'Invalid cursor or limit'}, status=status.HTTP_400_BAD_REQUEST)
+                return Response({"messages": messages, "next_cursor": next_cursor})
             return Response({"messages": session.serialize_messages()})
 
         raise NotImplementedError
@@ -369,10 +393,74 @@ class MessageActionView(APIView):
         if action == 'selected':
             session_message.selected = json_data['state']
             session_message.save()
+            ConversationHistory.invalidate(session.session_id)
 
         return Response({'set': True})
 
 
+#############
+# BATCH RUN #
+#############
+
+class BatchRunListView(APIView):
+    """
+    Run one pipeline over many payloads : body is made of JSON lines, one payload per line
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        batches = BatchRun.objects.filter(user=request.user).order_by('-created_on')
+        return Response({'batches': [batch.as_dict() for batch in batches]})
+
+    def post(self, request):
+        pipeline_alias = request.GET.get('pipeline')
+        if not pipeline_alias or get_pipeline_class(pipeline_alias, request.user) is None:
+            raise Http404
+        try:
+            default_concurrency = getattr(settings, 'BATCH_RUN_CONCURRENCY', DEFAULT_BATCH_CONCURRENCY)
+            concurrency = int(request.GET.get('concurrency', default_concurrency))
+        except ValueError:
+            return Response({'error': 'Invalid concurrency'}, status=status.HTTP_400_BAD_REQUEST)
+        max_concurrency = getattr(settings, 'BATCH_RUN_MAX_CONCURRENCY', DEFAULT_BATCH_MAX_CONCURRENCY)
+        concurrency = min(max(concurrency, 1), max_concurrency)
+
+        payloads = []
+        for index, line in enumerate(request.body.decode().splitlines()):
+            if not line.strip():
+                continue
+            try:
+                payloads.append(json.loads(line))
+            except ValueError:
+                return Response({'error': f'Invalid JSON at line {index + 1}'}, status=status.HTTP_400_BAD_REQUEST)
+        max_size = getattr(settings, 'BATCH_RUN_MAX_SIZE', DEFAULT_BATCH_MAX_SIZE)
+        if not payloads or len(payloads) > max_size:
+            return Response({'error': f'A batch must have between 1 and {max_size} payloads'}, status=status.HTTP_400_BAD_REQUEST)
+
+        batch, errors = create_batch_run(request.user, pipeline_alias, payloads, concurrency)
+        if errors:
+            return Response({'errors': errors}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(batch.as_dict(), status=status.HTTP_201_CREATED)
+
+
+class BatchRunDetailView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get_object(self, id, user):
+        try:
+            return BatchRun.objects.get(id=id, user=user)
+        except (BatchRun.DoesNotExist, ValidationError):
+            raise Http404
+
+    def get(self, request, id, action=None):
+        batch = self.get_object(id, request.user)
+        if action is None:
+            return Response(batch.as_dict())
+        if action == 'results':
+            # results are streamed as they come, until the batch ends
+            return StreamingHttpResponse(iter_batch_results(batch), content_type='application/x-ndjson')
+        raise Http404
+
+
 #######################
 # PIPELINE MANAGEMENT #
 #######################
@@ -381,7 +469,7 @@ class PipelineListView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
-        pipeline_dict = get_pipeline_dict(request.user, use_cache=False)
+        pipeline_dict = get_pipeline_dict(request.user)
         pipelines = []
         for alias, kls in pipeline_dict.items():
             # if alias != settings.DEFAULT_PIPELINE:
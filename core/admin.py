@@ -1,8 +1,9 @@
 from django.contrib import admin
 
-from core.models import DynamicPipeline, ChatSession, UserToken
+from core.models import DynamicPipeline, ChatSession, UserToken, BatchRun
 # Register your models here.
 
 admin.site.register(DynamicPipeline)
 admin.site.register(ChatSession)
 admin.site.register(UserToken)
+admin.site.register(BatchRun)
@@ -0,0 +1,189 @@
+# asyncio worker : runs pipelines that implement aprocess (see BasePipeline.aprocess)
+# concurrently within a single process, instead of blocking one RQ worker per job.
+# Jobs are pushed in a redis list by ChatSession.process and run by "python manage.py asyncworker".
+# A job is moved to a processing list of its worker until it ends : jobs of a dead worker (whose heartbeat
+# expired) are recovered by the other workers, every HEARTBEAT_TTL seconds. A recovered job is run again
+# unless its messages had been created : its responses are then ended with an error (see end_orphan_call).
+import asyncio
+import json
+import logging
+import os
+import socket
+import uuid
+
+from django.conf import settings
+from django.utils.translation import gettext as _
+
+from asgiref.sync import sync_to_async
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+import django_rq
+import redis.asyncio as aioredis
+
+from core.models import ChatSession, ChatSessionMessage
+from core.scheduler import release
+from machinery.senders import AsyncChannelSender
+import lib.metrics as lib_metrics
+from lib.constants import MESSAGE_KIND_ERROR
+
+logger = logging.getLogger("django")
+
+ASYNC_JOBS_KEY = 'matcha:async_jobs'
+ASYNC_WORKERS_KEY = 'matcha:async_workers'  # set of worker names
+PROCESSING_KEY_TPL = 'matcha:async_jobs:processing:{worker_name}'
+HEARTBEAT_KEY_TPL = 'matcha:async_workers:{worker_name}'
+JOB_MESSAGES_KEY_TPL = 'matcha:async_jobs:messages:{job_id}'  # response message ids of a running job
+JOB_MESSAGES_TTL = 24 * 60 * 60  # in sec, a forgotten key must not live forever
+HEARTBEAT_INTERVAL = 10  # in sec
+HEARTBEAT_TTL = 3 * HEARTBEAT_INTERVAL
+DEFAULT_ASYNC_WORKER_CONCURRENCY = 50
+
+
+def enqueue_async_call(session_id: str, payload: dict, ticket: dict = None) -> None:
+    connection = django_rq.get_connection('default')
+    job = {'id': str(uuid.uuid4()), 'session_id': session_id, 'payload': payload, 'ticket': ticket}
+    connection.rpush(ASYNC_JOBS_KEY, json.dumps(job))
+
+
+async def async_inline_schedule_call(session_id: str, payload: dict, ticket: dict = None, on_prepared=None) -> None:
+    # asyncio version of core.models.inline_schedule_call
+    try:
+        session = await database_sync_to_async(ChatSession.objects.get, thread_sensitive=False)(id=session_id)
+        session.channel_layer = get_channel_layer()
+        session.connected = True
+        session.async_sender = AsyncChannelSender(session.channel_layer, session.channel_id)
+        try:
+            await session.aschedule_call(payload, on_prepared=on_prepared)
+        finally:
+            await session.async_sender.close()
+    finally:
+        await sync_to_async(lib_metrics.flush, thread_sensitive=False)()
+        if ticket is not None:
+            await sync_to_async(release, thread_sensitive=False)(ticket)
+
+
+async def run_job(connection, processing_key: str, raw_job: bytes, semaphore: asyncio.Semaphore) -> None:
+    messages_key = None
+    try:
+        job = json.loads(raw_job)
+        messages_key = JOB_MESSAGES_KEY_TPL.format(job_id=job['id'])
+
+        async def record_messages(response_messages: list) -> None:
+            # from now on, the job must not be run again if its worker dies (see recover_orphan_jobs)
+            message_ids = [str(response_message.id) for response_message in response_messages]
+            await connection.set(messages_key, json.dumps(message_ids), ex=JOB_MESSAGES_TTL)
+
+        await async_inline_schedule_call(job['session_id'], job['payload'], ticket=job.get('ticket'), on_prepared=record_messages)
+    except Exception:
+        logger.exception("Async job failed")
+    finally:
+        semaphore.release()
+        await connection.lrem(processing_key, 1, raw_job)
+        if messages_key is not None:
+            await connection.delete(messages_key)
+
+
+def end_orphan_call(job: dict, message_ids: list) -> None:
+    # responses left half-written by a dead worker are ended with an error rather than generated again
+    session = ChatSession.objects.get(id=job['session_id'])
+    session._connect_channel()
+    for response_message in ChatSessionMessage.objects.filter(session=session, id__in=message_ids, status='started'):
+        response_message.data['error'] = _("Processing was interrupted, please retry")
+        response_message.kind = MESSAGE_KIND_ERROR
+        response_message.status = 'ended'
+        response_message.save()
+        session.send_message(response_message.as_dict())
+    session.send_result(_("End processing"))
+
+
+async def recover_orphan_job(connection, processing_key: str, raw_job: bytes) -> bool:
+    # True when the job is run again, False when its call is ended
+    job = json.loads(raw_job)
+    messages_key = JOB_MESSAGES_KEY_TPL.format(job_id=job['id'])
+    raw_message_ids = await connection.get(messages_key)
+    if raw_message_ids is None:
+        # nothing had been saved yet
+        async with connection.pipeline(transaction=True) as pipe:
+            pipe.lrem(processing_key, 1, raw_job)
+            pipe.lpush(ASYNC_JOBS_KEY, raw_job)
+            await pipe.execute()
+        return True
+    try:
+        await database_sync_to_async(end_orphan_call, thread_sensitive=False)(job, json.loads(raw_message_ids))
+    finally:
+        await connection.delete(messages_key)
+        if job.get('ticket') is not None:
+            await sync_to_async(release, thread_sensitive=False)(job['ticket'])
+    return False
+
+
+async def recover_orphan_jobs(connection, processing_key: str) -> None:
+    # jobs of workers which died are claimed (moved to this worker processing list) one at a time
+    for worker_name in await connection.smembers(ASYNC_WORKERS_KEY):
+        worker_name = worker_name.decode()
+        if await connection.exists(HEARTBEAT_KEY_TPL.format(worker_name=worker_name)):
+            continue
+        orphan_processing_key = PROCESSING_KEY_TPL.format(worker_name=worker_name)
+        requeued, ended = 0, 0
+        while True:
+            raw_job = await connection.lmove(orphan_processing_key, processing_key, 'RIGHT', 'LEFT')
+            if raw_job is None:
+                break
+            try:
+                if await recover_orphan_job(connection, processing_key, raw_job):
+                    requeued += 1
+                else:
+                    ended += 1
+            except Exception:
+                logger.exception("Job of dead async worker %s could not be recovered", worker_name)
+            await connection.lrem(processing_key, 1, raw_job)  # already done for requeued jobs
+        if requeued or ended:
+            logger.warning("Jobs of dead async worker %s : %s requeued, %s ended with an error", worker_name, requeued, ended)
+        await connection.srem(ASYNC_WORKERS_KEY, worker_name)
+
+
+async def sweep_orphan_jobs(connection, processing_key: str) -> None:
+    while True:
+        try:
+            await recover_orphan_jobs(connection, processing_key)
+        except Exception:
+            logger.exception("Jobs of dead async workers could not be recovered")
+        await asyncio.sleep(HEARTBEAT_TTL)
+
+
+async def send_heartbeats(connection, worker_name: str) -> None:
+    while True:
+        await connection.set(HEARTBEAT_KEY_TPL.format(worker_name=worker_name), 1, ex=HEARTBEAT_TTL)
+        await asyncio.sleep(HEARTBEAT_INTERVAL)
+
+
+async def flush_metrics() -> None:
+    # metrics recorded by jobs are written to redis within a thread, never from the event loop
+    while True:
+        await asyncio.sleep(lib_metrics.FLUSH_INTERVAL)
+        await asyncio.to_thread(lib_metrics.flush)
+
+
+async def run_async_worker(concurrency: int = DEFAULT_ASYNC_WORKER_CONCURRENCY) -> None:
+    queue_settings = settings.RQ_QUEUES['default']
+    connection = aioredis.Redis(host=queue_settings['HOST'], port=queue_settings['PORT'], db=queue_settings['DB'])
+    worker_name = f'{socket.gethostname()}:{os.getpid()}'
+    processing_key = PROCESSING_KEY_TPL.format(worker_name=worker_name)
+    await connection.set(HEARTBEAT_KEY_TPL.format(worker_name=worker_name), 1, ex=HEARTBEAT_TTL)
+    await connection.sadd(ASYNC_WORKERS_KEY, worker_name)
+    heartbeat_task = asyncio.create_task(send_heartbeats(connection, worker_name))
+    lib_metrics.auto_flush = False
+    flush_task = asyncio.create_task(flush_metrics())
+    sweep_task = asyncio.create_task(sweep_orphan_jobs(connection, processing_key))
+    semaphore = asyncio.Semaphore(concurrency)
+    tasks = {heartbeat_task, flush_task, sweep_task}
+    logger.info("Async worker %s started (concurrency: %s)", worker_name, concurrency)
+    while True:
+        # don't pop a job that could not be run right now
+        await semaphore.acquire()
+        raw_job = None
+        while raw_job is None:
+            raw_job = await connection.blmove(ASYNC_JOBS_KEY, processing_key, 5, 'LEFT', 'RIGHT')
+        task = asyncio.create_task(run_job(connection, processing_key, raw_job, semaphore))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
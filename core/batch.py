@@ -0,0 +1,140 @@
+# Batch runs : one pipeline over many payloads (see BatchRun), all run by a single RQ job
+# with bounded parallelism. Payloads are processed within transient sessions : nothing is sent
+# thru websocket and no chat message is saved, results are stored within the batch itself.
+import json
+import logging
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django import db
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+
+import django_rq
+
+from core.models import BatchRun, ChatSession, ChatSessionMessage
+from lib.constants import MESSAGE_KIND_REQUEST, MESSAGE_KIND_RESPONSE
+from machinery.router import get_pipeline_class
+import lib.metrics as lib_metrics
+
+logger = logging.getLogger("django")
+
+DEFAULT_BATCH_CONCURRENCY = 4
+DEFAULT_BATCH_MAX_CONCURRENCY = 16
+DEFAULT_BATCH_MAX_SIZE = 1000
+BATCH_SAVE_INTERVAL = 1.0  # in sec, results are saved at most this often while batch is running
+BATCH_POLL_INTERVAL = 0.5  # in sec, see iter_batch_results
+BATCH_ENDED_STATUSES = ('ended', 'error')
+BATCH_RESULTS_MARGIN = 60  # in sec, results are streamed until batch job timeout (from batch creation) and this margin
+
+
+def create_batch_run(user, pipeline_alias: str, payloads: list[dict], concurrency: int) -> tuple[BatchRun, list]:
+    # every payload is validated before anything is run, errors are given by line (starting at 1)
+    session = ChatSession.create_transient(user)
+    pipeline_class = session.get_pipeline_class(pipeline_alias)
+    cleaned_payloads = []
+    errors = []
+    for index, payload in enumerate(payloads):
+        data, payload_errors = session.validate_payload(pipeline_alias, payload)
+        if data is None:
+            errors.append({'line': index + 1, 'errors': payload_errors})
+        else:
+            cleaned_payloads.append(data)
+    if errors:
+        return None, errors
+    batch = BatchRun.objects.create(user=user, pipeline=pipeline_alias, payloads=cleaned_payloads, concurrency=concurrency)
+    enqueue_batch_run(batch, pipeline_class)
+    return batch, []
+
+
+def get_batch_timeout(batch: BatchRun, pipeline_class) -> int:
+    job_timeout = pipeline_class.JOB_TIMEOUT or settings.RQ_QUEUES[pipeline_class.QUEUE]['DEFAULT_TIMEOUT']
+    rounds = math.ceil(len(batch.payloads) / batch.concurrency)
+    return job_timeout * rounds
+
+
+def enqueue_batch_run(batch: BatchRun, pipeline_class) -> None:
+    queue = django_rq.get_queue(pipeline_class.QUEUE)
+    queue.enqueue(
+        inline_batch_run, str(batch.id),
+        job_timeout=get_batch_timeout(batch, pipeline_class),
+        result_ttl=pipeline_class.RESULT_TTL,
+        on_failure=batch_run_failed
+    )
+
+
+def end_batch_run(batch_id: str) -> None:
+    # a batch that could not end normally (job failure, timeout...) must not look as running forever
+    BatchRun.objects.filter(id=batch_id).exclude(status__in=BATCH_ENDED_STATUSES).update(status='error', ended_on=timezone.now())
+
+
+def batch_run_failed(job, connection, type, value, traceback) -> None:
+    # RQ failure callback, called when job raised or timed out
+    end_batch_run(job.args[0])
+
+
+def run_batch_item(batch: BatchRun, pipeline_class, index: int, data: dict) -> dict:
+    session = ChatSession.create_transient(batch.user)
+    pipeline = pipeline_class(session)
+    request_message = ChatSessionMessage(session=session, pipeline=batch.pipeline, data=data, kind=MESSAGE_KIND_REQUEST)
+    response_message = ChatSessionMessage(session=session, pipeline=batch.pipeline, data={}, status='started', kind=MESSAGE_KIND_RESPONSE)
+    session.transient_messages.append(request_message)
+    try:
+        pipeline.preprocess(request_message, response_message)
+        if not session.replay_cached_result(pipeline, request_message, response_message):
+            pipeline.process(request_message, response_message)
+            session.cache_result(pipeline, request_message, response_message)
+        pipeline.postprocess(request_message, response_message)
+        return {'index': index, 'status': 'ok', 'data': response_message.data, 'content': response_message.render(pipeline_class)}
+    except Exception as e:
+        logger.exception("Batch %s : payload %s failed", batch.id, index)
+        return {'index': index, 'status': 'error', 'error': str(e)}
+    finally:
+        # each thread has its own database connection
+        db.connection.close()
+
+
+def inline_batch_run(batch_id: str) -> None:
+    batch = BatchRun.objects.select_related('user').get(id=batch_id)
+    pipeline_class = get_pipeline_class(batch.pipeline, batch.user)
+    if pipeline_class is None:
+        BatchRun.objects.filter(id=batch.id).update(status='error', ended_on=timezone.now())
+        return
+    try:
+        BatchRun.objects.filter(id=batch.id).update(status='started')
+        results = []
+        saved_at = time.monotonic()
+        with ThreadPoolExecutor(max_workers=batch.concurrency) as executor:
+            futures = [executor.submit(run_batch_item, batch, pipeline_class, index, data) for index, data in enumerate(batch.payloads)]
+            for future in as_completed(futures):
+                results.append(future.result())
+                if time.monotonic() - saved_at >= BATCH_SAVE_INTERVAL:
+                    BatchRun.objects.filter(id=batch.id).update(results=results)
+                    saved_at = time.monotonic()
+        BatchRun.objects.filter(id=batch.id).update(results=results, status='ended', ended_on=timezone.now())
+    except Exception:
+        logger.exception("Batch %s failed", batch.id)
+        end_batch_run(batch.id)
+        raise
+    finally:
+        lib_metrics.flush()
+
+
+def iter_batch_results(batch: BatchRun):
+    # JSON lines, yielded as soon as they are saved, until batch ends (or should have ended)
+    pipeline_class = get_pipeline_class(batch.pipeline, batch.user)
+    deadline = batch.created_on.timestamp() + BATCH_RESULTS_MARGIN
+    if pipeline_class is not None:
+        deadline += get_batch_timeout(batch, pipeline_class)
+    batch_id = batch.id
+    sent_count = 0
+    while True:
+        batch = BatchRun.objects.only('status', 'results').get(id=batch_id)
+        for result in batch.results[sent_count:]:
+            yield json.dumps(result, cls=DjangoJSONEncoder) + '\n'
+        sent_count = len(batch.results)
+        if batch.status in BATCH_ENDED_STATUSES or time.time() >= deadline:
+            break
+        time.sleep(BATCH_POLL_INTERVAL)
@@ -0,0 +1,17 @@
+import asyncio
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandParser
+
+from core.asyncworker import run_async_worker, DEFAULT_ASYNC_WORKER_CONCURRENCY
+
+
+class Command(BaseCommand):
+    help = 'Run pipelines that support asyncio (aprocess) concurrently within a single process'
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        default_concurrency = getattr(settings, 'ASYNC_WORKER_CONCURRENCY', DEFAULT_ASYNC_WORKER_CONCURRENCY)
+        parser.add_argument('--concurrency', type=int, default=default_concurrency, help='Maximum number of jobs run simultaneously')
+
+    def handle(self, *args, **kwargs):
+        asyncio.run(run_async_worker(kwargs['concurrency']))
@@ -0,0 +1,45 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError, CommandParser
+
+from rq import Queue
+from rq.worker import Worker
+import django_rq
+
+from core.worker import PreloadedWorker, PreloadedSimpleWorker, benchmark_job
+
+BENCHMARK_QUEUE_NAME = 'matcha_benchmark'
+
+
+class Command(BaseCommand):
+    help = 'Compare per-job overhead of RQ worker classes (stock worker first, preloaded ones afterwards)'
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument('--jobs', type=int, default=50, help='Number of jobs run by each worker class')
+        parser.add_argument('--username', type=str, default=None, help='User whose pipeline registry is resolved by jobs (default: first user)')
+
+    def handle(self, *args, **kwargs):
+        users = User.objects.all()
+        if kwargs['username']:
+            users = users.filter(username=kwargs['username'])
+        user = users.order_by('id').first()
+        if user is None:
+            raise CommandError('No user found')
+        job_count = kwargs['jobs']
+        queue = Queue(BENCHMARK_QUEUE_NAME, connection=django_rq.get_connection('default'))
+        # stock worker must be run first : benchmark process itself is warmed by preloaded workers
+        for worker_class in [Worker, PreloadedWorker, PreloadedSimpleWorker]:
+            queue.empty()
+            for _ in range(job_count):
+                queue.enqueue(benchmark_job, user.id, result_ttl=0)
+            worker = worker_class([queue], connection=queue.connection)
+            started_at = time.monotonic()
+            worker.work(burst=True, logging_level='WARNING')
+            duration = time.monotonic() - started_at
+            warm_up_duration = getattr(worker, 'warm_up_duration', None) or 0
+            per_job = (duration - warm_up_duration) / job_count
+            self.stdout.write(
+                f'{worker_class.__name__:<24} warm up: {warm_up_duration * 1000:8.1f} ms'
+                f'    per job: {per_job * 1000:8.1f} ms    total: {duration:6.2f} s'
+            )
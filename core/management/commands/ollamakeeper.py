@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand, CommandParser
+
+from core.ollama_keeper import OllamaKeeper
+
+
+class Command(BaseCommand):
+    help = 'Preload Ollama models used by pipelines, keep the most used ones loaded and unload idle ones'
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument('--once', action='store_true', help='Run a single cycle, then exit')
+
+    def handle(self, *args, **kwargs):
+        OllamaKeeper().run(once=kwargs['once'])
@@ -0,0 +1,15 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandParser
+
+from core.scheduler import run_dispatcher, DEFAULT_DISPATCH_INTERVAL
+
+
+class Command(BaseCommand):
+    help = 'Periodically dispatch jobs waiting in the fair scheduler (in-flight jobs whose release was lost expire)'
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        default_interval = getattr(settings, 'SCHEDULER_DISPATCH_INTERVAL', DEFAULT_DISPATCH_INTERVAL)
+        parser.add_argument('--interval', type=float, default=default_interval, help='Delay between dispatches (in sec)')
+
+    def handle(self, *args, **kwargs):
+        run_dispatcher(kwargs['interval'])
@@ -0,0 +1,79 @@
+import asyncio
+import time
+
+from django.core.management.base import BaseCommand, CommandParser
+from django.test import override_settings
+from django.urls import re_path
+
+from channels.layers import get_channel_layer, channel_layers, InMemoryChannelLayer, DEFAULT_CHANNEL_LAYER
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+
+from wsock.consumers import Consumer, SyncConsumer, loads
+
+LOADTEST_GROUP_TPL = 'loadtest_{index}'
+
+
+async def receive_events(communicator: WebsocketCommunicator, event_count: int) -> None:
+    received = 0
+    while received < event_count:
+        output = await communicator.receive_output(timeout=60)
+        if output['type'] != 'websocket.send':
+            continue
+        payload = loads(output['text'])
+        received += len(payload) if isinstance(payload, list) else 1
+
+
+async def run_scenario(consumer_class, socket_count: int, event_count: int) -> tuple[float, float]:
+    # returns (wall time, cpu time) needed to deliver event_count deltas to each of socket_count sockets
+    application = URLRouter([re_path(r"ws/channel/(?P<channel_id>\w+)$", consumer_class.as_asgi())])
+    communicators = []
+    for index in range(socket_count):
+        communicator = WebsocketCommunicator(application, 'ws/channel/' + LOADTEST_GROUP_TPL.format(index=index))
+        await communicator.connect()
+        communicators.append(communicator)
+    channel_layer = get_channel_layer()
+    started_at = time.monotonic()
+    cpu_started_at = time.process_time()
+    receivers = [asyncio.create_task(receive_events(communicator, event_count)) for communicator in communicators]
+    for seq in range(event_count):
+        event = {'type': 'runner.delta', 'message': {'id': 'loadtest', 'seq': seq + 1, 'content': 'some streamed tokens ', 'session_id': 'loadtest'}}
+        await asyncio.gather(*[
+            channel_layer.group_send(LOADTEST_GROUP_TPL.format(index=index), event)
+            for index in range(socket_count)
+        ])
+    await asyncio.gather(*receivers)
+    result = time.monotonic() - started_at, time.process_time() - cpu_started_at
+    for communicator in communicators:
+        await communicator.disconnect()
+    return result
+
+
+class Command(BaseCommand):
+    help = 'Compare websocket consumers (previous sync one, async one, async one with send batching) under many concurrent streams'
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument('--sockets', type=int, default=200, help='Number of concurrent websockets')
+        parser.add_argument('--events', type=int, default=100, help='Number of deltas sent to each websocket')
+        parser.add_argument('--rate', type=int, default=20, help='Deltas per second of a stream, used to estimate sockets per core')
+        parser.add_argument('--batch-window', type=float, default=0.05, help='Send batching window (in sec) of the 3rd scenario')
+        parser.add_argument('--in-memory', action='store_true', help='Use an in-memory channel layer instead of the configured one')
+
+    def handle(self, *args, **kwargs):
+        if kwargs['in_memory']:
+            channel_layers.set(DEFAULT_CHANNEL_LAYER, InMemoryChannelLayer(capacity=kwargs['events'] * 2))
+        scenarios = [
+            ('sync consumer', SyncConsumer, 0),
+            ('async consumer', Consumer, 0),
+            ('async consumer, batched', Consumer, kwargs['batch_window']),
+        ]
+        for label, consumer_class, batch_window in scenarios:
+            with override_settings(WEBSOCKET_SEND_BATCH_WINDOW=batch_window):
+                duration, cpu_time = asyncio.run(run_scenario(consumer_class, kwargs['sockets'], kwargs['events']))
+            delivered = kwargs['sockets'] * kwargs['events']
+            # a core can serve this many sockets each streaming --rate deltas per second
+            sockets_per_core = delivered / max(cpu_time, 1e-6) / kwargs['rate']
+            self.stdout.write(
+                f'{label:<24} wall: {duration:6.2f} s    cpu: {cpu_time:6.2f} s'
+                f'    deltas/s: {delivered / duration:9.0f}    sockets per core: {sockets_per_core:8.0f}'
+            )
@@ -0,0 +1,9 @@
+# Matcha metrics, see lib.metrics
+from lib.metrics import Counter, Histogram
+
+PIPELINE_RUNS = Counter('matcha_pipeline_runs_total', 'Pipeline runs by pipeline and status')
+PIPELINE_CALL_DURATION = Histogram('matcha_pipeline_call_duration_seconds', 'Whole call duration (including database and channel steps)')
+PIPELINE_PROCESS_DURATION = Histogram('matcha_pipeline_process_duration_seconds', 'Pipeline processing duration')
+PIPELINE_FIRST_DELTA = Histogram('matcha_pipeline_time_to_first_delta_seconds', 'Time from processing start to first streamed text')
+CHANNEL_MESSAGES = Counter('matcha_channel_messages_total', 'Messages sent to websocket channels by type')
+JOB_SETUP_OVERHEAD = Histogram('matcha_job_setup_overhead_seconds', 'Time from job pick up by a worker to pipeline processing start')
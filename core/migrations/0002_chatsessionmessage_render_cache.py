@@ -0,0 +1,23 @@
+# Generated by Django 4.2.5 on 2026-10-18 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatsessionmessage',
+            name='rendered_content',
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='chatsessionmessage',
+            name='render_key',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.5 on 2026-10-18 10:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_chatsessionmessage_render_cache'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='chatsessionmessage',
+            index=models.Index(fields=['session', 'created_on'], name='core_message_session_created'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.5 on 2026-10-18 14:12
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('core', '0003_chatsessionmessage_session_created_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BatchRun',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('pipeline', models.CharField(max_length=255)),
+                ('created_on', models.DateTimeField(auto_now_add=True)),
+                ('ended_on', models.DateTimeField(blank=True, null=True)),
+                ('status', models.CharField(default='pending', max_length=255)),
+                ('concurrency', models.PositiveIntegerField(default=1)),
+                ('payloads', models.JSONField(default=list)),
+                ('results', models.JSONField(default=list)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='batch_runs', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 4.2.5 on 2026-10-18 15:02
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_batchrun'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatsessionmessage',
+            name='request',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='responses', to='core.chatsessionmessage'),
+        ),
+    ]
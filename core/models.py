@@ -1,27 +1,44 @@
 from __future__ import annotations
+import asyncio
+import copy
 import uuid
+import base64
+import binascii
+import time
+from datetime import datetime
 from typing import Type
+from concurrent.futures import ThreadPoolExecutor
 
 import pytz
 import os
 
+from django import db
 from django.db import models
+from django.db.models import Exists, OuterRef, Q
 from django.utils import timezone
 from django.contrib.auth.models import User, Group
 from django.conf import settings
-from django.utils.translation import gettext as _
+from django.utils.translation import gettext as _, get_language
 
 import django_rq
+from channels.db import database_sync_to_async
 from channels.layers import get_channel_layer
 from asgiref.sync import async_to_sync
 from pydantic import ValidationError
 
-from lib.utils import get_upload_path
+from lib.utils import get_upload_path, get_stable_hash
+import core.metrics as core_metrics
+import lib.metrics as lib_metrics
 from lib.constants import KIND_CHOICES, MESSAGE_KIND_CHOICES
-from lib.constants import MESSAGE_KIND_REQUEST, MESSAGE_KIND_RESPONSE
+from lib.constants import MESSAGE_KIND_REQUEST, MESSAGE_KIND_RESPONSE, MESSAGE_KIND_ERROR
 from lib.constants import RENDERER_MARKDOWN
+from lib.constants import PRIORITY_HIGH
 from machinery.exceptions import ChannelNotConnectedException
-from machinery.router import get_pipeline_class, get_pipeline_aliases
+from machinery.result_cache import get_cached_result, set_cached_result
+from machinery.streams import record_event as record_stream_event
+from machinery.senders import get_threaded_sender, flush_threaded_sender
+from core.worker import record_setup_overhead
+from machinery.router import get_pipeline_class, get_pipeline_aliases, get_pipeline_dict
 from machinery.mixins import ChannelMixin
 from machinery.router import get_factory_class
 
@@ -30,13 +47,67 @@ import machinery.pipelines.base as pipelines_base
 
 TIMEZONE = pytz.timezone('Europe/Paris')
 FRENCH_DATETIME_FORMAT = "%d/%m/%Y %H:%M:%S"
+MESSAGES_PAGE_SIZE = 50
+DEFAULT_FANOUT_MAX_PIPELINES = 4
 
 
-def inline_schedule_call(session_id, payload):
-    session = ChatSession.objects.get(id=session_id)
-    session.channel_layer = get_channel_layer()
-    session.connected = True
-    session.schedule_call(payload)
+def inline_schedule_call(session_id, payload, ticket=None):
+    try:
+        session = ChatSession.objects.get(id=session_id)
+        session.channel_layer = get_channel_layer()
+        session.connected = True
+        session.schedule_call(payload)
+    finally:
+        # queued channel messages must be sent before job ends
+        flush_threaded_sender()
+        lib_metrics.flush()
+        if ticket is not None:
+            # job has been admitted by the fair scheduler : let it start waiting jobs
+            from core.scheduler import release
+            release(ticket)
+
+
+def get_fanout_aliases(payload: dict) -> list[str]:
+    # a payload may ask for several pipelines ("pipelines" key) to be run concurrently on the same input,
+    # "pipeline" being the main one (its response is the only one selected for conversation history)
+    aliases = [payload['pipeline']]
+    for pipeline_alias in payload.get('pipelines') or []:
+        if pipeline_alias not in aliases:
+            aliases.append(pipeline_alias)
+    return aliases[:getattr(settings, 'FANOUT_MAX_PIPELINES', DEFAULT_FANOUT_MAX_PIPELINES)]
+
+
+def get_job_timeout(pipeline_class) -> int:
+    return pipeline_class.JOB_TIMEOUT or settings.RQ_QUEUES[pipeline_class.QUEUE]['DEFAULT_TIMEOUT']
+
+
+def get_queue_pipeline_class(pipeline_classes: list):
+    # a fan-out job runs on the queue with the longest timeout among its pipelines (a heavy pipeline
+    # must not run in a light queue worker), main pipeline queue when several are as heavy
+    return max(pipeline_classes, key=lambda kls: settings.RQ_QUEUES[kls.QUEUE]['DEFAULT_TIMEOUT'])
+
+
+def get_call_status(pipeline, response_message, replayed: bool) -> str:
+    if replayed:
+        return 'cached'
+    if response_message.kind == MESSAGE_KIND_ERROR:
+        return 'error'
+    if pipeline.was_cancelled:
+        return 'cancelled'
+    return 'ok'
+
+
+def record_call_metrics(pipeline_alias: str, status: str, started_at: float) -> None:
+    core_metrics.PIPELINE_RUNS.inc(pipeline=pipeline_alias, status=status)
+    core_metrics.PIPELINE_CALL_DURATION.observe(time.monotonic() - started_at, pipeline=pipeline_alias)
+
+
+class ChatSessionQuerySet(models.QuerySet):
+
+    def for_listing(self, pipeline_aliases):
+        # has_messages and files computed within a constant number of queries
+        messages = ChatSessionMessage.objects.filter(session=OuterRef('pk'), pipeline__in=pipeline_aliases)
+        return self.annotate(annotated_has_messages=Exists(messages)).prefetch_related('chatsessionfile_set')
 
 
 class ChatSession(models.Model, ChannelMixin):
@@ -46,23 +117,46 @@ class ChatSession(models.Model, ChannelMixin):
     datetime = models.DateTimeField(default=timezone.now)
     title = models.CharField(max_length=255, null=True, blank=True) # NOSONAR
 
+    objects = ChatSessionQuerySet.as_manager()
+
     def __init__(self, *args, **kwargs):
         super(ChatSession, self).__init__(*args, **kwargs)
         self.pipeline_cache = {}
         self.connected = False
+        self.async_sender = None
         self.channel_id = self.compute_channel_id()
+        # transient sessions (see create_transient) are neither saved nor connected to a channel
+        self.transient = False
+        self.transient_messages = []
+        self.parent = None
+
+    @classmethod
+    def create_transient(cls, user: User, parent: ChatSession = None) -> ChatSession:
+        # used to run a pipeline outside of a chat (e.g. batch runs) : messages are kept in memory.
+        # Within a chat (e.g. chain steps), it shares parent files and channel, and sends thru parent
+        if parent is not None:
+            session = cls(id=parent.id, user=parent.user, title=parent.title)
+        else:
+            session = cls(user=user)
+        session.transient = True
+        session.parent = parent
+        return session
 
     def compute_channel_id(self):
         return str(self.id).replace('-', '_')
 
     @property
     def has_messages(self):
+        annotated_has_messages = getattr(self, 'annotated_has_messages', None)  # see ChatSessionQuerySet.for_listing
+        if annotated_has_messages is not None:
+            return annotated_has_messages
         pipeline_aliases = get_pipeline_aliases(self.user)
         return ChatSessionMessage.objects.filter(pipeline__in=pipeline_aliases, session=self).exists()
 
     @property
     def files(self) -> list[ChatSessionFile]:
-        files = ChatSessionFile.objects.filter(session=self)
+        # NOTE : uses prefetched files if any (see ChatSessionQuerySet.for_listing)
+        files = self.chatsessionfile_set.all()
         file_list = [file.as_dict() for file in files]
         return file_list
 
@@ -81,7 +175,20 @@ class ChatSession(models.Model, ChannelMixin):
 
     def _send_msg(self, msg):
         # it is strongly recommended not to override this function
-        if self.connected:
+        if self.transient:
+            if self.parent is not None:
+                self.parent._send_msg(msg)
+            return
+        core_metrics.CHANNEL_MESSAGES.inc(type=msg['type'])
+        if self.async_sender is not None:
+            # within asyncio worker : message is queued and sent without blocking (and checkpointed by the sender)
+            self.async_sender.put(msg)
+        elif self.connected and settings.THREADED_CHANNEL_SENDER:
+            # message is queued and sent by a long-lived event loop thread, see flush_threaded_sender
+            get_threaded_sender().put(self.channel_id, msg)
+        elif self.connected:
+            # streamed responses can be resumed by clients after a reconnection (see machinery.streams)
+            record_stream_event(self.channel_id, msg)
             async_to_sync(self.channel_layer.group_send)(self.channel_id, msg)
         else:
             raise ChannelNotConnectedException
@@ -94,60 +201,186 @@ class ChatSession(models.Model, ChannelMixin):
     def process(self, payload):
         if not self.connected:
             self._connect_channel()
-        django_rq.enqueue(inline_schedule_call, str(self.id), payload)
+        pipeline_class = self.get_pipeline_class(payload['pipeline'])
+        if settings.SCHEDULER_ENABLED and pipeline_class is not None:
+            # fair scheduler caps in-flight jobs per user and per pipeline, it calls enqueue_call once job is admitted
+            from core.scheduler import submit
+            submit(self, payload)
+        else:
+            self.enqueue_call(pipeline_class, payload)
+
+    def enqueue_call(self, pipeline_class, payload, ticket=None):
+        # fan-out calls (see get_fanout_aliases) are run by a single job, on the heaviest queue of their pipelines
+        pipeline_classes = [self.get_pipeline_class(pipeline_alias) for pipeline_alias in get_fanout_aliases(payload)]
+        if None in pipeline_classes:
+            pipeline_class = None
+        if settings.ASYNC_WORKER_ENABLED and pipeline_class is not None and all(kls.supports_async for kls in pipeline_classes):
+            # many of those jobs are run concurrently by a single asyncio worker
+            from core.asyncworker import enqueue_async_call
+            enqueue_async_call(str(self.id), payload, ticket=ticket)
+        elif pipeline_class is not None:
+            # heavy and light pipelines are routed to distinct queues, see "queue" in config.yaml
+            job_timeout = pipeline_class.JOB_TIMEOUT
+            queue_alias = pipeline_class.QUEUE
+            if len(pipeline_classes) > 1:
+                job_timeout = max(get_job_timeout(kls) for kls in pipeline_classes)
+                queue_alias = get_queue_pipeline_class(pipeline_classes).QUEUE
+            queue = django_rq.get_queue(queue_alias)
+            queue.enqueue(
+                inline_schedule_call, str(self.id), payload, ticket=ticket,
+                job_timeout=job_timeout,
+                result_ttl=pipeline_class.RESULT_TTL,
+                at_front=pipeline_class.PRIORITY == PRIORITY_HIGH
+            )
+        else:
+            # unknown pipeline : let prepare_call send the error feedback
+            django_rq.enqueue(inline_schedule_call, str(self.id), payload, ticket=ticket)
 
     def schedule_call(self, payload: dict):
-        pipeline_alias = payload['pipeline']
-        pipeline = self.get_pipeline(pipeline_alias)
-        # get and clean data :
-        data = self.clean_payload(pipeline_alias, payload['payload'])
-        if data is not None:
-            # create a ChatSessionMessage with cleaned_data and files :
-            request_message = ChatSessionMessage(
-                session=self,
-                pipeline=pipeline_alias,
-                data=data,
-                kind=MESSAGE_KIND_REQUEST
-            )
-            request_message.save()
+        started_at = time.monotonic()
+        prepared_calls = self.prepare_call(payload)
+        if prepared_calls is not None:
+            record_setup_overhead()
+            if len(prepared_calls) == 1:
+                self.run_call(*prepared_calls[0], started_at)
+                return
+            # fan-out : pipelines are run concurrently, each one streaming into its own response message
+            with ThreadPoolExecutor(max_workers=len(prepared_calls)) as executor:
+                for future in [executor.submit(self.run_fanout_call, *prepared_call, started_at) for prepared_call in prepared_calls]:
+                    future.result()
+        else:
+            # There is nothing else to do : clean_data method already sent feedback to user
+            record_call_metrics(payload['pipeline'], 'invalid', started_at)
 
-            # returns, thru channel, a formatted version of this message
-            self.send_message(request_message.as_dict())
+    def run_call(self, pipeline, request_message, response_message, started_at: float) -> None:
+        replayed = self.replay_cached_result(pipeline, request_message, response_message)
+        # response may have been cancelled before processing starts
+        if not replayed and not pipeline.cancelled():
+            # now, ask pipeline to process the request message and update "periodically" the response message :
+            pipeline._start_processing(request_message, response_message)
+            self.cache_result(pipeline, request_message, response_message)
+        self.end_call(pipeline, request_message, response_message)
+        record_call_metrics(response_message.pipeline, get_call_status(pipeline, response_message, replayed), started_at)
 
-            # Prepare a message for response :
+    def run_fanout_call(self, pipeline, request_message, response_message, started_at: float) -> None:
+        try:
+            self.run_call(pipeline, request_message, response_message, started_at)
+        finally:
+            # each thread has its own database connection
+            db.connection.close()
+
+    async def aschedule_call(self, payload: dict, on_prepared=None):
+        # asyncio version of schedule_call (see core.asyncworker) : pipeline is processed thru aprocess
+        # whereas database related steps are run within threads.
+        # on_prepared coroutine function is given response messages once they are saved
+        started_at = time.monotonic()
+        prepared_calls = await database_sync_to_async(self.prepare_call, thread_sensitive=False)(payload)
+        if prepared_calls is not None:
+            if on_prepared is not None:
+                await on_prepared([prepared_call[2] for prepared_call in prepared_calls])
+            await asyncio.gather(*[self.arun_call(*prepared_call, started_at) for prepared_call in prepared_calls])
+        else:
+            record_call_metrics(payload['pipeline'], 'invalid', started_at)
+
+    async def arun_call(self, pipeline, request_message, response_message, started_at: float) -> None:
+        replayed = await database_sync_to_async(self.replay_cached_result, thread_sensitive=False)(pipeline, request_message, response_message)
+        if not replayed and not await pipeline.acancelled():
+            await pipeline._astart_processing(request_message, response_message)
+            await database_sync_to_async(self.cache_result, thread_sensitive=False)(pipeline, request_message, response_message)
+        await database_sync_to_async(self.end_call, thread_sensitive=False)(pipeline, request_message, response_message)
+        record_call_metrics(response_message.pipeline, get_call_status(pipeline, response_message, replayed), started_at)
+
+    def prepare_call(self, payload: dict):
+        # returns a (pipeline, request message, response message) tuple per pipeline to run (see get_fanout_aliases)
+        pipeline_aliases = get_fanout_aliases(payload)
+        # get and clean data, for each pipeline :
+        cleaned_data = []
+        for pipeline_alias in pipeline_aliases:
+            data = self.clean_payload(pipeline_alias, payload['payload'])
+            if data is None:
+                return None
+            cleaned_data.append(data)
+
+        # create a ChatSessionMessage with cleaned_data and files :
+        request_message = ChatSessionMessage(
+            session=self,
+            pipeline=pipeline_aliases[0],
+            data=cleaned_data[0],
+            kind=MESSAGE_KIND_REQUEST
+        )
+        request_message.save()
+
+        # returns, thru channel, a formatted version of this message
+        self.send_message(request_message.as_dict())
+
+        prepared_calls = []
+        for index, pipeline_alias in enumerate(pipeline_aliases):
+            pipeline = self.get_pipeline(pipeline_alias)
+            pipeline_request_message = request_message
+            if cleaned_data[index] != request_message.data:
+                # same request, as cleaned by this pipeline
+                pipeline_request_message = copy.copy(request_message)
+                pipeline_request_message.data = cleaned_data[index]
+            # Prepare a message for response, linked to its request :
             response_message = ChatSessionMessage(
                 session=self,
                 pipeline=pipeline_alias,
                 data={},
                 status='started',
-                kind=MESSAGE_KIND_RESPONSE
+                kind=MESSAGE_KIND_RESPONSE,
+                request=request_message,
+                selected=index == 0
             )
             # preprocess message :
-            pipeline.preprocess(request_message, response_message)
+            pipeline.preprocess(pipeline_request_message, response_message)
             response_message.save()
+            # clients cancel a response by its id (see runner.cancel)
+            pipeline.cancel_message_id = str(response_message.id)
 
             # send a partial for the front to know that processing will start so that
             # it can start displaying a block with content for the result
             self.send_partial(response_message.as_dict())
-
-            # now, ask pipeline to process the request message and update "periodically" the response message :
-            pipeline._start_processing(request_message, response_message)
-            response_message.status = 'ended'
-            response_message.save()
-            self.send_message(response_message.as_dict())
-            self.send_result(_("End processing"))
-
-            # postprocess message
-            pipeline.postprocess(request_message, response_message)
-            response_message.save()
-
-            # if current session has no title, let's ask current pipeline to generate one
-            if not self.title:
-                self.title = pipeline.get_title(request_message, response_message)
-                self.send_title()
-                self.save()
-        # else:
-        #     There is nothing to do : clean_data method already sent feedback to user
+            prepared_calls.append((pipeline, pipeline_request_message, response_message))
+        return prepared_calls
+
+    def replay_cached_result(self, pipeline, request_message, response_message) -> bool:
+        # deterministic pipelines (see BasePipeline.CACHEABLE) don't need to process an already seen request
+        if not pipeline.is_cacheable(request_message.data):
+            return False
+        cached_result = get_cached_result(pipeline, request_message.data, self.user_id)
+        if cached_result is None:
+            return False
+        response_message.data = cached_result['data']
+        response_message.renderer = cached_result['renderer']
+        self.send_log(_("Result retrieved from cache"))
+        return True
+
+    def cache_result(self, pipeline, request_message, response_message) -> None:
+        # errors and cancelled results must not be replayed
+        if response_message.kind != MESSAGE_KIND_RESPONSE or pipeline.was_cancelled:
+            return
+        if not pipeline.is_cacheable(request_message.data):
+            return
+        result = {'data': response_message.data, 'renderer': response_message.renderer}
+        set_cached_result(pipeline, request_message.data, self.user_id, result)
+
+    def end_call(self, pipeline, request_message, response_message):
+        # a cancelled response keeps what had been generated before cancellation
+        response_message.status = 'cancelled' if pipeline.was_cancelled else 'ended'
+        response_message.save()
+        self.send_message(response_message.as_dict())
+        self.send_result(_("End processing"))
+
+        # postprocess message
+        pipeline.postprocess(request_message, response_message)
+        response_message.save()
+
+        # if current session has no title, let's ask current pipeline to generate one
+        # (only main pipeline of a fan-out call does)
+        if not self.title and response_message.selected:
+            self.title = pipeline.get_title(request_message, response_message)
+            self.send_title()
+            self.save()
 
     # PIPELINE FUNCTIONS
 
@@ -163,28 +396,50 @@ class ChatSession(models.Model, ChannelMixin):
         pipeline_class = self.get_pipeline_class(pipeline_alias)
         return pipeline_class(session=self)
 
-    def clean_payload(self, pipeline_alias, payload):
+    def validate_payload(self, pipeline_alias, payload) -> tuple[dict, list]:
+        # returns cleaned data (None if payload is invalid) and errors
         pipeline_class = self.get_pipeline_class(pipeline_alias)
         pydantic_model = pipeline_class.pydantic_model
         try:
             obj = pydantic_model(**payload)
         except ValidationError as e:
             errors = [(item['loc'][0], item['msg']) for item in e.errors()]
+            return None, errors
+        return obj.model_dump(), []
+
+    def clean_payload(self, pipeline_alias, payload):
+        data, errors = self.validate_payload(pipeline_alias, payload)
+        if data is None:
             self.send_error(errors)
-            return None
-        return obj.model_dump()
+        return data
 
     # MESSAGES
     # NOTE : HISTORY
     def serialize_messages(self):
-        pipeline_aliases = get_pipeline_aliases(self.user)
-        session_messages = ChatSessionMessage.objects.filter(pipeline__in=pipeline_aliases, session=self).order_by('created_on')
-        history = []
-        for session_message in session_messages:
-            serialized_message = session_message.as_dict()
-            if serialized_message is not None:
-                history.append(serialized_message)
-        return history
+        pipeline_dict = get_pipeline_dict(self.user)
+        session_messages = ChatSessionMessage.objects.filter(pipeline__in=pipeline_dict.keys(), session=self).for_serialization().order_by('created_on')
+        return ChatSessionMessage.serialize_many(session_messages, pipeline_dict)
+
+    def serialize_messages_page(self, cursor: str = None, limit: int = MESSAGES_PAGE_SIZE) -> tuple[list[dict], str]:
+        # Newest messages come first : cursor (if any) points to the oldest message already sent
+        # returns serialized messages (in chronological order) and the cursor of the next (older) page
+        pipeline_dict = get_pipeline_dict(self.user)
+        session_messages = ChatSessionMessage.objects.filter(pipeline__in=pipeline_dict.keys(), session=self)
+        if cursor is not None:
+            created_on, message_id = ChatSessionMessage.parse_cursor(cursor)
+            session_messages = session_messages.filter(Q(created_on__lt=created_on) | Q(created_on=created_on, id__lt=message_id))
+        page = list(session_messages.for_serialization().order_by('-created_on', '-id')[:limit + 1])
+        next_cursor = page[limit - 1].cursor if len(page) > limit else None
+        page = page[:limit][::-1]
+        return ChatSessionMessage.serialize_many(page, pipeline_dict), next_cursor
+
+
+class ChatSessionMessageQuerySet(models.QuerySet):
+
+    def for_serialization(self):
+        # fetch everything as_dict needs within a single query
+        prompts = UserPrompt.objects.filter(message=OuterRef('pk'))
+        return self.select_related('session__user').annotate(is_prompt=Exists(prompts))
 
 
 class ChatSessionMessage(models.Model):
@@ -199,6 +454,18 @@ class ChatSessionMessage(models.Model):
     selected = models.BooleanField(default=True, null=False, blank=False)
     kind = models.CharField(choices=MESSAGE_KIND_CHOICES)
     renderer = models.CharField(max_length=255, null=False, blank=False, default=RENDERER_MARKDOWN)
+    # render cache (see render method) :
+    rendered_content = models.TextField(null=True, blank=True)  # NOSONAR
+    render_key = models.CharField(max_length=64, null=True, blank=True)  # NOSONAR
+    # responses are linked to their request : a fan-out request has a response per pipeline
+    request = models.ForeignKey('self', related_name='responses', on_delete=models.SET_NULL, null=True, blank=True)
+
+    objects = ChatSessionMessageQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['session', 'created_on'], name='core_message_session_created'),
+        ]
 
     @property
     def files(self):
@@ -209,11 +476,50 @@ class ChatSessionMessage(models.Model):
     def pipeline_class(self):
         return get_pipeline_class(self.pipeline, self.session.user)
 
+    @property
+    def cursor(self) -> str:
+        # pagination cursor, see ChatSession.serialize_messages_page
+        raw_cursor = f'{self.created_on.isoformat()}|{self.id}'
+        return base64.urlsafe_b64encode(raw_cursor.encode('utf-8')).decode('ascii')
+
+    @classmethod
+    def parse_cursor(cls, cursor: str) -> tuple[datetime, uuid.UUID]:
+        # raises ValueError if cursor is invalid
+        try:
+            raw_cursor = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8')
+            created_on, message_id = raw_cursor.split('|')
+        except (UnicodeError, binascii.Error) as e:
+            raise ValueError(str(e))
+        return datetime.fromisoformat(created_on), uuid.UUID(message_id)
+
     def files_as_dict(self):
         files = self.files
         return [{'id': file.id, 'name': file.file.name} for file in files]
 
-    def as_dict(self):
+    @classmethod
+    def serialize_many(cls, session_messages, pipeline_dict: dict) -> list[dict]:
+        # session_messages should come from a for_serialization queryset,
+        # pipeline classes are resolved once per alias thru pipeline_dict
+        history = []
+        rerendered_messages = []
+        for session_message in session_messages:
+            pipeline_class = pipeline_dict.get(session_message.pipeline)
+            if pipeline_class is not None:
+                render_key = session_message.render_key
+                history.append(session_message.as_dict(pipeline_class=pipeline_class))
+                if session_message.render_key != render_key:
+                    rerendered_messages.append(session_message)
+        # persist render cache of messages that had to be (re)rendered :
+        if rerendered_messages:
+            cls.objects.bulk_update(rerendered_messages, ['rendered_content', 'render_key'])
+        return history
+
+    def as_dict(self, pipeline_class=None):
+        if pipeline_class is None:
+            pipeline_class = self.pipeline_class
+        is_prompt = getattr(self, 'is_prompt', None)  # annotated by for_serialization
+        if is_prompt is None:
+            is_prompt = self.prompts.exists()
         return {
             "id": str(self.id),
             "session_id": str(self.session.id),
@@ -221,24 +527,38 @@ class ChatSessionMessage(models.Model):
             "created_on": self.created_on.astimezone(settings.TIMEZONE).strftime(settings.DATETIME_FORMAT),
             "kind": self.kind,
             "username": self.session.user.username,
-            "content": self.render(),
+            "content": self.render(pipeline_class=pipeline_class),
             "pipeline": self.pipeline,
-            "pipeline_label": self.pipeline_class.label,
+            "pipeline_label": pipeline_class.label,
             "status": self.status,
             "valid": self.valid,
             "selected": self.selected,
+            "request_id": str(self.request_id) if self.request_id else None,
             "renderer": self.renderer,
-            "is_prompt": self.prompts.exists(),
+            "is_prompt": is_prompt,
             # "files": self.files_as_dict()
         }
 
-    def render(self):
-        from machinery.router import get_pipeline_class
-        pipeline_class = get_pipeline_class(self.pipeline, self.session.user)
+    def compute_render_key(self, pipeline_class) -> str:
+        # produced pipelines may render thru their params (e.g. TEMPLATE_STRING) and format methods may be translated
+        return get_stable_hash([
+            self.kind, self.renderer, pipeline_class.FORMAT_VERSION, pipeline_class.PARAMS_HASH, get_language(), self.data
+        ])
+
+    def render(self, pipeline_class=None):
+        # Rendered content is cached within the message itself (and saved with it)
+        # it is only computed again if data, renderer, pipeline format version or params, or active language changed
+        if pipeline_class is None:
+            pipeline_class = self.pipeline_class
         kind = self.kind
         if pipeline_class is not None:
+            render_key = self.compute_render_key(pipeline_class)
+            if render_key == self.render_key:
+                return self.rendered_content
             format_method = getattr(pipeline_class, f'format_{kind}')
-            return format_method(self)
+            self.rendered_content = format_method(self)
+            self.render_key = render_key
+            return self.rendered_content
         return None
 
     def set_result(self, content: str) -> None:
@@ -260,7 +580,7 @@ class ChatSessionFile(models.Model):
     def as_dict(self):
         return {
             'id': self.id,
-            'session_id': self.session.id,
+            'session_id': self.session_id,
             'name': self.name,
             'url': self.file.url,
             'favorite': self.favorite,
@@ -414,9 +734,8 @@ class DynamicPipeline(models.Model):
     def pipeline_class(self):
         factory_class = get_factory_class(self.factory)
         editable = any(factory_class.ui_schema["editable_elements"].values())
-        cls = factory_class.produce(**self.params)
-        normalized_id = self.normalized_id
-        cls.ALIAS = f'dynamic.{normalized_id}'
+        cls = factory_class.produce_cached(self.alias, **self.params)
+        cls.ALIAS = self.alias
         cls.LABEL = self.label
         cls.DESCRIPTION = self.description
         cls.GENERATE_MEDIA = self.generate_media
@@ -431,4 +750,34 @@ class DynamicPipeline(models.Model):
         cls.OTHER_RIGHTS = self.other_rights
         cls.FACTORY = self.factory
         cls.EDITABLE = editable
+        factory_class.apply_job_settings(cls)
         return cls
+
+
+class BatchRun(models.Model):
+    """
+    One pipeline run over many payloads (see core.batch) : results are stored within the batch
+    instead of creating chat messages
+    """
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, related_name="batch_runs", on_delete=models.CASCADE)
+    pipeline = models.CharField(max_length=255)
+    created_on = models.DateTimeField(auto_now_add=True)
+    ended_on = models.DateTimeField(null=True, blank=True)
+    status = models.CharField(max_length=255, default='pending')  # NOSONAR
+    concurrency = models.PositiveIntegerField(default=1)
+    payloads = models.JSONField(default=list)  # cleaned payloads
+    results = models.JSONField(default=list)  # in completion order, each result has the index of its payload
+
+    def as_dict(self):
+        return {
+            'id': str(self.id),
+            'pipeline': self.pipeline,
+            'created_on': self.created_on,
+            'ended_on': self.ended_on,
+            'status': self.status,
+            'concurrency': self.concurrency,
+            'count': len(self.payloads),
+            'processed': len(self.results),
+        }
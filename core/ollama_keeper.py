@@ -0,0 +1,160 @@
+# Ollama keeper (python manage.py ollamakeeper) : keeps models loaded on Ollama backends according to their usage,
+# so that users don't wait for cold model loads. On each cycle, each model served by a backend is either :
+# - pinned : requested at least OLLAMA_KEEPER_HOT_THRESHOLD times within the usage window, its keep_alive is renewed
+# - warm : referenced (config, factory instances, dynamic pipelines) or recently used, loaded until it becomes idle.
+#   Referenced models are considered used when the keeper starts : they are preloaded once, then follow the idle rule
+# - idle : not requested for OLLAMA_KEEPER_IDLE_TIMEOUT seconds, unloaded to free memory
+# Decisions are logged when they change, see OLLAMA_KEEPER_* settings to tune memory versus latency.
+# The keeper is also the only process probing backends health (every OLLAMA_HEALTH_CHECK_INTERVAL seconds),
+# probe results being shared thru redis with the processes balancing requests (see lib.ollama_pool).
+import logging
+import time
+
+from django.conf import settings
+
+import httpx
+
+from lib.config import get_config
+from lib.ollama_pool import DEFAULT_OLLAMA_HEALTH_CHECK_INTERVAL, probe_backends
+from lib.ollama_usage import get_model_usage, get_used_models, normalize_model_name
+
+logger = logging.getLogger("django")
+
+DEFAULT_OLLAMA_KEEPER_INTERVAL = 60  # in sec
+DEFAULT_OLLAMA_KEEPER_USAGE_WINDOW = 15 * 60  # in sec
+DEFAULT_OLLAMA_KEEPER_HOT_THRESHOLD = 5  # requests within usage window
+DEFAULT_OLLAMA_KEEPER_PIN_DURATION = 10 * 60  # in sec, keep_alive of pinned models (renewed on each cycle)
+DEFAULT_OLLAMA_KEEPER_IDLE_TIMEOUT = 30 * 60  # in sec
+DEFAULT_OLLAMA_KEEPER_LOAD_TIMEOUT = 5 * 60  # in sec, loading a big model may be long
+
+DECISION_PINNED = 'pinned'
+DECISION_WARM = 'warm'
+DECISION_IDLE = 'idle'
+
+
+def get_pipeline_models(pipeline_class) -> set:
+    from machinery.bridges.ollama import OllamaPipeline
+
+    models = set()
+    if issubclass(pipeline_class, OllamaPipeline) and pipeline_class.MODEL:
+        models.add(pipeline_class.MODEL)
+    llm_model = getattr(pipeline_class, 'LLM_MODEL', None)  # e.g. searchupload
+    if llm_model:
+        models.add(llm_model)
+    return models
+
+
+def get_referenced_models() -> set:
+    # Ollama models used by config.yaml pipelines and factory instances, by active dynamic pipelines,
+    # to generate titles and descriptions and by searchapp summaries
+    from core.models import DynamicPipeline
+    from machinery.router import get_static_pipeline_dict
+
+    models = set(model for model in (settings.BIG_LLM, settings.SMALL_LLM, settings.TITLE_LLM) if model)
+    for alias, pipeline_class in get_static_pipeline_dict().items():
+        models |= get_pipeline_models(pipeline_class)
+    for dynamic_pipeline in DynamicPipeline.objects.filter(active=True):
+        try:
+            models |= get_pipeline_models(dynamic_pipeline.pipeline_class)
+        except Exception:
+            logger.exception("Models of dynamic pipeline %s could not be read", dynamic_pipeline.id)
+    try:
+        summary_model = get_config().processes.core.search.settings.summary_model
+    except AttributeError:
+        summary_model = None
+    if summary_model:
+        models.add(summary_model)
+    return set(normalize_model_name(model) for model in models)
+
+
+def load_model(backend, model: str, keep_alive: int) -> None:
+    # a generate request without prompt only loads the model, keep_alive 0 unloads it.
+    # Sent without lib.ollama_pool clients so that it isn't counted as usage
+    response = httpx.post(
+        backend.url + '/api/generate',
+        json={'model': model, 'keep_alive': keep_alive},
+        timeout=getattr(settings, 'OLLAMA_KEEPER_LOAD_TIMEOUT', DEFAULT_OLLAMA_KEEPER_LOAD_TIMEOUT),
+    )
+    response.raise_for_status()
+
+
+class OllamaKeeper(object):
+
+    def __init__(self):
+        self.started_at = time.time()
+        self.decisions = {}  # (backend url, model) -> last decision
+
+    def get_idle_deadline(self, last_used: float, referenced: bool) -> float:
+        # referenced models are considered used when the keeper starts, so that they are preloaded
+        idle_since = max(last_used or 0, self.started_at if referenced else 0)
+        return idle_since + getattr(settings, 'OLLAMA_KEEPER_IDLE_TIMEOUT', DEFAULT_OLLAMA_KEEPER_IDLE_TIMEOUT)
+
+    def get_decision(self, request_count: int, last_used: float, referenced: bool) -> str:
+        if request_count >= getattr(settings, 'OLLAMA_KEEPER_HOT_THRESHOLD', DEFAULT_OLLAMA_KEEPER_HOT_THRESHOLD):
+            return DECISION_PINNED
+        if time.time() >= self.get_idle_deadline(last_used, referenced):
+            return DECISION_IDLE
+        return DECISION_WARM
+
+    def log_decision(self, backend, model: str, decision: str, reason: str) -> None:
+        key = (backend.url, model)
+        level = logging.INFO if self.decisions.get(key) != decision else logging.DEBUG
+        logger.log(level, "Ollama keeper : %s on %s is %s (%s)", model, backend.url, decision, reason)
+        self.decisions[key] = decision
+
+    def apply(self, backend, model: str, request_count: int, last_used: float, referenced: bool) -> None:
+        decision = self.get_decision(request_count, last_used, referenced)
+        loaded = model in backend.loaded_models
+        window_minutes = getattr(settings, 'OLLAMA_KEEPER_USAGE_WINDOW', DEFAULT_OLLAMA_KEEPER_USAGE_WINDOW) // 60
+        idle_minutes = (time.time() - last_used) // 60 if last_used else None
+        reason = f'{request_count} requests in last {window_minutes} min, ' + (
+            f'last one {idle_minutes:.0f} min ago' if last_used else 'not used yet'
+        )
+        if decision == DECISION_PINNED:
+            load_model(backend, model, getattr(settings, 'OLLAMA_KEEPER_PIN_DURATION', DEFAULT_OLLAMA_KEEPER_PIN_DURATION))
+        elif decision == DECISION_WARM:
+            if not loaded:
+                # loaded until it becomes idle (Ollama unloads it by itself)
+                keep_alive = int(self.get_idle_deadline(last_used, referenced) - time.time())
+                load_model(backend, model, max(keep_alive, 1))
+                reason += ', preloaded'
+        elif loaded:
+            load_model(backend, model, 0)
+            backend.loaded_models.discard(model)
+            reason += ', unloaded'
+        self.log_decision(backend, model, decision, reason)
+
+    def run_cycle(self, backends: list) -> None:
+        referenced_models = get_referenced_models()
+        models = sorted(referenced_models | get_used_models())
+        usage = get_model_usage(models, getattr(settings, 'OLLAMA_KEEPER_USAGE_WINDOW', DEFAULT_OLLAMA_KEEPER_USAGE_WINDOW))
+        for backend in backends:
+            if not backend.healthy:
+                continue
+            for model in models:
+                # models that a backend doesn't have are never pulled
+                if model not in backend.available_models or not backend.serves(model):
+                    continue
+                request_count, last_used = usage[model]
+                try:
+                    self.apply(backend, model, request_count, last_used, model in referenced_models)
+                except httpx.HTTPError as e:
+                    logger.warning("Ollama keeper : %s on %s could not be (un)loaded (%s)", model, backend.url, e)
+
+    def run(self, once: bool = False) -> None:
+        interval = getattr(settings, 'OLLAMA_KEEPER_INTERVAL', DEFAULT_OLLAMA_KEEPER_INTERVAL)
+        probe_interval = getattr(settings, 'OLLAMA_HEALTH_CHECK_INTERVAL', DEFAULT_OLLAMA_HEALTH_CHECK_INTERVAL)
+        logger.info("Ollama keeper started, checking models every %s sec", interval)
+        next_cycle_at = time.monotonic()
+        while True:
+            probe_started_at = time.monotonic()
+            try:
+                backends = probe_backends()
+                if probe_started_at >= next_cycle_at:
+                    next_cycle_at = probe_started_at + interval
+                    self.run_cycle(backends)
+            except Exception:
+                logger.exception("Ollama keeper cycle failed")
+            if once:
+                return
+            time.sleep(max(min(probe_interval, interval) - (time.monotonic() - probe_started_at), 0))
@@ -0,0 +1,200 @@
+# Fair scheduler : admission control in front of RQ queues (and asyncio worker).
+# Each user has its own waiting list, jobs are dispatched round-robin across users as long as
+# per-user and per-pipeline in-flight caps are not reached. A job is "in-flight" from its dispatch
+# until the end of inline_schedule_call (or async_inline_schedule_call) which releases it.
+# A release may be lost (killed work horse, hard timeout) : in-flight entries expire after the job timeout,
+# and waiting jobs are dispatched periodically by "python manage.py schedulerdispatch", not only on submit/release.
+import json
+import logging
+import time
+import uuid
+
+from django.conf import settings
+from django.utils.translation import gettext as _
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+import django_rq
+
+logger = logging.getLogger("django")
+
+SCHEDULER_LOCK_KEY = 'matcha:sched:lock'
+USERS_RING_KEY = 'matcha:sched:users'  # users having waiting jobs, in round-robin order
+WAITING_KEY_TPL = 'matcha:sched:waiting:{user_id}'
+RUNNING_USER_KEY_TPL = 'matcha:sched:running:user:{user_id}'
+RUNNING_PIPELINE_KEY_TPL = 'matcha:sched:running:pipeline:{pipeline}'
+
+DEFAULT_MAX_JOBS_PER_USER = 2
+DEFAULT_MAX_JOBS_PER_PIPELINE = None  # no limit
+# in-flight jobs whose release has been lost are forgotten this delay (in sec) after their job timeout
+DEFAULT_RUNNING_MARGIN = 60
+DEFAULT_DISPATCH_INTERVAL = 10  # in sec
+
+
+def get_connection():
+    return django_rq.get_connection('default')
+
+
+def get_max_jobs_per_user():
+    return getattr(settings, 'SCHEDULER_MAX_JOBS_PER_USER', DEFAULT_MAX_JOBS_PER_USER)
+
+
+def get_max_jobs_per_pipeline():
+    return getattr(settings, 'SCHEDULER_MAX_JOBS_PER_PIPELINE', DEFAULT_MAX_JOBS_PER_PIPELINE)
+
+
+def count_running(connection, key: str) -> int:
+    # in-flight jobs are stored in a sorted set, scored by their expiration time
+    connection.zremrangebyscore(key, '-inf', time.time())
+    return connection.zcard(key)
+
+
+def can_run(connection, ticket: dict) -> bool:
+    max_jobs_per_user = get_max_jobs_per_user()
+    if max_jobs_per_user and count_running(connection, RUNNING_USER_KEY_TPL.format(user_id=ticket['user_id'])) >= max_jobs_per_user:
+        return False
+    max_jobs_per_pipeline = get_max_jobs_per_pipeline()
+    if max_jobs_per_pipeline:
+        # a fan-out job is in-flight for each of its pipelines
+        for pipeline_alias in ticket['pipelines']:
+            if count_running(connection, RUNNING_PIPELINE_KEY_TPL.format(pipeline=pipeline_alias)) >= max_jobs_per_pipeline:
+                return False
+    return True
+
+
+def mark_running(connection, ticket: dict) -> None:
+    expires_at = time.time() + ticket['timeout'] + getattr(settings, 'SCHEDULER_RUNNING_MARGIN', DEFAULT_RUNNING_MARGIN)
+    connection.zadd(RUNNING_USER_KEY_TPL.format(user_id=ticket['user_id']), {ticket['id']: expires_at})
+    for pipeline_alias in ticket['pipelines']:
+        connection.zadd(RUNNING_PIPELINE_KEY_TPL.format(pipeline=pipeline_alias), {ticket['id']: expires_at})
+
+
+def start_job(job: dict) -> None:
+    from core.models import ChatSession
+    session = ChatSession.objects.get(id=job['session_id'])
+    pipeline_class = session.get_pipeline_class(job['payload']['pipeline'])
+    session.enqueue_call(pipeline_class, job['payload'], ticket=job['ticket'])
+
+
+def get_timeout(session, payload: dict) -> int:
+    # timeout of the job running payload, fan-out calls included
+    from core.models import get_fanout_aliases, get_job_timeout
+    pipeline_classes = [session.get_pipeline_class(pipeline_alias) for pipeline_alias in get_fanout_aliases(payload)]
+    return max(get_job_timeout(kls) for kls in pipeline_classes if kls is not None)
+
+
+def submit(session, payload: dict) -> None:
+    from core.models import get_fanout_aliases
+    ticket = {
+        'id': str(uuid.uuid4()),
+        'user_id': session.user_id,
+        'pipelines': get_fanout_aliases(payload),
+        'timeout': get_timeout(session, payload),
+    }
+    job = {'ticket': ticket, 'session_id': str(session.id), 'channel_id': session.channel_id, 'payload': payload}
+    connection = get_connection()
+    with connection.lock(SCHEDULER_LOCK_KEY, timeout=10):
+        waiting_key = WAITING_KEY_TPL.format(user_id=ticket['user_id'])
+        if not connection.llen(waiting_key):
+            connection.rpush(USERS_RING_KEY, ticket['user_id'])
+        connection.rpush(waiting_key, json.dumps(job))
+    dispatch()
+
+
+def release(ticket: dict) -> None:
+    connection = get_connection()
+    with connection.lock(SCHEDULER_LOCK_KEY, timeout=10):
+        connection.zrem(RUNNING_USER_KEY_TPL.format(user_id=ticket['user_id']), ticket['id'])
+        for pipeline_alias in ticket['pipelines']:
+            connection.zrem(RUNNING_PIPELINE_KEY_TPL.format(pipeline=pipeline_alias), ticket['id'])
+    dispatch()
+
+
+def dispatch() -> None:
+    # Start as many waiting jobs as caps allow, taking the oldest job of each user in turn
+    connection = get_connection()
+    started_jobs = []
+    with connection.lock(SCHEDULER_LOCK_KEY, timeout=10):
+        blocked_users = set()
+        while True:
+            user_id = connection.lpop(USERS_RING_KEY)
+            if user_id is None:
+                break
+            user_id = user_id.decode()
+            if user_id in blocked_users:
+                # every user with waiting jobs has been tried since last dispatched job
+                connection.lpush(USERS_RING_KEY, user_id)
+                break
+            waiting_key = WAITING_KEY_TPL.format(user_id=user_id)
+            raw_job = connection.lindex(waiting_key, 0)
+            if raw_job is None:
+                continue
+            job = json.loads(raw_job)
+            if can_run(connection, job['ticket']):
+                connection.lpop(waiting_key)
+                mark_running(connection, job['ticket'])
+                started_jobs.append(job)
+                blocked_users.clear()
+            else:
+                blocked_users.add(user_id)
+            if connection.llen(waiting_key):
+                connection.rpush(USERS_RING_KEY, user_id)
+        waiting_jobs = get_waiting_positions(connection)
+    for job in started_jobs:
+        try:
+            start_job(job)
+        except Exception as e:
+            logger.exception("Scheduled job could not be started")
+            # job has left its waiting list : the user must be told that it won't run
+            notify_error(job, _("Your request could not be started (%s), please retry") % (e,))
+            release(job['ticket'])
+    notify_positions(waiting_jobs)
+
+
+def get_waiting_positions(connection) -> list[tuple[dict, int]]:
+    # position of a waiting job, as if users' waiting lists were served round-robin
+    user_ids = [user_id.decode() for user_id in connection.lrange(USERS_RING_KEY, 0, -1)]
+    waiting_lists = [
+        [json.loads(raw_job) for raw_job in connection.lrange(WAITING_KEY_TPL.format(user_id=user_id), 0, -1)]
+        for user_id in user_ids
+    ]
+    result = []
+    position = 0
+    for index in range(max([len(waiting_list) for waiting_list in waiting_lists] or [0])):
+        for waiting_list in waiting_lists:
+            if index < len(waiting_list):
+                position += 1
+                result.append((waiting_list[index], position))
+    return result
+
+
+def notify_positions(waiting_jobs: list[tuple[dict, int]]) -> None:
+    channel_layer = get_channel_layer()
+    for job, position in waiting_jobs:
+        msg = {
+            'type': 'runner.status',
+            'message': {'status': 'queued', 'position': position, 'session_id': job['session_id']}
+        }
+        try:
+            async_to_sync(channel_layer.group_send)(job['channel_id'], msg)
+        except Exception:
+            logger.exception("Queue position could not be sent to channel %s", job['channel_id'])
+
+
+def notify_error(job: dict, error: str) -> None:
+    msg = {'type': 'runner.error', 'message': {'data': error, 'session_id': job['session_id']}}
+    try:
+        async_to_sync(get_channel_layer().group_send)(job['channel_id'], msg)
+    except Exception:
+        logger.exception("Error could not be sent to channel %s", job['channel_id'])
+
+
+def run_dispatcher(interval: float) -> None:
+    # dispatches jobs whose in-flight caps have been freed by expired entries
+    logger.info("Scheduler dispatcher started, dispatching every %s sec", interval)
+    while True:
+        try:
+            dispatch()
+        except Exception:
+            logger.exception("Scheduled jobs could not be dispatched")
+        time.sleep(interval)
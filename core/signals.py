@@ -0,0 +1,12 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from core.models import DynamicPipeline
+from machinery.router import invalidate_pipeline_registry
+
+
+@receiver(post_save, sender=DynamicPipeline)
+@receiver(post_delete, sender=DynamicPipeline)
+def dynamic_pipeline_changed(sender, **kwargs):
+    # pipeline registries (see machinery.router) must be rebuilt
+    invalidate_pipeline_registry()
@@ -1,3 +1,293 @@
-from django.test import TestCase
+import json
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.utils import timezone, translation
+
+import fakeredis
+
+import core.scheduler as scheduler
+from core.models import ChatSession, ChatSessionMessage, ChatSessionFile, UserPreference, UserPrompt
+from core.serializers import ChatSessionSerializer
+from core.views import metrics
+from lib.constants import MESSAGE_KIND_REQUEST, MESSAGE_KIND_RESPONSE
+from machinery.exceptions import ChainDefinitionError
+from machinery.factories.chain.factory import get_ordered_steps
+from machinery.pipelines.demo.demo import EchoPipeline
+import machinery.streams as streams
+
+PIPELINE_DICT = {'core.demo': EchoPipeline}
+
+
+@mock.patch('core.models.get_pipeline_class', lambda alias, user: PIPELINE_DICT.get(alias))
+@mock.patch('core.models.get_pipeline_dict', lambda user: PIPELINE_DICT)
+class ChatSessionSerializationTestCase(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='castor', password='pollux')
+        self.session = ChatSession.objects.create(user=self.user)
+        self.messages = []
+        now = timezone.now()
+        for index in range(20):
+            request_message = ChatSessionMessage.objects.create(
+                session=self.session,
+                pipeline='core.demo',
+                data={'prompt': f'prompt {index}'},
+                created_on=now + timedelta(seconds=2 * index),
+                kind=MESSAGE_KIND_REQUEST
+            )
+            response_message = ChatSessionMessage.objects.create(
+                session=self.session,
+                pipeline='core.demo',
+                data={'result': f'result {index}'},
+                created_on=now + timedelta(seconds=2 * index + 1),
+                kind=MESSAGE_KIND_RESPONSE
+            )
+            self.messages += [request_message, response_message]
+        preference = UserPreference.objects.create(user=self.user)
+        UserPrompt.objects.create(preference=preference, content='prompt 0', message=self.messages[0])
+
+    def test_serialize_messages_query_count(self):
+        session = ChatSession.objects.get(id=self.session.id)
+        # 1st call renders messages and saves render cache :
+        with self.assertNumQueries(2):
+            history = session.serialize_messages()
+        self.assertEqual(len(history), len(self.messages))
+        # next calls only need to fetch messages :
+        with self.assertNumQueries(1):
+            session.serialize_messages()
+
+    def test_render_cache(self):
+        self.session.serialize_messages()
+        message = ChatSessionMessage.objects.get(id=self.messages[1].id)
+        self.assertEqual(message.rendered_content, 'result 0')
+        with mock.patch.object(EchoPipeline, 'format_response') as format_response:
+            self.assertEqual(message.render(EchoPipeline), 'result 0')
+            format_response.assert_not_called()
+        message.set_result('updated result')
+        self.assertEqual(message.render(EchoPipeline), 'updated result')
+
+    def test_render_key(self):
+        message = ChatSessionMessage.objects.get(id=self.messages[1].id)
+        render_key = message.compute_render_key(EchoPipeline)
+        with translation.override('en'):
+            english_render_key = message.compute_render_key(EchoPipeline)
+        with translation.override('fr'):
+            self.assertNotEqual(message.compute_render_key(EchoPipeline), english_render_key)
+        with mock.patch.object(EchoPipeline, 'PARAMS_HASH', 'other params'):
+            self.assertNotEqual(message.compute_render_key(EchoPipeline), render_key)
+
+    def test_serialize_messages_same_dicts(self):
+        history = self.session.serialize_messages()
+        expected = [ChatSessionMessage.objects.get(id=message.id).as_dict() for message in self.messages]
+        self.assertEqual(history, expected)
+        self.assertTrue(history[0]['is_prompt'])
+        self.assertFalse(history[1]['is_prompt'])
+
+    def test_serialize_messages_page(self):
+        expected_ids = [str(message.id) for message in self.messages]
+        messages, next_cursor = self.session.serialize_messages_page(limit=15)
+        self.assertEqual([message['id'] for message in messages], expected_ids[-15:])
+        page_ids = []
+        while next_cursor is not None:
+            messages, next_cursor = self.session.serialize_messages_page(cursor=next_cursor, limit=15)
+            page_ids = [message['id'] for message in messages] + page_ids
+        self.assertEqual(page_ids, expected_ids[:-15])
+
+
+class ChatSessionListingTestCase(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='castor', password='pollux')
+        for index in range(10):
+            session = ChatSession.objects.create(user=self.user)
+            ChatSessionFile.objects.create(session=session, file=f'uploaded/{index}.txt', name=f'{index}.txt')
+            if index % 2:
+                ChatSessionMessage.objects.create(session=session, pipeline='core.demo', data={'prompt': 'prompt'}, kind=MESSAGE_KIND_REQUEST)
+
+    def test_listing_query_count(self):
+        chat_sessions = ChatSession.objects.filter(user=self.user).for_listing(['core.demo'])
+        # 1 query for sessions (with has_messages annotation) + 1 query for files
+        with self.assertNumQueries(2):
+            data = ChatSessionSerializer(chat_sessions, many=True).data
+        self.assertEqual(len(data), 10)
+        self.assertEqual(sum(1 for item in data if item['has_messages']), 5)
+        self.assertTrue(all(len(item['files']) == 1 for item in data))
+
+
+class ChainStepsTestCase(SimpleTestCase):
+
+    def test_ordered_steps(self):
+        steps = get_ordered_steps([
+            {'alias': 'summary', 'pipeline': 'core.demo', 'after': ['answer', 'translation']},
+            {'alias': 'translation', 'pipeline': 'core.demo', 'after': ['answer']},
+            {'alias': 'answer', 'pipeline': 'core.demo'},
+        ])
+        self.assertEqual([step['alias'] for step in steps], ['answer', 'translation', 'summary'])
+        self.assertEqual(steps[0]['after'], [])
+
+    def test_duplicate_step(self):
+        with self.assertRaises(ChainDefinitionError):
+            get_ordered_steps([{'alias': 'answer', 'pipeline': 'core.demo'}, {'alias': 'answer', 'pipeline': 'core.demo'}])
+
+    def test_incomplete_step(self):
+        with self.assertRaises(ChainDefinitionError):
+            get_ordered_steps([{'alias': 'answer'}])
+
+    def test_unknown_step(self):
+        with self.assertRaisesMessage(ChainDefinitionError, 'missing'):
+            get_ordered_steps([{'alias': 'answer', 'pipeline': 'core.demo', 'after': ['missing']}])
+
+    def test_circular_steps(self):
+        with self.assertRaises(ChainDefinitionError):
+            get_ordered_steps([
+                {'alias': 'first', 'pipeline': 'core.demo', 'after': ['second']},
+                {'alias': 'second', 'pipeline': 'core.demo', 'after': ['first']},
+            ])
+
+
+class MetricsAccessTestCase(SimpleTestCase):
+
+    @override_settings(METRICS_TOKEN=None, METRICS_ALLOWED_IPS=[])
+    def test_denied_by_default(self):
+        response = metrics(RequestFactory().get('/metrics'))
+        self.assertEqual(response.status_code, 403)
+
+    @override_settings(METRICS_TOKEN='secret', METRICS_ALLOWED_IPS=[])
+    def test_token(self):
+        response = metrics(RequestFactory().get('/metrics', HTTP_AUTHORIZATION='Bearer wrong'))
+        self.assertEqual(response.status_code, 403)
+        with mock.patch('core.views.get_queue_gauges', return_value=[]), mock.patch('lib.metrics.render_metrics', return_value=''):
+            response = metrics(RequestFactory().get('/metrics', HTTP_AUTHORIZATION='Bearer secret'))
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(METRICS_TOKEN=None, METRICS_ALLOWED_IPS=['10.0.0.1'])
+    def test_allowed_ips(self):
+        response = metrics(RequestFactory().get('/metrics', REMOTE_ADDR='10.0.0.2'))
+        self.assertEqual(response.status_code, 403)
+        with mock.patch('core.views.get_queue_gauges', return_value=[]), mock.patch('lib.metrics.render_metrics', return_value=''):
+            response = metrics(RequestFactory().get('/metrics', REMOTE_ADDR='10.0.0.1'))
+        self.assertEqual(response.status_code, 200)
+
+
+@override_settings(SCHEDULER_MAX_JOBS_PER_USER=1, SCHEDULER_MAX_JOBS_PER_PIPELINE=None)
+class SchedulerDispatchTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.connection = fakeredis.FakeRedis()
+        self.connection.lock = mock.MagicMock()  # redis locks run lua scripts
+        self.started_jobs = []
+        patchers = [
+            mock.patch('core.scheduler.get_connection', return_value=self.connection),
+            mock.patch('core.scheduler.start_job', side_effect=self.started_jobs.append),
+            mock.patch('core.scheduler.notify_positions'),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def add_waiting_job(self, user_id: int, job_id: str, pipelines: list = None) -> dict:
+        # same structures as scheduler.submit, without dispatching
+        ticket = {'id': job_id, 'user_id': user_id, 'pipelines': pipelines or ['core.demo'], 'timeout': 60}
+        job = {'ticket': ticket, 'session_id': 'session', 'channel_id': 'channel', 'payload': {}}
+        waiting_key = scheduler.WAITING_KEY_TPL.format(user_id=user_id)
+        if not self.connection.llen(waiting_key):
+            self.connection.rpush(scheduler.USERS_RING_KEY, user_id)
+        self.connection.rpush(waiting_key, json.dumps(job))
+        return job
+
+    def get_started_ids(self) -> list:
+        return [job['ticket']['id'] for job in self.started_jobs]
+
+    def test_round_robin(self):
+        for job_id in ('a1', 'a2', 'a3'):
+            self.add_waiting_job(1, job_id)
+        self.add_waiting_job(2, 'b1')
+        scheduler.dispatch()
+        # a single job per user, in ring order
+        self.assertEqual(self.get_started_ids(), ['a1', 'b1'])
+        scheduler.release(self.started_jobs[0]['ticket'])
+        self.assertEqual(self.get_started_ids(), ['a1', 'b1', 'a2'])
+        scheduler.release(self.started_jobs[1]['ticket'])
+        self.assertEqual(self.get_started_ids(), ['a1', 'b1', 'a2'])  # user 2 has nothing left
+        self.assertEqual(self.connection.lrange(scheduler.USERS_RING_KEY, 0, -1), [b'1'])
+
+    @override_settings(SCHEDULER_MAX_JOBS_PER_USER=None, SCHEDULER_MAX_JOBS_PER_PIPELINE=1)
+    def test_pipeline_cap(self):
+        self.add_waiting_job(1, 'a1', ['core.demo'])
+        self.add_waiting_job(2, 'b1', ['core.other', 'core.demo'])  # fan-out job, blocked by its second pipeline
+        self.add_waiting_job(3, 'c1', ['core.other'])
+        scheduler.dispatch()
+        self.assertEqual(self.get_started_ids(), ['a1', 'c1'])
+        scheduler.release(self.started_jobs[0]['ticket'])
+        self.assertEqual(self.get_started_ids(), ['a1', 'c1'])
+        scheduler.release(self.started_jobs[1]['ticket'])
+        self.assertEqual(self.get_started_ids(), ['a1', 'c1', 'b1'])
+
+    def test_expired_running_job(self):
+        self.add_waiting_job(1, 'a1')
+        self.add_waiting_job(1, 'a2')
+        scheduler.dispatch()
+        self.assertEqual(self.get_started_ids(), ['a1'])
+        # release of a1 has been lost : its in-flight entry expires after its timeout
+        running_key = scheduler.RUNNING_USER_KEY_TPL.format(user_id=1)
+        self.connection.zadd(running_key, {'a1': 0})
+        scheduler.dispatch()
+        self.assertEqual(self.get_started_ids(), ['a1', 'a2'])
+
+    def test_start_failure(self):
+        self.add_waiting_job(1, 'a1')
+        with mock.patch('core.scheduler.start_job', side_effect=Exception('down')), mock.patch('core.scheduler.notify_error') as notify_error:
+            scheduler.dispatch()
+        notify_error.assert_called_once()
+        self.assertEqual(self.connection.zcard(scheduler.RUNNING_USER_KEY_TPL.format(user_id=1)), 0)
+
+
+class StreamCheckpointTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.connection = fakeredis.FakeRedis()
+        patcher = mock.patch('machinery.streams.get_connection', return_value=self.connection)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def record_stream(self, message_id: str, delta_count: int, ended: bool = False) -> None:
+        streams.record_event('channel', {'type': 'runner.partial', 'message': {'data': {'id': message_id, 'status': 'started'}}})
+        for seq in range(1, delta_count + 1):
+            streams.record_event('channel', {'type': 'runner.delta', 'message': {'id': message_id, 'seq': seq, 'content': str(seq)}})
+        if ended:
+            streams.record_event('channel', {'type': 'runner.message', 'message': {'data': {'id': message_id, 'status': 'ended'}}})
+
+    def get_event_summary(self, events: list) -> list:
+        return [(event['type'], event['message'].get('seq')) for event in events]
+
+    def test_known_message(self):
+        self.record_stream('m1', 3, ended=True)
+        events = streams.get_missing_events('channel', {'m1': 2})
+        # only what the client missed, without partial
+        self.assertEqual(self.get_event_summary(events), [('runner.delta', 3), ('runner.message', None)])
+        self.assertEqual(streams.get_missing_events('channel', {'m1': 3}), events[1:])
+
+    def test_unknown_message(self):
+        self.record_stream('m1', 1, ended=True)
+        self.record_stream('m2', 2)
+        events = streams.get_missing_events('channel', {'m1': 1})
+        # m2 is replayed from its partial
+        self.assertEqual(
+            self.get_event_summary(events),
+            [('runner.message', None), ('runner.partial', None), ('runner.delta', 1), ('runner.delta', 2)]
+        )
+
+    def test_request_message(self):
+        # messages that aren't part of a stream are not checkpointed
+        streams.record_event('channel', {'type': 'runner.message', 'message': {'data': {'id': 'request', 'status': 'ended'}}})
+        self.assertEqual(streams.get_missing_events('channel', {}), [])
+
+    def test_expired_stream(self):
+        self.record_stream('m1', 2, ended=True)
+        self.assertLessEqual(self.connection.ttl(streams.STREAM_KEY_TPL.format(channel_id='channel', message_id='m1')), streams.STREAM_ENDED_TTL)
+        self.connection.delete(streams.STREAM_KEY_TPL.format(channel_id='channel', message_id='m1'))
+        self.assertEqual(streams.get_missing_events('channel', {'m1': 1}), [])
+        self.assertEqual(self.connection.zcard(streams.STREAM_INDEX_KEY_TPL.format(channel_id='channel')), 0)
@@ -0,0 +1,36 @@
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+
+import django_rq
+
+import core.metrics  # noqa : metrics must be registered before being rendered
+import lib.metrics as lib_metrics
+from core.asyncworker import ASYNC_JOBS_KEY
+from core.scheduler import USERS_RING_KEY, WAITING_KEY_TPL
+
+
+def get_queue_gauges() -> list[str]:
+    # computed at each scrape from RQ (and asyncio worker / scheduler) redis structures
+    queued, started, failed = [], [], []
+    for queue_alias in settings.RQ_QUEUES.keys():
+        queue = django_rq.get_queue(queue_alias)
+        labels = {'queue': queue_alias}
+        queued.append((labels, queue.count))
+        started.append((labels, queue.started_job_registry.count))
+        failed.append((labels, queue.failed_job_registry.count))
+    connection = django_rq.get_connection('default')
+    queued.append(({'queue': 'async'}, connection.llen(ASYNC_JOBS_KEY)))
+    waiting = sum(connection.llen(WAITING_KEY_TPL.format(user_id=user_id.decode())) for user_id in connection.lrange(USERS_RING_KEY, 0, -1))
+    lines = []
+    lines += lib_metrics.render_gauge('matcha_queue_jobs', 'Jobs waiting in queue', queued)
+    lines += lib_metrics.render_gauge('matcha_queue_started_jobs', 'Jobs being run', started)
+    lines += lib_metrics.render_gauge('matcha_queue_failed_jobs', 'Failed jobs', failed)
+    lines += lib_metrics.render_gauge('matcha_scheduler_waiting_jobs', 'Jobs waiting for admission by fair scheduler', [({}, waiting)])
+    return lines
+
+
+def metrics(request):
+    if not lib_metrics.is_scrape_allowed(request):
+        return HttpResponseForbidden()
+    content = lib_metrics.render_metrics(extra_lines=get_queue_gauges())
+    return HttpResponse(content, content_type='text/plain; version=0.0.4; charset=utf-8')
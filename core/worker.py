@@ -0,0 +1,99 @@
+# RQ worker classes for pipeline jobs, to be used with "python3 manage.py rqworker --worker-class"
+# (see --worker-class option of launch.py) :
+# - PreloadedWorker loads config, pipeline registry, templates... once, before forking,
+#   so that work horses inherit this warm state instead of rebuilding it for each job
+# - PreloadedSimpleWorker also runs jobs within the worker process itself (no fork), which suits I/O bound queues
+import logging
+import time
+
+from django import db
+from django.template.loader import get_template
+
+from channels.layers import get_channel_layer
+from rq.worker import Worker, SimpleWorker
+
+import core.metrics as core_metrics
+
+logger = logging.getLogger("django")
+
+JOB_STARTED_AT = None  # set when a job is picked up, inherited by work horse (see record_setup_overhead)
+
+
+def warm_up() -> None:
+    # Everything loaded here is shared by all jobs, it must not depend on user nor hold a database connection
+    from lib.config import get_config
+    from machinery.router import get_factory_dict, get_static_pipeline_dict
+    from lib.ollama_pool import get_backends, get_host_client
+
+    get_config()
+    get_factory_dict()
+    pipeline_dict = get_static_pipeline_dict()
+    for alias, cls in pipeline_dict.items():
+        try:
+            cls.pydantic_model  # noqa : schemas are built once
+            template_name = getattr(cls, 'TEMPLATE', None)
+            if template_name:
+                get_template(template_name)  # compiled templates are kept by cached loader
+        except Exception:
+            logger.exception("Pipeline %s could not be preloaded", alias)
+    get_channel_layer()
+    for backend in get_backends():
+        get_host_client(backend.url)  # no connection is opened yet : it is safe to fork
+    # backends health is read from redis on each call (probed by the Ollama keeper), nothing to probe here
+    # work horses must not share database connections with their parent
+    db.connections.close_all()
+
+
+def record_setup_overhead() -> None:
+    # time spent between job pick up and pipeline processing start (fork, session fetch, registry...)
+    if JOB_STARTED_AT is None:
+        return
+    overhead = time.monotonic() - JOB_STARTED_AT
+    core_metrics.JOB_SETUP_OVERHEAD.observe(overhead)
+    logger.info("Job setup overhead : %.1f ms", overhead * 1000)
+
+
+class PreloadMixin(object):
+
+    warm_up_duration = None
+
+    def work(self, *args, **kwargs):
+        started_at = time.monotonic()
+        warm_up()
+        self.warm_up_duration = time.monotonic() - started_at
+        logger.info("Worker preloaded in %.1f ms", self.warm_up_duration * 1000)
+        return super(PreloadMixin, self).work(*args, **kwargs)
+
+    def execute_job(self, job, queue):
+        global JOB_STARTED_AT
+        JOB_STARTED_AT = time.monotonic()
+        try:
+            return super(PreloadMixin, self).execute_job(job, queue)
+        finally:
+            JOB_STARTED_AT = None
+
+
+class PreloadedWorker(PreloadMixin, Worker):
+    pass
+
+
+class PreloadedSimpleWorker(PreloadMixin, SimpleWorker):
+
+    def execute_job(self, job, queue):
+        try:
+            return super(PreloadedSimpleWorker, self).execute_job(job, queue)
+        finally:
+            # connections are kept between jobs, as in a request/response cycle
+            db.close_old_connections()
+
+
+def benchmark_job(user_id: int) -> None:
+    # what each pipeline job does before processing (see core.models.inline_schedule_call)
+    from django.contrib.auth.models import User
+    from lib.config import get_config
+    from machinery.router import get_pipeline_dict
+
+    get_config()
+    user = User.objects.get(id=user_id)
+    get_pipeline_dict(user)
+    get_channel_layer()
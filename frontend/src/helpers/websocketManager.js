@@ -4,6 +4,8 @@ import { SessionStore } from "@/stores/session";
 
 import ChatManager from "@/helpers/chatManager.js";
 
+const WS_RECONNECT_DELAY = 1000;  // in ms
+
 class WebSocketManager {
     constructor() {
         this.api = new API();
@@ -21,74 +23,118 @@ class WebSocketManager {
         
         chatSession.wsock = new WebSocket(url)
         chatSession.wsock.onmessage = function(event) {
-            const data = JSON.parse(event.data);
-            let panel = document.querySelector(`#log-${data.message.session_id}`)
-            switch (data.type) {
-
-                case 'runner.status':
-                    console.log('runner.status', data.message)
-                    // self.setSessionStatus(data.message)
-                    break;
-
-                case 'runner.log':
-                    if (panel) {
-                        const child = document.createElement('li')
-                        child.textContent = data.message.content
-                        child.classList.add('log')
-                        panel.appendChild(child)
-                    }
-                    console.log('runner.log', data);
-                    break;
-
-                case 'runner.checkstatus':
-                    console.log('Check status: ', data.messages)
-                    break;
-
-                case 'runner.error': {
-                    if (panel) {
-                        const child = document.createElement('li')
-                        child.textContent = data.message.data
-                        child.classList.add('error')
-                        panel.appendChild(child)
-                    }
-                    console.log('runner.error', data);
-                    self.chatStore.isRunning = false
-                    break;
-                }
-
-                case 'runner.message': {
-                    console.log('runner.message', data);
-                    self.upsert(data.message.data)
-                    break;
-                }
-
-                case 'runner.partial':
-                    console.log('runner.partial', data);
-                    self.upsert(data.message.data)
-                    break;
-
-
-                case 'runner.result':
-                    console.log('runner.result', data);
-                    self.chatStore.isRunning = false
-                    break;
-
-                case 'runner.title':
-                    console.log('runner.title', data);
-                    self.updateTitle(data.message.session_id, data.message.title)
-                    break;
-                default:
-            }
+            // when send batching is enabled on backend side, a frame holds a list of events
+            const payload = JSON.parse(event.data);
+            const events = Array.isArray(payload) ? payload : [payload];
+            events.forEach((data) => self.handleEvent(data));
         };
 
         chatSession.wsock.onopen = function() {
             chatSession.wsock.send(JSON.stringify({'type':'client.status', 'message':'connected'}));
+            self.resume(chatSession);
+        };
+
+        chatSession.wsock.onclose = function(event) {
+            // dropped connection (not closed by us) : reconnect, missed stream events will be replayed
+            if (!event.wasClean && self.chatManager.getChat(chat.id)) {
+                setTimeout(() => self.setup(chat), WS_RECONNECT_DELAY);
+            }
         };
 
         // UPDATE CHAT
         this.chatManager.updateChat(chatSession, {'wsock': chatSession.wsock})
     }
 
+    handleEvent(data) {
+        const self = this;
+        let panel = document.querySelector(`#log-${data.message.session_id}`)
+        switch (data.type) {
+
+            case 'runner.status':
+                console.log('runner.status', data.message)
+                if (panel && data.message.status === 'queued') {
+                    // waiting for a worker, see fair scheduler
+                    const child = document.createElement('li')
+                    child.textContent = `Waiting (position in queue: ${data.message.position})`
+                    child.classList.add('log')
+                    panel.appendChild(child)
+                }
+                // self.setSessionStatus(data.message)
+                break;
+
+            case 'runner.log':
+                if (panel) {
+                    const child = document.createElement('li')
+                    child.textContent = data.message.content
+                    child.classList.add('log')
+                    panel.appendChild(child)
+                }
+                console.log('runner.log', data);
+                break;
+
+            case 'runner.checkstatus':
+                console.log('Check status: ', data.messages)
+                break;
+
+            case 'runner.error': {
+                if (panel) {
+                    const child = document.createElement('li')
+                    child.textContent = data.message.data
+                    child.classList.add('error')
+                    panel.appendChild(child)
+                }
+                console.log('runner.error', data);
+                self.chatStore.isRunning = false
+                break;
+            }
+
+            case 'runner.message': {
+                console.log('runner.message', data);
+                self.upsert(data.message.data)
+                break;
+            }
+
+            case 'runner.partial':
+                console.log('runner.partial', data);
+                self.upsert(data.message.data)
+                break;
+
+            case 'runner.delta':
+                self.appendDelta(data.message)
+                break;
+
+
+            case 'runner.result':
+                console.log('runner.result', data);
+                self.chatStore.isRunning = false
+                break;
+
+            case 'runner.title':
+                console.log('runner.title', data);
+                self.updateTitle(data.message.session_id, data.message.title)
+                break;
+            default:
+        }
+    }
+
+    resume(chatSession) {
+        // ask backend to replay what was missed from responses still being streamed
+        const seqs = {};
+        (chatSession.messages || []).forEach((message) => {
+            if (message.inProgress) seqs[message.id] = message.lastSeq || 0;
+        });
+        chatSession.wsock.send(JSON.stringify({'type': 'runner.resume', 'message': {'seqs': seqs}}));
+    }
+
+    cancel(chatId) {
+        // ask worker to stop generating the responses of this chat being streamed
+        const chatSession = this.chatManager.getChat(chatId)
+        if (chatSession && chatSession.wsock) {
+            const ids = (chatSession.messages || []).filter((message) => message.inProgress).map((message) => message.id);
+            chatSession.wsock.send(JSON.stringify({'type': 'runner.cancel', 'message': {'ids': ids}}));
+        }
+    }
+
     upsert(msgData) {
         // Find message by id
         const message = this.chatManager.getChatMessage(msgData);
@@ -106,6 +152,19 @@ class WebSocketManager {
         }
     }
 
+    appendDelta(delta) {
+        // Find message (created by a previous runner.partial) by id
+        const message = this.chatManager.getChatMessage(delta);
+        if (message && (message.lastSeq || 0) < delta.seq) {
+            // append streamed text
+            this.chatManager.updateChatMessage(message, {
+                'inProgress': true,
+                'content': (message.content || '') + delta.content,
+                'lastSeq': delta.seq
+            })
+        }
+    }
+
     updateTitle(sessionId, newTitle) {
         const chat = this.chatManager.getChat(sessionId);
         // update title 
@@ -3,12 +3,13 @@ import subprocess
 from threading import Thread, Lock
 from itertools import cycle
 import argparse
-from lib.config import get_config
+from lib.config import get_config, get_queue_worker_processes
 from termcolor import colored
 import getpass
 
 SUPERVISOR_CONF_FILENAME = 'supervisor.conf'
 CONFIG_YAML_FILENAME = 'config.yaml'
+WORKER_CLASS_HELP = 'RQ worker class of Matcha workers, e.g. core.worker.PreloadedWorker or core.worker.PreloadedSimpleWorker (default: RQ worker).'
 
 # Color cycle for logs
 colors = cycle([
@@ -39,18 +40,36 @@ def log_line(color, alias, line):
         print(text, end="")
 
 
+# Function to get processes to launch : processes section and queue workers (see queues section)
+# worker_class (e.g. core.worker.PreloadedWorker) is used by Matcha RQ workers that don't define theirs
+def get_processes(config, worker_class=None):
+    processes = config['process_list'] + get_queue_worker_processes(config)
+    if not worker_class:
+        return processes
+    backend_workdir = config['processes']['core']['backend']['run']['workdir']
+    result = []
+    for process in processes:
+        run = process['run']
+        cmd_parts = run['cmd'].split()
+        if run['workdir'] == backend_workdir and 'rqworker' in cmd_parts and '--worker-class' not in cmd_parts:
+            process = dict(process, run=dict(run, cmd=f"{run['cmd']} --worker-class {worker_class}"))
+        result.append(process)
+    return result
+
+
 # Function to generate Supervisor configuration file
-def generate_supervisor_conf(output_filepath=SUPERVISOR_CONF_FILENAME):
+def generate_supervisor_conf(output_filepath=SUPERVISOR_CONF_FILENAME, worker_class=None):
     cwd = os.getcwd()
     log_dir = os.path.join(cwd, 'logs')
     config_filepath = os.path.join(cwd, CONFIG_YAML_FILENAME)
     config = get_config(filepath=config_filepath)
+    processes = get_processes(config, worker_class)
 
     # Create log directory if it doesn't exist
     os.makedirs(log_dir, exist_ok=True)
 
     # Create empty log files
-    for process in config['process_list']:
+    for process in processes:
         alias = process['alias']
         stdout_log = os.path.join(log_dir, f'{alias}_stdout.log')
         stderr_log = os.path.join(log_dir, f'{alias}_stderr.log')
@@ -85,7 +104,7 @@ user={user}
 """
 
     program_configs = []
-    for process in config['process_list']:
+    for process in processes:
         alias = process['alias']
         run = process['run']
         workdir = os.path.abspath(run['workdir'])  # Use absolute path
@@ -119,10 +138,10 @@ user={user}
 
 
 # Function to execute the dev command
-def dev():
+def dev(worker_class=None):
     cwd = os.getcwd()
     config = get_config(filepath=os.path.join(cwd, CONFIG_YAML_FILENAME))
-    processes = config['process_list']
+    processes = get_processes(config, worker_class)
 
     control_threads = []
 
@@ -171,7 +190,10 @@ if __name__ == "__main__":
     parser_supervisor_conf = subparsers.add_parser('supervisor_conf', help='Generate a Supervisor configuration file.')
     parser_supervisor_conf.add_argument('output', type=str, nargs='?', default=SUPERVISOR_CONF_FILENAME, help=f'Output path for the Supervisor configuration file (default: {SUPERVISOR_CONF_FILENAME}).')
 
+    parser_supervisor_conf.add_argument('--worker-class', type=str, default=None, help=WORKER_CLASS_HELP)
+
     parser_dev = subparsers.add_parser('dev', help='Execute the dev command.')
+    parser_dev.add_argument('--worker-class', type=str, default=None, help=WORKER_CLASS_HELP)
 
     args = parser.parse_args()
 
@@ -179,7 +201,7 @@ if __name__ == "__main__":
 
     if args.command == 'supervisor_conf':
         print(f"Generating Supervisor configuration file: {args.output}")
-        generate_supervisor_conf(args.output)
+        generate_supervisor_conf(args.output, args.worker_class)
     elif args.command == 'dev':
         print("Executing dev command.")
-        dev()
+        dev(args.worker_class)
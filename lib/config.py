@@ -1,5 +1,7 @@
 import os
 import string
+import pickle
+import hashlib
 from collections import defaultdict
 
 import yaml
@@ -7,6 +9,11 @@ from yaml import SafeLoader
 
 from .exceptions import UnhandledConfigTypeException
 
+# Compiled configurations cache : config filepath -> (mtime, source hash, compiled configuration)
+COMPILED_CONFIGS = {}
+
+# Optional directory where compiled configurations are pickled
+COMPILED_CONFIG_DIR = os.getenv('MATCHA_COMPILED_CONFIG_DIR')
 
 
 class dotdict(dict):
@@ -80,16 +87,24 @@ def namespace_items(item_list):
     return dict(namespaced_items)
 
 
-# Main function to get configuration from the YAML file
-def get_config(filepath=None):
-    # Set default filepath if not provided
+# Default config.yaml location (at project root)
+def get_config_filepath():
+    parent_file_dir = os.path.dirname(os.path.dirname(__file__))
+    return os.path.join(parent_file_dir, 'config.yaml')
+
+
+# Last modification time of the config file, useful to detect config changes
+def get_config_mtime(filepath=None):
     if filepath is None:
-        parent_file_dir = os.path.dirname(os.path.dirname(__file__))
-        filepath = os.path.join(parent_file_dir, 'config.yaml')
+        filepath = get_config_filepath()
+    try:
+        return os.path.getmtime(filepath)
+    except OSError:
+        return None
 
-    # Load data from the YAML file
-    data = load_yaml(filepath)
 
+# Function to compile YAML data into the final configuration
+def compile_config(data):
     # Initialize result dictionary with common variables and default pipeline
     result = {
         'common': data['common'],
@@ -116,5 +131,115 @@ def get_config(filepath=None):
     result['factory_instances'] = namespace_items(result['factory_instance_list'])
     result['factories'] = namespace_items(result['factory_list'])
 
+    # Add job queues (see get_queue_aliases)
+    result['queue_list'] = data.get('queues') or []
+    result['queues'] = dict((queue['alias'], queue) for queue in result['queue_list'])
+
     # Return the final configuration, properly formatted
     return propertize(result)
+
+
+# Function to get aliases of all job queues, either declared in queues section
+# or referenced by pipelines, factory instances or factories
+def get_queue_aliases(config):
+    aliases = ['default'] + [queue['alias'] for queue in config['queue_list']]
+    for item in config['pipeline_list'] + config['factory_instance_list'] + config['factory_list']:
+        alias = item.get('queue')
+        if alias and alias not in aliases:
+            aliases.append(alias)
+    return list(dict.fromkeys(aliases))
+
+
+# Function to get worker processes of job queues declared in queues section
+# (queues that are already handled by a process of processes section are skipped)
+def get_queue_worker_processes(config):
+    backend_run = config['processes']['core']['backend']['run']
+    handled_queues = set()
+    for process in config['process_list']:
+        cmd_parts = process['run']['cmd'].split()
+        if 'rqworker' in cmd_parts:
+            handled_queues.update(cmd_parts[cmd_parts.index('rqworker') + 1:])
+    result = []
+    for queue in config['queue_list']:
+        alias = queue['alias']
+        if alias in handled_queues:
+            continue
+        cmd = f'python3 manage.py rqworker {alias}'
+        if queue.get('worker_class'):
+            cmd += f" --worker-class {queue['worker_class']}"
+        for index in range(queue.get('workers') or 1):
+            result.append(propertize({
+                'alias': f'core.{alias}worker{index + 1}',
+                'settings': {},
+                'computed': {},
+                'run': {
+                    'workdir': backend_run['workdir'],
+                    'env': backend_run.get('env') or {},
+                    'precmd': backend_run.get('precmd') or '',
+                    'cmd': cmd
+                }
+            }))
+    return result
+
+
+# Function to load a pickled compiled configuration (if any)
+def load_compiled_config(compiled_dir, source_hash):
+    filepath = os.path.join(compiled_dir, f'config_{source_hash}.pickle')
+    try:
+        with open(filepath, 'rb') as f:
+            return pickle.load(f)  # NOSONAR (file is written by dump_compiled_config only)
+    except (OSError, pickle.PickleError, EOFError):
+        return None
+
+
+# Function to pickle a compiled configuration so that other processes start faster
+def dump_compiled_config(compiled_dir, source_hash, config):
+    filepath = os.path.join(compiled_dir, f'config_{source_hash}.pickle')
+    try:
+        os.makedirs(compiled_dir, exist_ok=True)
+        tmp_filepath = f'{filepath}.{os.getpid()}.tmp'
+        with open(tmp_filepath, 'wb') as f:
+            pickle.dump(config, f)
+        os.replace(tmp_filepath, filepath)
+    except OSError:
+        print(f"Error while writing compiled configuration to {filepath}")
+
+
+# Main function to get configuration from the YAML file
+#
+# The compiled configuration is cached (per process) and shared between callers,
+# so it must be considered as read only.
+# It is only recompiled when config file modification time and content changed.
+def get_config(filepath=None, use_cache=True, compiled_dir=COMPILED_CONFIG_DIR):
+    # Set default filepath if not provided
+    if filepath is None:
+        filepath = get_config_filepath()
+    filepath = os.path.abspath(filepath)
+
+    # Fast path : file has not been touched since last compilation
+    mtime = get_config_mtime(filepath)
+    cached = COMPILED_CONFIGS.get(filepath)
+    if use_cache and cached is not None and cached[0] == mtime:
+        return cached[2]
+
+    with open(filepath, 'rb') as f:
+        source = f.read()
+    source_hash = hashlib.sha1(source).hexdigest()  # NOSONAR
+
+    # File has been touched but its content is the same
+    if use_cache and cached is not None and cached[1] == source_hash:
+        COMPILED_CONFIGS[filepath] = (mtime, source_hash, cached[2])
+        return cached[2]
+
+    result = None
+    if use_cache and compiled_dir:
+        result = load_compiled_config(compiled_dir, source_hash)
+    if result is None:
+        # Load data from the YAML file
+        data = yaml.load(source, SafeLoader)
+        result = compile_config(data)
+        if compiled_dir:
+            dump_compiled_config(compiled_dir, source_hash, result)
+
+    COMPILED_CONFIGS[filepath] = (mtime, source_hash, result)
+    return result
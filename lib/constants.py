@@ -70,3 +70,7 @@ LANGUAGE_CHOICES = (
 )
 
 LANGUAGE_TO_LABEL = dict(LANGUAGE_CHOICES)
+
+# Job priorities (see BasePipeline.PRIORITY) : high priority jobs are put in front of their queue
+PRIORITY_NORMAL = 'normal'
+PRIORITY_HIGH = 'high'
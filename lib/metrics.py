@@ -0,0 +1,186 @@
+# Metrics shared by all processes (backend, RQ workers, asyncio worker) thru redis,
+# exposed in Prometheus text format by /metrics views (see core.views.metrics, in Matcha and searchapp).
+# Values are aggregated within each process and written to redis at most every FLUSH_INTERVAL seconds
+# (and at the end of each job, see flush) so that recording a metric stays cheap.
+# Within an event loop, redis must not be called when a metric is recorded : auto_flush is then disabled
+# and flush is run periodically within a thread (see core.asyncworker).
+# Metrics themselves are declared by each app (see core.metrics).
+import hmac
+import logging
+import threading
+import time
+
+from django.conf import settings
+
+import django_rq
+
+logger = logging.getLogger("django")
+
+DEFAULT_METRICS_KEY_PREFIX = 'matcha:metrics:'
+FLUSH_INTERVAL = 1.0  # in sec
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, float('inf'))
+
+REGISTRY = []  # registered metrics, in declaration order
+pending = {}  # (redis key, field) -> pending increment
+pending_lock = threading.Lock()
+last_flush = time.monotonic()
+auto_flush = True  # flush from increment when FLUSH_INTERVAL is elapsed
+
+
+def get_connection():
+    # metrics are stored along jobs of METRICS_QUEUE queue
+    return django_rq.get_connection(getattr(settings, 'METRICS_QUEUE', 'default'))
+
+
+def is_scrape_allowed(request) -> bool:
+    # /metrics views are only served to clients giving METRICS_TOKEN (as a bearer token) or coming from METRICS_ALLOWED_IPS
+    token = getattr(settings, 'METRICS_TOKEN', None)
+    authorization = request.META.get('HTTP_AUTHORIZATION', '')
+    if token and hmac.compare_digest(authorization.encode(), f'Bearer {token}'.encode()):
+        return True
+    return request.META.get('REMOTE_ADDR') in getattr(settings, 'METRICS_ALLOWED_IPS', [])
+
+
+def format_labels(labels: dict) -> str:
+    return ','.join('%s="%s"' % (key, str(value).replace('"', '\\"')) for key, value in sorted(labels.items()))
+
+
+def format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+def increment(key: str, field: str, value: float) -> None:
+    with pending_lock:
+        pending[(key, field)] = pending.get((key, field), 0) + value
+    if auto_flush and time.monotonic() - last_flush >= FLUSH_INTERVAL:
+        flush()
+
+
+def flush() -> None:
+    # write pending increments to redis, metrics errors must never break a pipeline
+    global pending, last_flush
+    with pending_lock:
+        items, pending = pending, {}
+        last_flush = time.monotonic()
+    if not items:
+        return
+    try:
+        pipe = get_connection().pipeline(transaction=False)
+        for (key, field), value in items.items():
+            pipe.hincrbyfloat(key, field, value)
+        pipe.execute()
+    except Exception:
+        logger.exception("Metrics could not be flushed")
+
+
+class Metric(object):
+
+    TYPE = None
+
+    def __init__(self, name: str, description: str):
+        self.name = name
+        self.description = description
+        REGISTRY.append(self)
+
+    @property
+    def key(self) -> str:
+        return getattr(settings, 'METRICS_KEY_PREFIX', DEFAULT_METRICS_KEY_PREFIX) + self.name
+
+    def collect(self, connection) -> list[str]:
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} {self.TYPE}']
+        values = connection.hgetall(self.key)
+        for field, value in sorted(values.items()):
+            field = field.decode()
+            labels = '{%s}' % (field,) if field else ''
+            lines.append(f'{self.name}{labels} {format_value(float(value))}')
+        return lines
+
+
+class Counter(Metric):
+
+    TYPE = 'counter'
+
+    def inc(self, value: float = 1, **labels) -> None:
+        increment(self.key, format_labels(labels), value)
+
+
+class Histogram(Metric):
+
+    TYPE = 'histogram'
+
+    def __init__(self, name: str, description: str, buckets=DEFAULT_BUCKETS):
+        super(Histogram, self).__init__(name, description)
+        self.buckets = buckets
+
+    def observe(self, value: float, **labels) -> None:
+        for bucket in self.buckets:
+            # empty buckets must be listed too
+            bucket_labels = dict(labels, le=format_value(bucket))
+            increment(self.key, 'bucket|' + format_labels(bucket_labels), 1 if value <= bucket else 0)
+        label_str = format_labels(labels)
+        increment(self.key, 'sum|' + label_str, value)
+        increment(self.key, 'count|' + label_str, 1)
+
+    def time(self, **labels) -> 'Timer':
+        return Timer(self, **labels)
+
+    @classmethod
+    def get_sort_key(cls, field: str) -> tuple:
+        # buckets must be listed by increasing upper bound
+        suffix, label_str = field.split('|', 1)
+        le = float('inf')
+        labels = []
+        for label in label_str.split(','):
+            if label.startswith('le="'):
+                le = float(label[4:-1].replace('+Inf', 'inf'))
+            elif label:
+                labels.append(label)
+        return labels, suffix, le
+
+    def collect(self, connection) -> list[str]:
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} {self.TYPE}']
+        values = dict((field.decode(), value) for field, value in connection.hgetall(self.key).items())
+        for field in sorted(values.keys(), key=self.get_sort_key):
+            value = values[field]
+            suffix, label_str = field.split('|', 1)
+            labels = '{%s}' % (label_str,) if label_str else ''
+            lines.append(f'{self.name}_{suffix}{labels} {format_value(float(value))}')
+        return lines
+
+
+class Timer(object):
+    "Context manager observing elapsed time in a histogram"
+
+    def __init__(self, histogram: Histogram, **labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started_at = time.monotonic()
+        return self
+
+    def __exit__(self, *args):
+        self.histogram.observe(time.monotonic() - self.started_at, **self.labels)
+
+
+def render_gauge(name: str, description: str, values: list[tuple[dict, float]]) -> list[str]:
+    # gauges are computed when metrics are collected (queue depth...) : they are not stored
+    lines = [f'# HELP {name} {description}', f'# TYPE {name} gauge']
+    for labels, value in values:
+        label_str = format_labels(labels)
+        labels_part = '{%s}' % (label_str,) if label_str else ''
+        lines.append(f'{name}{labels_part} {format_value(value)}')
+    return lines
+
+
+def render_metrics(extra_lines: list[str] = None) -> str:
+    flush()
+    connection = get_connection()
+    lines = []
+    for metric in REGISTRY:
+        lines += metric.collect(connection)
+    lines += extra_lines or []
+    return '\n'.join(lines) + '\n'
+
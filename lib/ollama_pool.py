@@ -0,0 +1,374 @@
+# Process-wide Ollama clients, keyed by backend URL : HTTP connections are kept alive and reused
+# across pipelines, and in-flight requests to a given host are limited by a semaphore.
+# When several backends are configured (OLLAMA_BACKENDS setting), each call is routed to the least loaded
+# healthy backend serving the requested model. Backend loads and health are shared by all processes thru redis
+# (OLLAMA_REDIS setting) : in-flight requests are counted by each client, backends are probed by a single
+# process (the Ollama keeper, see core.ollama_keeper) so that jobs never probe on their critical path.
+# Shared by Matcha and searchapp, always use get_client / get_async_client instead of building ollama clients.
+import asyncio
+import json
+import logging
+import threading
+import time
+import uuid
+
+from django.conf import settings
+
+import httpx
+import redis
+from ollama import Client, AsyncClient
+
+from lib.ollama_usage import get_connection, get_request_model, normalize_model_name, record_model_usage
+
+DEFAULT_OLLAMA_POOL_MAX_CONNECTIONS = 20
+DEFAULT_OLLAMA_POOL_MAX_KEEPALIVE = 10
+DEFAULT_OLLAMA_POOL_KEEPALIVE_EXPIRY = 60  # in sec
+DEFAULT_OLLAMA_CONNECT_TIMEOUT = 10  # in sec
+DEFAULT_OLLAMA_READ_TIMEOUT = None  # generations may be long, None means no timeout
+DEFAULT_OLLAMA_MAX_CONCURRENT_REQUESTS = 8  # per host
+DEFAULT_OLLAMA_HEALTH_CHECK_INTERVAL = 15  # in sec
+DEFAULT_OLLAMA_HEALTH_CHECK_TIMEOUT = 2  # in sec
+DEFAULT_OLLAMA_IN_FLIGHT_TTL = 15 * 60  # in sec, in-flight entries of dead processes are forgotten after this delay
+
+BACKENDS_STATE_KEY = 'matcha:ollama:backends'  # hash : backend url -> probe results (JSON)
+IN_FLIGHT_KEY_TPL = 'matcha:ollama:inflight:{url}'  # sorted set : request id -> expiration time
+
+logger = logging.getLogger("django")
+
+# Don't use these values directly, use get_* functions instead
+CLIENTS = {}  # host -> Client
+ASYNC_CLIENTS = {}  # (host, event loop id) -> AsyncClient, as async connections belong to an event loop
+SEMAPHORES = {}  # host -> threading semaphore
+BACKENDS = None  # list of Backend
+clients_lock = threading.Lock()
+
+
+def get_client_kwargs() -> dict:
+    max_connections = getattr(settings, 'OLLAMA_POOL_MAX_CONNECTIONS', DEFAULT_OLLAMA_POOL_MAX_CONNECTIONS)
+    return {
+        'limits': httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=getattr(settings, 'OLLAMA_POOL_MAX_KEEPALIVE', DEFAULT_OLLAMA_POOL_MAX_KEEPALIVE),
+            keepalive_expiry=getattr(settings, 'OLLAMA_POOL_KEEPALIVE_EXPIRY', DEFAULT_OLLAMA_POOL_KEEPALIVE_EXPIRY),
+        ),
+        'timeout': httpx.Timeout(
+            getattr(settings, 'OLLAMA_READ_TIMEOUT', DEFAULT_OLLAMA_READ_TIMEOUT),
+            connect=getattr(settings, 'OLLAMA_CONNECT_TIMEOUT', DEFAULT_OLLAMA_CONNECT_TIMEOUT),
+        ),
+    }
+
+
+def get_max_concurrent_requests() -> int:
+    return getattr(settings, 'OLLAMA_MAX_CONCURRENT_REQUESTS', DEFAULT_OLLAMA_MAX_CONCURRENT_REQUESTS)
+
+
+def start_request(host: str, url: str, kwargs: dict) -> str:
+    # returns the id of the in-flight entry of the request, None when it isn't tracked
+    model = get_request_model(url, kwargs)
+    if model is not None:
+        record_model_usage(model)
+    connection = get_connection()
+    if connection is None or len(get_backends()) < 2:
+        # in-flight requests are only needed to balance backends
+        return None
+    request_id = uuid.uuid4().hex
+    expires_at = time.time() + getattr(settings, 'OLLAMA_IN_FLIGHT_TTL', DEFAULT_OLLAMA_IN_FLIGHT_TTL)
+    try:
+        connection.zadd(IN_FLIGHT_KEY_TPL.format(url=host), {request_id: expires_at})
+    except redis.RedisError:
+        logger.exception("In-flight request to %s could not be recorded", host)
+        return None
+    return request_id
+
+
+def end_request(host: str, request_id: str) -> None:
+    if request_id is None:
+        return
+    try:
+        get_connection().zrem(IN_FLIGHT_KEY_TPL.format(url=host), request_id)
+    except redis.RedisError:
+        logger.exception("In-flight request to %s could not be removed", host)
+
+
+class PooledClient(Client):
+    "ollama Client whose requests (and streams, until closed) hold a slot of their host semaphore"
+
+    def __init__(self, host: str, semaphore: threading.Semaphore, **kwargs):
+        super(PooledClient, self).__init__(host=host, **kwargs)
+        self.host = host
+        self.semaphore = semaphore
+
+    def _request(self, method: str, url: str, **kwargs):
+        request_id = start_request(self.host, url, kwargs)
+        try:
+            with self.semaphore:
+                return super(PooledClient, self)._request(method, url, **kwargs)
+        finally:
+            end_request(self.host, request_id)
+
+    def _stream(self, method: str, url: str, **kwargs):
+        request_id = start_request(self.host, url, kwargs)
+        try:
+            with self.semaphore:
+                yield from super(PooledClient, self)._stream(method, url, **kwargs)
+        finally:
+            end_request(self.host, request_id)
+
+
+class AsyncPooledClient(AsyncClient):
+    "asyncio version of PooledClient, redis calls being run in threads so that they don't block the event loop"
+
+    def __init__(self, host: str, semaphore: asyncio.Semaphore, **kwargs):
+        super(AsyncPooledClient, self).__init__(host=host, **kwargs)
+        self.host = host
+        self.semaphore = semaphore
+
+    async def _request(self, method: str, url: str, **kwargs):
+        request_id = await asyncio.to_thread(start_request, self.host, url, kwargs)
+        try:
+            async with self.semaphore:
+                return await super(AsyncPooledClient, self)._request(method, url, **kwargs)
+        finally:
+            await asyncio.to_thread(end_request, self.host, request_id)
+
+    async def _stream(self, method: str, url: str, **kwargs):
+        stream = await super(AsyncPooledClient, self)._stream(method, url, **kwargs)
+
+        async def inner():
+            request_id = await asyncio.to_thread(start_request, self.host, url, kwargs)
+            try:
+                async with self.semaphore:
+                    try:
+                        async for partial in stream:
+                            yield partial
+                    finally:
+                        await stream.aclose()  # stops generation on Ollama side when closed early
+            finally:
+                await asyncio.to_thread(end_request, self.host, request_id)
+
+        return inner()
+
+
+class Backend(object):
+    "An Ollama host, its health and models come from the last probe (see probe_backends), its load from redis"
+
+    def __init__(self, url: str, models: list = None):
+        self.url = url.rstrip('/')
+        # models explicitly served by this backend, otherwise the ones listed by /api/tags
+        self.configured_models = set(normalize_model_name(model) for model in models) if models else None
+        self.in_flight = 0
+        self.set_state(None)
+
+    def __repr__(self):
+        return f'<Backend {self.url}>'
+
+    def set_state(self, state: dict) -> None:
+        # probe results, None (or results of a stale probe) meaning unknown
+        max_age = 3 * getattr(settings, 'OLLAMA_HEALTH_CHECK_INTERVAL', DEFAULT_OLLAMA_HEALTH_CHECK_INTERVAL)
+        if state is None or time.time() - state['checked_at'] > max_age:
+            state = {'healthy': True, 'available_models': None, 'loaded_models': [], 'checked_at': None}
+        self.healthy = state['healthy']
+        self.available_models = set(state['available_models']) if state['available_models'] is not None else None
+        self.loaded_models = set(state['loaded_models'])  # models in memory, see /api/ps
+        self.checked_at = state['checked_at']
+
+    def get_state(self) -> dict:
+        return {
+            'healthy': self.healthy,
+            'available_models': sorted(self.available_models) if self.available_models is not None else None,
+            'loaded_models': sorted(self.loaded_models),
+            'checked_at': self.checked_at,
+        }
+
+    def serves(self, model: str = None) -> bool:
+        if model is None:
+            return True
+        model = normalize_model_name(model)
+        if self.configured_models is not None:
+            return model in self.configured_models
+        if self.available_models is None:
+            # unknown yet, any backend may serve it
+            return True
+        return model in self.available_models
+
+    def get_load(self, model: str = None) -> tuple:
+        # least in-flight requests first, then backends which don't have to load the model
+        has_model_loaded = model is not None and normalize_model_name(model) in self.loaded_models
+        return (self.in_flight, not has_model_loaded)
+
+    def get_model_names(self, path: str, timeout: float) -> set:
+        response = httpx.get(self.url + path, timeout=timeout)
+        response.raise_for_status()
+        return set(model['name'] for model in response.json().get('models', []))
+
+    def probe(self) -> None:
+        timeout = getattr(settings, 'OLLAMA_HEALTH_CHECK_TIMEOUT', DEFAULT_OLLAMA_HEALTH_CHECK_TIMEOUT)
+        was_healthy = self.healthy
+        try:
+            self.available_models = self.get_model_names('/api/tags', timeout)
+            try:
+                self.loaded_models = self.get_model_names('/api/ps', timeout)
+            except httpx.HTTPStatusError:
+                # older Ollama versions have no /api/ps
+                self.loaded_models = set()
+            self.healthy = True
+        except (httpx.HTTPError, ValueError) as e:
+            self.healthy = False
+            if was_healthy:
+                logger.warning("Ollama backend %s is unhealthy (%s)", self.url, e)
+        else:
+            if not was_healthy:
+                logger.info("Ollama backend %s is healthy again", self.url)
+        self.checked_at = time.time()
+
+    def save_state(self) -> None:
+        connection = get_connection()
+        if connection is not None:
+            connection.hset(BACKENDS_STATE_KEY, self.url, json.dumps(self.get_state()))
+
+    def mark_unhealthy(self) -> None:
+        # for all processes, until next probe
+        if self.healthy:
+            logger.warning("Ollama backend %s is unreachable", self.url)
+        self.healthy = False
+        self.checked_at = time.time()
+        try:
+            self.save_state()
+        except redis.RedisError:
+            logger.exception("State of Ollama backend %s could not be saved", self.url)
+
+
+def get_backends() -> list[Backend]:
+    global BACKENDS
+    if BACKENDS is None:
+        with clients_lock:
+            if BACKENDS is None:
+                definitions = getattr(settings, 'OLLAMA_BACKENDS', None) or [{'url': settings.OLLAMA_BACKEND_URL}]
+                BACKENDS = [Backend(definition['url'], definition.get('models')) for definition in definitions]
+    return BACKENDS
+
+
+def probe_backends() -> list[Backend]:
+    # called periodically by a single process (see core.ollama_keeper), results are shared thru redis
+    backends = get_backends()
+    for backend in backends:
+        backend.probe()
+        backend.save_state()
+    return backends
+
+
+def refresh_backends(backends: list[Backend]) -> None:
+    # loads last probe results and in-flight requests of every backend, in a single redis round trip
+    connection = get_connection()
+    if connection is None:
+        return
+    now = time.time()
+    pipe = connection.pipeline(transaction=False)
+    pipe.hgetall(BACKENDS_STATE_KEY)
+    for backend in backends:
+        in_flight_key = IN_FLIGHT_KEY_TPL.format(url=backend.url)
+        pipe.zremrangebyscore(in_flight_key, '-inf', now)
+        pipe.zcard(in_flight_key)
+    results = pipe.execute()
+    states = results[0]
+    for index, backend in enumerate(backends):
+        backend.in_flight = results[2 + 2 * index]
+        state = states.get(backend.url.encode())
+        backend.set_state(json.loads(state) if state else None)
+
+
+def select_backend(model: str = None) -> Backend:
+    backends = get_backends()
+    if len(backends) == 1:
+        return backends[0]
+    try:
+        refresh_backends(backends)
+    except redis.RedisError:
+        logger.exception("Ollama backends state could not be loaded")
+    healthy_backends = [backend for backend in backends if backend.healthy]
+    # when no healthy backend serves the model, any healthy one is tried (it may pull it), any one at all as last resort
+    candidates = [backend for backend in healthy_backends if backend.serves(model)] or healthy_backends or backends
+    return min(candidates, key=lambda backend: backend.get_load(model))
+
+
+def get_model_arg(args: tuple, kwargs: dict) -> str:
+    # ollama Client methods take the model as first argument (generate, chat, embeddings, show, pull...)
+    model = kwargs.get('model', args[0] if args else None)
+    return model if isinstance(model, str) and model else None
+
+
+class BalancedClient(object):
+    "Same interface as ollama Client, each call being sent to the backend returned by select_backend"
+
+    def __getattr__(self, name: str):
+        def call(*args, **kwargs):
+            model = get_model_arg(args, kwargs)
+            backend = select_backend(model)
+            try:
+                return getattr(get_host_client(backend.url), name)(*args, **kwargs)
+            except httpx.ConnectError:
+                # streams are lazy, only plain requests can be retried here
+                backend.mark_unhealthy()
+                other_backend = select_backend(model)
+                if other_backend is backend:
+                    raise
+                return getattr(get_host_client(other_backend.url), name)(*args, **kwargs)
+
+        return call
+
+
+class AsyncBalancedClient(object):
+    "asyncio version of BalancedClient"
+
+    def __getattr__(self, name: str):
+        async def call(*args, **kwargs):
+            model = get_model_arg(args, kwargs)
+            backend = await asyncio.to_thread(select_backend, model)
+            try:
+                return await getattr(get_async_host_client(backend.url), name)(*args, **kwargs)
+            except httpx.ConnectError:
+                await asyncio.to_thread(backend.mark_unhealthy)
+                other_backend = await asyncio.to_thread(select_backend, model)
+                if other_backend is backend:
+                    raise
+                return await getattr(get_async_host_client(other_backend.url), name)(*args, **kwargs)
+
+        return call
+
+
+def get_client(host: str = None):
+    # PooledClient of the given host, otherwise of the only backend or a BalancedClient
+    if host is None:
+        backends = get_backends()
+        if len(backends) > 1:
+            return BalancedClient()
+        host = backends[0].url
+    return get_host_client(host)
+
+
+def get_async_client(host: str = None):
+    # must be called from within the event loop the client will be used in
+    if host is None:
+        backends = get_backends()
+        if len(backends) > 1:
+            return AsyncBalancedClient()
+        host = backends[0].url
+    return get_async_host_client(host)
+
+
+def get_host_client(host: str) -> PooledClient:
+    with clients_lock:
+        client = CLIENTS.get(host)
+        if client is None:
+            semaphore = SEMAPHORES.setdefault(host, threading.BoundedSemaphore(get_max_concurrent_requests()))
+            client = CLIENTS[host] = PooledClient(host, semaphore, **get_client_kwargs())
+    return client
+
+
+def get_async_host_client(host: str) -> AsyncPooledClient:
+    key = (host, id(asyncio.get_running_loop()))
+    client = ASYNC_CLIENTS.get(key)
+    if client is None:
+        semaphore = asyncio.Semaphore(get_max_concurrent_requests())
+        client = ASYNC_CLIENTS[key] = AsyncPooledClient(host, semaphore, **get_client_kwargs())
+    return client
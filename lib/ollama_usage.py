@@ -0,0 +1,83 @@
+# Ollama model usage, shared by all processes thru redis : each generation request (see lib.ollama_pool)
+# increments a per-minute counter of its model. Read by the Ollama keeper (see core.ollama_keeper)
+# to decide which models are kept loaded.
+import logging
+import time
+
+from django.conf import settings
+
+import redis
+
+logger = logging.getLogger("django")
+
+USAGE_KEY_TPL = 'matcha:ollama:usage:{model}:{minute}'  # requests of a model during a minute
+LAST_USED_KEY = 'matcha:ollama:lastused'  # hash : model -> timestamp of its last request
+DEFAULT_OLLAMA_USAGE_TTL = 2 * 60 * 60  # in sec, must exceed the keeper usage window
+USAGE_PATHS = ('/api/generate', '/api/chat', '/api/embeddings')
+
+
+CONNECTION = None
+
+
+def get_connection():
+    # Matcha redis database (OLLAMA_REDIS setting) shared by Matcha and searchapp, None disables usage tracking
+    global CONNECTION
+    redis_settings = getattr(settings, 'OLLAMA_REDIS', None)
+    if not redis_settings:
+        return None
+    if CONNECTION is None:
+        # redis-py connection pools are fork safe
+        CONNECTION = redis.Redis(host=redis_settings['HOST'], port=redis_settings['PORT'], db=redis_settings['DB'])
+    return CONNECTION
+
+
+def normalize_model_name(model: str) -> str:
+    # Ollama lists models with their tag
+    return model if ':' in model else model + ':latest'
+
+
+def get_request_model(url: str, kwargs: dict) -> str:
+    # model of an ollama Client request, None if it doesn't use a model (tags, ps...)
+    if url not in USAGE_PATHS:
+        return None
+    model = (kwargs.get('json') or {}).get('model')
+    return normalize_model_name(model) if model else None
+
+
+def record_model_usage(model: str) -> None:
+    # usage tracking must never break a request
+    try:
+        connection = get_connection()
+        if connection is None:
+            return
+        now = time.time()
+        key = USAGE_KEY_TPL.format(model=model, minute=int(now // 60))
+        pipe = connection.pipeline(transaction=False)
+        pipe.incr(key)
+        pipe.expire(key, getattr(settings, 'OLLAMA_USAGE_TTL', DEFAULT_OLLAMA_USAGE_TTL))
+        pipe.hset(LAST_USED_KEY, model, now)
+        pipe.execute()
+    except Exception:
+        logger.exception("Usage of Ollama model %s could not be recorded", model)
+
+
+def get_used_models() -> set:
+    connection = get_connection()
+    if connection is None:
+        return set()
+    return set(model.decode() for model in connection.hkeys(LAST_USED_KEY))
+
+
+def get_model_usage(models: list, window: int) -> dict:
+    # model -> (requests within the last window seconds, timestamp of last request or None)
+    connection = get_connection()
+    if connection is None:
+        return dict((model, (0, None)) for model in models)
+    current_minute = int(time.time() // 60)
+    minutes = range(current_minute - window // 60, current_minute + 1)
+    result = {}
+    for model in models:
+        counts = connection.mget([USAGE_KEY_TPL.format(model=model, minute=minute) for minute in minutes])
+        last_used = connection.hget(LAST_USED_KEY, model)
+        result[model] = (sum(int(count) for count in counts if count), float(last_used) if last_used else None)
+    return result
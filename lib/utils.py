@@ -1,6 +1,8 @@
 import os
+import json
 import random
 import uuid
+import hashlib
 import requests
 import base64
 from urllib.parse import urlparse
@@ -119,6 +121,12 @@ def generate_pipeline_dict(cls_, alias):
     }
 
 
+def get_stable_hash(value):
+    # same (json serializable) value, whatever its keys order, gives the same hash
+    serialized = json.dumps(value, sort_keys=True, default=str)
+    return hashlib.sha1(serialized.encode('utf-8')).hexdigest()  # NOSONAR
+
+
 def get_data_type(value):
     if isinstance(value, str):
         return 'string'
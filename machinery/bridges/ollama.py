@@ -1,9 +1,7 @@
-from django.conf import settings
 from django.utils.translation import gettext as _
 from django.utils.functional import classproperty
 
-from ollama import Client
-
+from lib.ollama_pool import get_client, get_async_client
 from machinery.pipelines.base import BasePipeline
 
 
@@ -17,7 +15,12 @@ class OllamaPipeline(BasePipeline):
 
     @classproperty
     def client(cls):
-        return Client(host=settings.OLLAMA_BACKEND_URL)
+        # shared by all pipelines of the process, see lib.ollama_pool
+        return get_client()
+
+    @classproperty
+    def async_client(cls):
+        return get_async_client()
 
     @classmethod
     def get_default_label(cls):
@@ -5,13 +5,13 @@ from django.conf import settings
 from django.core.cache import caches
 
 import replicate
-import ollama
 
 from machinery.pipelines.base import BasePipeline
 import core.models as core_models
 
 from lib.uigenerator import ReplicateModelGenerator
 from lib.constants import KIND_TEXT
+from lib.ollama_pool import get_client
 
 djangocache = caches['djangocache']
 
@@ -25,7 +25,7 @@ class ReplicatePipeline(BasePipeline):
     def __init__(self, session):
         super(ReplicatePipeline, self).__init__(session)
         self.replicate = replicate.Client(api_token=settings.REPLICATE_API_TOKEN)
-        self.title_generator = ollama.Client(host=settings.OLLAMA_BACKEND_URL)
+        self.title_generator = get_client()
 
     @classmethod
     def get_default_label(cls):
@@ -53,6 +53,11 @@ class ReplicatePipeline(BasePipeline):
 
     @classproperty
     def pydantic_model(cls):
+        # Memoized on the produced class itself (see BasePipelineFactory.produce_cached)
+        memoized = cls.__dict__.get('_pydantic_model')
+        if memoized is not None:
+            return memoized
+
         # Get schema
         schema_key = f'replicate_schema_{cls.model_formated}'
         schema = djangocache.get(schema_key, None)
@@ -67,6 +72,7 @@ class ReplicatePipeline(BasePipeline):
         layout = djangocache.get(f'replicate_layout_{cls.model_formated}')
         setattr(pydantic_model, 'layout', lambda: layout)
 
+        cls._pydantic_model = pydantic_model
         return pydantic_model
 
     @classproperty
@@ -0,0 +1,22 @@
+# Cooperative cancellation of running pipelines : the websocket consumer raises a flag in redis per response message
+# (see wsock.consumers.Consumer), pipelines poll the flag of the message they are generating thru BasePipeline.cancelled
+from django.core.cache import caches
+
+djangocache = caches['djangocache']
+
+CANCEL_KEY_TPL = 'cancel_{channel_id}_{message_id}'
+CANCEL_FLAG_TTL = 3600  # a forgotten flag must not live forever
+CANCEL_CHECK_INTERVAL = 0.5  # in sec, see BasePipeline.cancelled
+
+
+def get_cancel_key(channel_id: str, message_id: str) -> str:
+    # scoped by channel : a client can only cancel responses of its own session
+    return CANCEL_KEY_TPL.format(channel_id=channel_id, message_id=message_id)
+
+
+def request_cancellation(channel_id: str, message_id: str) -> None:
+    djangocache.set(get_cancel_key(channel_id, message_id), True, timeout=CANCEL_FLAG_TTL)
+
+
+def is_cancellation_requested(channel_id: str, message_id: str) -> bool:
+    return bool(djangocache.get(get_cancel_key(channel_id, message_id)))
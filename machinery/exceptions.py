@@ -11,4 +11,11 @@ class UploadFailedException(Exception):
 
 
 class SearchFailedException(Exception):
-    pass
\ No newline at end of file
+    pass
+
+class ChainDefinitionError(Exception):
+    pass
+
+
+class ChainStepError(Exception):
+    pass
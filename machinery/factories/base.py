@@ -1,7 +1,10 @@
 from __future__ import annotations
 
+from collections import OrderedDict
+from threading import Lock
 from typing import Type
 
+from django.conf import settings
 from django.utils.functional import classproperty
 
 from machinery.common.schema import ModelSchema
@@ -9,6 +12,14 @@ from machinery.pipelines.base import BasePipeline
 from machinery.exceptions import InformationNotDefined
 
 import lib.uischema as lib_uischema
+from lib.constants import PRIORITY_NORMAL
+from lib.utils import get_stable_hash
+
+# LRU cache of produced classes : (factory, pipeline alias, params hash) -> pipeline class
+# Don't use this value directly, use BasePipelineFactory.produce_cached instead
+PRODUCED_CLASSES = OrderedDict()
+PRODUCED_CLASSES_MAX_SIZE = 256
+produced_classes_lock = Lock()
 
 
 class BasePipelineFactory(object):
@@ -17,6 +28,12 @@ class BasePipelineFactory(object):
     LABEL = None
     DESCRIPTION = None
 
+    # default RQ job settings of produced pipelines (see BasePipeline)
+    QUEUE = 'default'
+    PRIORITY = PRIORITY_NORMAL
+    JOB_TIMEOUT = None
+    RESULT_TTL = None
+
     @classmethod
     def get_default_alias(cls) -> str:
         # override this method instead of overriding alias classproperty
@@ -64,6 +81,36 @@ class BasePipelineFactory(object):
         "This must be overridden"
         raise NotImplementedError
 
+    @classmethod
+    def produce_cached(cls, alias: str, **kwargs) -> Type[BasePipeline]:
+        """
+        Memoized version of produce : a given pipeline resolves to the same class within a process\n
+        Pipeline alias is part of the key as meta infos (ALIAS, LABEL...) are set on the produced class
+        """
+        params_hash = get_stable_hash(kwargs)
+        key = (f'{cls.__module__}.{cls.__qualname__}', alias, params_hash)
+        with produced_classes_lock:
+            kls = PRODUCED_CLASSES.get(key)
+            if kls is not None:
+                PRODUCED_CLASSES.move_to_end(key)
+                return kls
+        kls = cls.produce(**kwargs)
+        kls.PARAMS_HASH = params_hash  # distinguishes pipelines sharing an alias (e.g. edited dynamic pipelines)
+        max_size = getattr(settings, 'PIPELINE_CLASS_CACHE_SIZE', PRODUCED_CLASSES_MAX_SIZE)
+        with produced_classes_lock:
+            kls = PRODUCED_CLASSES.setdefault(key, kls)
+            while len(PRODUCED_CLASSES) > max_size:
+                PRODUCED_CLASSES.popitem(last=False)
+        return kls
+
+    @classmethod
+    def apply_job_settings(cls, kls: Type[BasePipeline]) -> None:
+        # produced pipelines inherit factory RQ job settings, they can still be overridden afterwards
+        kls.QUEUE = cls.QUEUE
+        kls.PRIORITY = cls.PRIORITY
+        kls.JOB_TIMEOUT = cls.JOB_TIMEOUT
+        kls.RESULT_TTL = cls.RESULT_TTL
+
     @classmethod
     def populate(cls, *args, **kwargs) -> tuple[dict, dict]:
         """
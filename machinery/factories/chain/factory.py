@@ -0,0 +1,73 @@
+import json
+from typing import Type
+
+from django.utils.translation import gettext as _
+from django.utils.functional import classproperty
+
+from machinery.exceptions import ChainDefinitionError
+from machinery.factories.base import BasePipelineFactory
+from machinery.factories.chain.reference import ReferenceChainPipeline
+
+from .schema import ChainFactorySchema
+
+
+def get_ordered_steps(steps: list[dict]) -> list[dict]:
+    # steps sorted so that a step comes after the steps it depends on ("after" key), raises ChainDefinitionError
+    steps_by_alias = {}
+    for step in steps:
+        if not step.get('alias') or not step.get('pipeline'):
+            raise ChainDefinitionError(_("Each step must have an alias and a pipeline"))
+        if step['alias'] in steps_by_alias:
+            raise ChainDefinitionError(_("Step %s is defined twice") % (step['alias'],))
+        steps_by_alias[step['alias']] = dict(step, after=list(step.get('after') or []))
+    ordered_steps = []
+    ordered_aliases = set()
+    remaining_steps = list(steps_by_alias.values())
+    while remaining_steps:
+        ready_steps = [step for step in remaining_steps if all(alias in ordered_aliases for alias in step['after'])]
+        if not ready_steps:
+            unknown = [alias for step in remaining_steps for alias in step['after'] if alias not in steps_by_alias]
+            if unknown:
+                raise ChainDefinitionError(_("Unknown step %s") % (unknown[0],))
+            raise ChainDefinitionError(_("Steps have circular dependencies"))
+        for step in ready_steps:
+            ordered_steps.append(step)
+            ordered_aliases.add(step['alias'])
+            remaining_steps.remove(step)
+    return ordered_steps
+
+
+class ChainFactory(BasePipelineFactory):
+    """
+    Runs a DAG of pipelines within a single job : outputs of a step feed the payload of the next ones.\n
+    Each step has an alias, a pipeline alias, the steps it depends on ("after") and a payload
+    whose string values may use {prompt} (or any key of chain request) and {<step alias>} (output of a step).
+    Steps without payload get chain request (root steps) or outputs of the steps they depend on as prompt.
+    """
+
+    @classproperty
+    def pydantic_model(cls):
+        return ChainFactorySchema
+
+    @classmethod
+    def get_default_label(cls):
+        return _("Chain pipelines")
+
+    @classmethod
+    def get_default_description(cls):
+        return _("Runs several pipelines, one after the other or in parallel, outputs of a pipeline being given to the next ones")
+
+    @classmethod
+    def produce(cls, **kwargs) -> Type[ReferenceChainPipeline]:
+        steps = kwargs['steps']
+        if isinstance(steps, str):
+            # steps given thru DynamicPipeline form
+            steps = json.loads(steps)
+        steps = get_ordered_steps(steps)
+        result_step = kwargs.get('result_step') or steps[-1]['alias']
+        if result_step not in [step['alias'] for step in steps]:
+            raise ChainDefinitionError(_("Unknown step %s") % (result_step,))
+        return type('ChainPipeline', (ReferenceChainPipeline,), {
+            'STEPS': steps,
+            'RESULT_STEP': result_step,
+        })
@@ -0,0 +1,137 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from django import db
+from django.conf import settings
+from django.utils.translation import gettext as _
+
+from core.models import ChatSession, ChatSessionMessage
+from machinery.exceptions import ChainStepError
+from machinery.mixins.llm_title_generator import LlmTitleGeneratorMixin
+from machinery.pipelines.base import BasePipeline
+from lib.constants import MESSAGE_KIND_REQUEST, MESSAGE_KIND_RESPONSE
+
+logger = logging.getLogger("django")
+
+DEFAULT_CHAIN_MAX_PARALLEL_STEPS = 4
+
+
+def get_step_output(pipeline_class, response_message: ChatSessionMessage) -> str:
+    # text given to the next steps
+    result = response_message.data.get('result')
+    if isinstance(result, str):
+        return result
+    if isinstance(result, list) and all(isinstance(item, dict) and 'text' in item for item in result):
+        # e.g. transcriptions
+        return '\n'.join(item['text'] for item in result)
+    return response_message.render(pipeline_class=pipeline_class) or ''
+
+
+class ReferenceChainPipeline(BasePipeline, LlmTitleGeneratorMixin):
+
+    STEPS = []  # must be defined within factory, ordered (see factory.get_ordered_steps)
+    RESULT_STEP = None  # ditto
+
+    @classmethod
+    def get_default_label(cls):
+        return _('Chain of %s') % (', '.join(step['pipeline'] for step in cls.STEPS),)
+
+    @classmethod
+    def get_title(cls, request_message: ChatSessionMessage, response_message: ChatSessionMessage) -> str:
+        user_prompt = request_message.data.get('prompt', None)
+        prompt_format = _("Define a title for this message, only give the title without comments or explanations : user message : {user_prompt}")
+        return cls.generate_title(prompt_format.format(user_prompt=user_prompt))
+
+    def get_step_payload(self, step: dict, request_message: ChatSessionMessage, outputs: dict) -> dict:
+        if 'payload' not in step:
+            if not step['after']:
+                return dict(request_message.data)
+            return {'prompt': '\n\n'.join(outputs[alias] for alias in step['after'])}
+        context = dict(request_message.data, **outputs)
+        payload = {}
+        for key, value in step['payload'].items():
+            if isinstance(value, str):
+                try:
+                    value = value.format_map(context)
+                except (KeyError, IndexError, ValueError) as e:
+                    raise ChainStepError(_("Step %s : invalid payload (%s)") % (step['alias'], e))
+            payload[key] = value
+        return payload
+
+    def get_step_message_dict(self, step: dict, step_response: ChatSessionMessage, pipeline_class) -> dict:
+        result = step_response.as_dict(pipeline_class=pipeline_class)
+        result['chain_step'] = step['alias']
+        return result
+
+    def get_step_pipeline_class(self, step: dict):
+        pipeline_class = self.session.get_pipeline_class(step['pipeline'])
+        if pipeline_class is None:
+            raise ChainStepError(_("Step %s : unknown pipeline %s") % (step['alias'], step['pipeline']))
+        # step pipelines can't be resolved when a chain is produced : a chain (e.g. itself, thru a dynamic pipeline)
+        # is rejected here, before any step runs, as nested chains would multiply threads until job timeout
+        if issubclass(pipeline_class, ReferenceChainPipeline):
+            raise ChainStepError(_("Step %s : a chain can't be a step of another chain") % (step['alias'],))
+        return pipeline_class
+
+    def run_step(self, step: dict, request_message: ChatSessionMessage, outputs: dict) -> str:
+        # steps are run within a transient session : their messages are streamed to the chat but never saved
+        try:
+            step_session = ChatSession.create_transient(self.session.user, parent=self.session)
+            pipeline_alias = step['pipeline']
+            pipeline_class = self.get_step_pipeline_class(step)
+            payload = self.get_step_payload(step, request_message, outputs)
+            data, errors = step_session.validate_payload(pipeline_alias, payload)
+            if data is None:
+                raise ChainStepError(_("Step %s : invalid payload %s") % (step['alias'], errors))
+
+            pipeline = pipeline_class(step_session)
+            pipeline.cancel_message_id = self.cancel_message_id  # cancelling the chain response cancels its steps
+            step_request = ChatSessionMessage(session=step_session, pipeline=pipeline_alias, data=data, kind=MESSAGE_KIND_REQUEST)
+            step_response = ChatSessionMessage(
+                session=step_session,
+                pipeline=pipeline_alias,
+                data={},
+                status='started',
+                kind=MESSAGE_KIND_RESPONSE,
+                selected=False
+            )
+            step_response.is_prompt = False  # unsaved message, see ChatSessionMessage.as_dict
+            step_session.transient_messages.append(step_request)
+            pipeline.preprocess(step_request, step_response)
+            self.send_partial(self.get_step_message_dict(step, step_response, pipeline_class))
+
+            if not step_session.replay_cached_result(pipeline, step_request, step_response):
+                pipeline.process(step_request, step_response)
+                step_session.cache_result(pipeline, step_request, step_response)
+            step_response.status = 'cancelled' if pipeline.was_cancelled else 'ended'
+            self.send_message(self.get_step_message_dict(step, step_response, pipeline_class))
+            return get_step_output(pipeline_class, step_response)
+        finally:
+            # each thread has its own database connection
+            db.connection.close()
+
+    def process(self, request_message: ChatSessionMessage, response_message: ChatSessionMessage) -> None:
+        # independent steps are run in parallel, a step starts as soon as the steps it depends on are done
+        outputs = {}
+        pending_steps = list(self.STEPS)
+        running_steps = {}  # future -> step
+        max_workers = getattr(settings, 'CHAIN_MAX_PARALLEL_STEPS', DEFAULT_CHAIN_MAX_PARALLEL_STEPS)
+        for step in self.STEPS:
+            self.get_step_pipeline_class(step)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            while pending_steps or running_steps:
+                if not self.cancelled():
+                    for step in [step for step in pending_steps if all(alias in outputs for alias in step['after'])]:
+                        self.send_log(_("Starting step %s") % (step['alias'],))
+                        running_steps[executor.submit(self.run_step, step, request_message, dict(outputs))] = step
+                        pending_steps.remove(step)
+                elif not running_steps:
+                    break
+                done_futures, _not_done = wait(running_steps.keys(), return_when=FIRST_COMPLETED)
+                for future in done_futures:
+                    step = running_steps.pop(future)
+                    # a failed step fails the whole chain (remaining steps are not started)
+                    outputs[step['alias']] = future.result()
+
+        response_message.data['steps'] = outputs
+        response_message.data['result'] = outputs.get(self.RESULT_STEP, '')
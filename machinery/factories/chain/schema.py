@@ -0,0 +1,17 @@
+from django.utils.translation import gettext as _
+
+from lib.uischema import UISchemaBaseModel
+from lib.uifields import UIInputField, UITextareaField
+
+
+class ChainFactorySchema(UISchemaBaseModel):
+    # steps are given as a JSON list, see ChainFactory
+    steps: str = UITextareaField(label=_("Steps (JSON)"), rows=10, required=True)(None)
+    result_step: str = UIInputField(label=_("Result step"), required=False)(None)
+
+    @staticmethod
+    def layout():
+        return [
+            ['steps'],
+            ['result_step'],
+        ]
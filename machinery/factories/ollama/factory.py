@@ -1,13 +1,15 @@
 from django.utils.translation import gettext as _
 from django.utils.functional import classproperty
 
+from channels.db import database_sync_to_async
+
 from machinery.bridges.ollama import OllamaPipeline
 from machinery.factories.base import BasePipelineFactory
 from core.models import ChatSessionMessage
 from machinery.mixins.llm_title_generator import LlmTitleGeneratorMixin
 
 from .schema import OllamaFactorySchema
-from lib.constants import MESSAGE_KIND_REQUEST, MESSAGE_KIND_RESPONSE
+from .history import ConversationHistory, trim_to_token_budget, get_history_token_budget
 import logging
 
 logger = logging.getLogger('django')
@@ -37,17 +39,6 @@ class OllamaRunnerFactory(BasePipelineFactory):
             new_prompt = prompt_format.format(user_prompt=user_prompt, assistant_response=assistant_response)
             return cls.generate_title(new_prompt)
 
-        def build_ollama_history(self, history):
-            ollama_history = []
-            for message in history:
-                if message.get('selected'):
-                    kind = message.get('kind')
-                    if kind == MESSAGE_KIND_REQUEST:
-                        ollama_history.append({'role': 'user', 'content': message.get('content')})
-                    elif kind == MESSAGE_KIND_RESPONSE:
-                        ollama_history.append({'role': 'system', 'content': message.get('content')})
-            return ollama_history
-
         def remove_empty_system_messages(self, ollama_history):
             i = 0
             while i < len(ollama_history):
@@ -61,35 +52,56 @@ class OllamaRunnerFactory(BasePipelineFactory):
             return ollama_history
 
         def get_formated_history(self):
-            history = self.session.serialize_messages()
-            logger.info(f"History: {history}")
-            history = history[:-1]
-
-            ollama_history = self.build_ollama_history(history)
-            ollama_history = self.remove_empty_system_messages(ollama_history)
-
-            return ollama_history
+            # only messages that are new since previous turn are fetched, see ConversationHistory
+            history = ConversationHistory(self.session)
+            ollama_history = self.remove_empty_system_messages(history.get_messages())
+            return trim_to_token_budget(ollama_history, get_history_token_budget())
 
-        def run_model(self):
+        def get_model_messages(self):
             history = self.get_formated_history()
             messages = []
             messages.append({'role': 'system', 'content': self.SYSTEM})
             messages += history
+            return messages
+
+        def run_model(self):
+            messages = self.get_model_messages()
             return self.client.chat(model=self.MODEL, messages=messages, stream=True)
 
         def process(self, request_message: ChatSessionMessage, response_message: ChatSessionMessage) -> None:
             output = self.run_model()
             results = []
-            raw_content = ''
             self.send_log('Extraction des résultats')
 
+            # only appended text is streamed, full message will be sent once processing is done
             for result in output:
-                results.append(result['message']['content'])
-                raw_content = ''.join(results)
-                response_message.data['result'] = raw_content
-                self.send_partial(response_message.as_dict())
+                if self.cancelled():
+                    output.close()  # closing the stream stops generation on Ollama side
+                    break
+                content = result['message']['content']
+                results.append(content)
+                self.send_delta(response_message.id, content)
+            self.flush_delta(response_message.id)
+
+            response_message.data['result'] = ''.join(results)
+
+        async def aprocess(self, request_message: ChatSessionMessage, response_message: ChatSessionMessage) -> None:
+            # asyncio version of process, see core.asyncworker
+            messages = await database_sync_to_async(self.get_model_messages, thread_sensitive=False)()
+            output = await self.async_client.chat(model=self.MODEL, messages=messages, stream=True)
+            results = []
+            self.send_log('Extraction des résultats')
+
+            async for result in output:
+                if await self.acancelled():
+                    await output.aclose()
+                    break
+                content = result['message']['content']
+                results.append(content)
+                self.send_delta(response_message.id, content)
+            self.flush_delta(response_message.id)
 
-            # NOTE : No need to set result at the end, the last loop does this
+            response_message.data['result'] = ''.join(results)
 
     @classmethod
     def produce(cls, **kwargs):
@@ -0,0 +1,108 @@
+from __future__ import annotations
+
+from django.conf import settings
+from django.core.cache import caches
+
+from core.models import ChatSession, ChatSessionMessage
+from lib.constants import MESSAGE_KIND_REQUEST, MESSAGE_KIND_RESPONSE
+from machinery.router import get_pipeline_dict
+
+djangocache = caches['djangocache']
+
+HISTORY_CACHE_KEY_TPL = 'ollama_history_{session_id}'
+DEFAULT_HISTORY_TOKEN_BUDGET = 4096
+CHARS_PER_TOKEN = 4  # rough estimate, good enough to enforce a budget
+
+ROLE_BY_MESSAGE_KIND = {
+    MESSAGE_KIND_REQUEST: 'user',
+    MESSAGE_KIND_RESPONSE: 'system',
+}
+
+
+def get_history_token_budget() -> int:
+    return getattr(settings, 'OLLAMA_HISTORY_TOKEN_BUDGET', DEFAULT_HISTORY_TOKEN_BUDGET)
+
+
+def estimate_token_count(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def trim_to_token_budget(messages: list[dict], token_budget: int) -> list[dict]:
+    # Drop oldest messages until history fits within token budget
+    # (last message, which is the current user prompt, is always kept)
+    token_count = sum(estimate_token_count(message['content']) for message in messages)
+    start = 0
+    while token_count > token_budget and start < len(messages) - 1:
+        token_count -= estimate_token_count(messages[start]['content'])
+        start += 1
+    # history must not start with an answer whose question has been dropped
+    while start < len(messages) - 1 and messages[start]['role'] != 'user':
+        start += 1
+    return messages[start:]
+
+
+class ConversationHistory(object):
+    """
+    Ready to send Ollama messages of a session\n
+    They are cached so that each turn only fetches (and renders) messages that are new since the previous turn
+    """
+
+    def __init__(self, session: ChatSession):
+        self.session = session
+        self.cache_key = self.get_cache_key(session.session_id)
+
+    @classmethod
+    def get_cache_key(cls, session_id: str) -> str:
+        return HISTORY_CACHE_KEY_TPL.format(session_id=session_id)
+
+    @classmethod
+    def invalidate(cls, session_id: str) -> None:
+        # must be called when already cached messages are changed (e.g. unselected)
+        djangocache.delete(cls.get_cache_key(session_id))
+
+    def fetch_new_items(self, cached_items: list[dict]) -> list[dict]:
+        pipeline_dict = get_pipeline_dict(self.session.user)
+        session_messages = ChatSessionMessage.objects.filter(
+            session=self.session,
+            pipeline__in=pipeline_dict.keys(),
+            kind__in=ROLE_BY_MESSAGE_KIND.keys(),
+            selected=True
+        ).exclude(status='started')  # responses being processed will be added once ended
+        if cached_items:
+            session_messages = session_messages.filter(created_on__gte=cached_items[-1]['created_on'])
+        known_ids = set(item['id'] for item in cached_items)
+        items = []
+        for session_message in session_messages.order_by('created_on'):
+            message_id = str(session_message.id)
+            if message_id in known_ids:
+                continue
+            content = session_message.render(pipeline_class=pipeline_dict[session_message.pipeline])
+            items.append({
+                'id': message_id,
+                'created_on': session_message.created_on,
+                'role': ROLE_BY_MESSAGE_KIND[session_message.kind],
+                'content': content or '',
+            })
+        return items
+
+    def get_transient_messages(self) -> list[dict]:
+        # transient sessions (see ChatSession.create_transient) only have in memory messages
+        pipeline_dict = get_pipeline_dict(self.session.user)
+        messages = []
+        for session_message in self.session.transient_messages:
+            pipeline_class = pipeline_dict.get(session_message.pipeline)
+            if pipeline_class is None or session_message.kind not in ROLE_BY_MESSAGE_KIND:
+                continue
+            content = session_message.render(pipeline_class=pipeline_class)
+            messages.append({'role': ROLE_BY_MESSAGE_KIND[session_message.kind], 'content': content or ''})
+        return messages
+
+    def get_messages(self) -> list[dict]:
+        if self.session.transient:
+            return self.get_transient_messages()
+        cached_items = djangocache.get(self.cache_key) or []
+        new_items = self.fetch_new_items(cached_items)
+        items = cached_items + new_items
+        if new_items:
+            djangocache.set(self.cache_key, items)
+        return [{'role': item['role'], 'content': item['content']} for item in items]
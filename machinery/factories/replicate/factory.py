@@ -26,6 +26,15 @@ class ReplicateRunnerFactory(BasePipelineFactory):
 
     class InnerRunner(ReplicatePipeline, LlmTitleGeneratorMixin):
 
+        CACHEABLE = True
+        CACHE_PER_USER = True  # generated files are stored along the session of the user who asked for them
+        CACHE_TTL = 50 * 60  # in sec, outputs that aren't downloaded are Replicate URLs, which expire after an hour
+
+        @classmethod
+        def is_cacheable(cls, data: dict) -> bool:
+            # without a fixed seed, each run gives a new result
+            return cls.CACHEABLE and data.get('seed') not in (None, '')
+
         @classmethod
         def get_title(cls, request_message: ChatSessionMessage, response_message: ChatSessionMessage):
             user_prompt = request_message.data.get('prompt', None)
@@ -22,6 +22,9 @@ class ReferenceSearchPipeline(BasePipeline, LlmTitleGeneratorMixin):
     NAMESPACE = None  # ditto
     TEMPLATE = 'searchresult.html'
     TEMPLATE_STRING = None
+    CACHEABLE = True
+    CACHE_TTL = 60 * 60  # indexed documents may change
+    CACHE_PER_USER = True  # found documents depend on user rights
 
     @classmethod
     def get_default_label(cls):
@@ -20,6 +20,7 @@ class ReferenceTranslationPipeline(OllamaPipeline, LlmTitleGeneratorMixin):
 
     MODEL = None  # must be defined within factory
     LANGUAGE = None  # ditto
+    CACHEABLE = True
 
     @classmethod
     def get_language_label(cls):
@@ -47,22 +48,47 @@ class ReferenceTranslationPipeline(OllamaPipeline, LlmTitleGeneratorMixin):
         pretitle = _('%s translation') % (language_label,)
         return f'{pretitle}: {title}'
 
-    def process(self, request_message: ChatSessionMessage, response_message: ChatSessionMessage):
+    def get_translation_prompt(self, request_message: ChatSessionMessage) -> str:
         language_label = self.get_language_label()
-        self.send_log(_("Starting translation to %s") % (language_label,))
         data = request_message.data
         user_prompt = data.get('prompt')
         final_prompt_tpl = _("""Please translate this text to {language_label}. Do not add a title nor introduction nor explanations, only provide the translation. Here is the text to translate :
         {user_prompt}
         """)
-        final_prompt = final_prompt_tpl.format(user_prompt=user_prompt, language_label=language_label)
+        return final_prompt_tpl.format(user_prompt=user_prompt, language_label=language_label)
+
+    def process(self, request_message: ChatSessionMessage, response_message: ChatSessionMessage):
+        language_label = self.get_language_label()
+        self.send_log(_("Starting translation to %s") % (language_label,))
+        final_prompt = self.get_translation_prompt(request_message)
         output = self.client.generate(self.MODEL, final_prompt, stream=True)
         self.send_log(_('Extracting results'))
         results = []
+        # only appended text is streamed, full message will be sent once processing is done
         for item in output:
+            if self.cancelled():
+                output.close()  # closing the stream stops generation on Ollama side
+                break
+            content = item['response']
+            results.append(content)
+            self.send_delta(response_message.id, content)
+        self.flush_delta(response_message.id)
+        response_message.data['result'] = ''.join(results)
+
+    async def aprocess(self, request_message: ChatSessionMessage, response_message: ChatSessionMessage):
+        # asyncio version of process, see core.asyncworker
+        language_label = self.get_language_label()
+        self.send_log(_("Starting translation to %s") % (language_label,))
+        final_prompt = self.get_translation_prompt(request_message)
+        output = await self.async_client.generate(self.MODEL, final_prompt, stream=True)
+        self.send_log(_('Extracting results'))
+        results = []
+        async for item in output:
+            if await self.acancelled():
+                await output.aclose()
+                break
             content = item['response']
             results.append(content)
-            raw_content = ''.join(results)
-            response_message.data['result'] = raw_content
-            self.send_partial(response_message.as_dict())
-        # NOTE : No need to set result at the end, the last loop does this
+            self.send_delta(response_message.id, content)
+        self.flush_delta(response_message.id)
+        response_message.data['result'] = ''.join(results)
@@ -1,9 +1,15 @@
 import logging
+import time
+
 from django.conf import settings
 
+import core.metrics as core_metrics
 
 logger = logging.getLogger("django")
 
+DEFAULT_STREAM_DELTA_WINDOW = 0.05  # in seconds
+DEFAULT_STREAM_DELTA_MAX_TOKENS = 20
+
 class ChannelMixin(object):
 
     def _send_msg(self, msg):
@@ -25,6 +31,40 @@ class ChannelMixin(object):
             logger.debug(self.channel_id, "RESULT :", data)
         self._send_msg({'type': 'runner.result', 'message': {'data': data}})
 
+    def _get_delta_state(self, message_id: str) -> dict:
+        delta_states = self.__dict__.setdefault('_delta_states', {})
+        if message_id not in delta_states:
+            delta_states[message_id] = {'seq': 0, 'tokens': [], 'flushed_at': time.monotonic()}
+        return delta_states[message_id]
+
+    def send_delta(self, message_id: str, text: str) -> None:
+        # Streaming : instead of sending the whole message (see send_partial) only appended text is sent,
+        # tokens are coalesced and sent once STREAM_DELTA_WINDOW seconds elapsed or STREAM_DELTA_MAX_TOKENS are pending
+        message_id = str(message_id)
+        delta_state = self._get_delta_state(message_id)
+        delta_state['tokens'].append(text)
+        window = getattr(settings, 'STREAM_DELTA_WINDOW', DEFAULT_STREAM_DELTA_WINDOW)
+        max_tokens = getattr(settings, 'STREAM_DELTA_MAX_TOKENS', DEFAULT_STREAM_DELTA_MAX_TOKENS)
+        if len(delta_state['tokens']) >= max_tokens or time.monotonic() - delta_state['flushed_at'] >= window:
+            self.flush_delta(message_id)
+
+    def flush_delta(self, message_id: str) -> None:
+        # Must be called at the end of the stream so that pending tokens are sent
+        message_id = str(message_id)
+        delta_state = self._get_delta_state(message_id)
+        delta_state['flushed_at'] = time.monotonic()
+        if not delta_state['tokens']:
+            return
+        content = ''.join(delta_state['tokens'])
+        delta_state['tokens'] = []
+        delta_state['seq'] += 1
+        processing_started_at = getattr(self, 'processing_started_at', None)
+        if delta_state['seq'] == 1 and processing_started_at is not None:
+            core_metrics.PIPELINE_FIRST_DELTA.observe(time.monotonic() - processing_started_at, pipeline=self.alias)
+        if settings.DEBUG:
+            logger.debug("%s DELTA  : %s", self.channel_id, content)
+        self._send_msg({'type': 'runner.delta', 'message': {'id': message_id, 'seq': delta_state['seq'], 'content': content, 'session_id': self.session_id}})
+
     def send_error(self, data: dict) -> None:
         if settings.DEBUG:
             logger.debug(self.channel_id, "ERROR  :", data)
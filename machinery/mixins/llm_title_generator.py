@@ -1,13 +1,14 @@
 
 from django.conf import settings
-import ollama
+
+from lib.ollama_pool import get_client
 
 
 class LlmTitleGeneratorMixin(object):
 
     @classmethod
     def generate_title(cls, new_prompt):
-        title_generator = ollama.Client(host=settings.OLLAMA_BACKEND_URL)
+        title_generator = get_client()
         title = title_generator.generate(model=settings.TITLE_LLM, prompt=new_prompt)
         # remove "
         title['response'] = title['response'].replace('"', '')
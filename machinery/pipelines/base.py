@@ -1,20 +1,25 @@
 from __future__ import annotations
 
+import asyncio
+import time
 from typing import Type
 
 from django.utils.translation import gettext as _
 from django.utils.functional import classproperty
 from django.conf import settings
 
-import ollama
+from channels.db import database_sync_to_async
 
 from machinery.common.schema import PromptSchema
 from machinery.mixins import ChannelMixin
 from machinery.exceptions import InformationNotDefined
+from machinery.cancellation import CANCEL_CHECK_INTERVAL, is_cancellation_requested
 
 import core.models as core_models
 import lib.uischema as lib_uischema
-from lib.constants import KIND_TEXT, MESSAGE_KIND_TO_LABEL, MESSAGE_KIND_ERROR
+from lib.ollama_pool import get_client
+import core.metrics as core_metrics
+from lib.constants import KIND_TEXT, MESSAGE_KIND_TO_LABEL, MESSAGE_KIND_ERROR, PRIORITY_NORMAL
 
 
 class BasePipeline(ChannelMixin):
@@ -28,6 +33,19 @@ class BasePipeline(ChannelMixin):
     ACTIVE = True
     READY = True
     EDITABLE = False
+    FORMAT_VERSION = 1  # increase it when format_* methods output changes : rendered messages cache will be invalidated
+
+    # RQ job settings, may be overridden in config.yaml (queue, priority, timeout, result_ttl)
+    QUEUE = 'default'
+    PRIORITY = PRIORITY_NORMAL
+    JOB_TIMEOUT = None  # None means queue default timeout
+    RESULT_TTL = None  # None means RQ default result ttl
+
+    # deterministic pipelines may have their results cached (see machinery.result_cache)
+    CACHEABLE = False
+    CACHE_TTL = 60 * 60 * 24  # in sec
+    CACHE_PER_USER = False  # True when result depends on user (e.g. rights)
+    PARAMS_HASH = None  # set on produced pipelines, see BasePipelineFactory.produce_cached
 
     USER = None
     GROUP = None
@@ -44,13 +62,19 @@ class BasePipeline(ChannelMixin):
     def __init__(self, session: core_models.ChatSession):
         self.session: core_models.ChatSession = session
         self.channel_id = session.channel_id
+        self.was_cancelled = False
+        self.cancel_checked_at = None
+        self.cancel_message_id = None  # response message whose cancellation is polled, see cancelled
+        self.processing_started_at = None
 
     # Please don't override methods starting with _
 
     def _start_processing(self, request_message: core_models.ChatSessionMessage, response_message: core_models.ChatSessionMessage) -> None:
         # it is strongly recommended not to override this function
+        self.processing_started_at = time.monotonic()
         try:
-            self.process(request_message, response_message)
+            with core_metrics.PIPELINE_PROCESS_DURATION.time(pipeline=self.alias):
+                self.process(request_message, response_message)
         except Exception as e:
             self.send_error(str(e))
 
@@ -60,6 +84,46 @@ class BasePipeline(ChannelMixin):
 
             self.send_message(response_message.as_dict())
 
+    async def _astart_processing(self, request_message: core_models.ChatSessionMessage, response_message: core_models.ChatSessionMessage) -> None:
+        # asyncio version of _start_processing, it is strongly recommended not to override this function
+        self.processing_started_at = time.monotonic()
+        try:
+            with core_metrics.PIPELINE_PROCESS_DURATION.time(pipeline=self.alias):
+                await self.aprocess(request_message, response_message)
+        except Exception as e:
+            self.send_error(str(e))
+
+            response_message.data['error'] = str(e)
+            response_message.kind = MESSAGE_KIND_ERROR
+            await database_sync_to_async(response_message.save, thread_sensitive=False)()
+
+            message_dict = await database_sync_to_async(response_message.as_dict, thread_sensitive=False)()
+            self.send_message(message_dict)
+
+    def cancelled(self) -> bool:
+        """
+        True once user asked (thru websocket) to cancel the response being generated (see cancel_message_id)\n
+        Long running loops should poll it, stop and close their upstream stream.
+        It is cheap enough to be called for each streamed token : redis is only asked every CANCEL_CHECK_INTERVAL seconds
+        """
+        if self.was_cancelled or self.cancel_message_id is None:
+            return self.was_cancelled
+        now = time.monotonic()
+        if self.cancel_checked_at is None or now - self.cancel_checked_at >= CANCEL_CHECK_INTERVAL:
+            self.cancel_checked_at = now
+            self.was_cancelled = is_cancellation_requested(self.channel_id, self.cancel_message_id)
+        return self.was_cancelled
+
+    async def acancelled(self) -> bool:
+        # asyncio version of cancelled, redis is asked within a thread so that other streams of the event loop aren't blocked
+        if self.was_cancelled or self.cancel_message_id is None:
+            return self.was_cancelled
+        now = time.monotonic()
+        if self.cancel_checked_at is None or now - self.cancel_checked_at >= CANCEL_CHECK_INTERVAL:
+            self.cancel_checked_at = now
+            self.was_cancelled = await asyncio.to_thread(is_cancellation_requested, self.channel_id, self.cancel_message_id)
+        return self.was_cancelled
+
     def _send_msg(self, msg):
         # it is strongly recommended not to override this function
         self.session._send_msg(msg)
@@ -86,6 +150,16 @@ class BasePipeline(ChannelMixin):
     def editable(cls) -> bool:  # NOSONAR
         return cls.EDITABLE
 
+    @classproperty
+    def supports_async(cls) -> bool:  # NOSONAR
+        # True when aprocess has been implemented, such pipelines can be run by the asyncio worker
+        return cls.aprocess is not BasePipeline.aprocess
+
+    @classmethod
+    def is_cacheable(cls, data: dict) -> bool:
+        # override it when only some requests give a deterministic result
+        return cls.CACHEABLE
+
     @classmethod
     def get_default_label(cls) -> str:
         # override this method instead of overriding label classproperty
@@ -116,7 +190,7 @@ class BasePipeline(ChannelMixin):
         '''
         prompt_format = _(prompt_preformat)
         prompt = prompt_format.format(label=cls.label, model=cls.MODEL, input=cls.input, output=cls.output)
-        result = ollama.Client(host=settings.OLLAMA_BACKEND_URL).generate(model=settings.SMALL_LLM, prompt=prompt)
+        result = get_client().generate(model=settings.SMALL_LLM, prompt=prompt)
         return result['response']
 
     @classmethod
@@ -221,6 +295,13 @@ class BasePipeline(ChannelMixin):
         #   note : feedbacks are particularly welcomed where result generation is iterative (which is the case, for instance, for most LLMs)
         raise NotImplementedError
 
+    async def aprocess(self, request_message: core_models.ChatSessionMessage, response_message: core_models.ChatSessionMessage) -> None:
+        # Optional asyncio native version of process (see core.asyncworker), same contract as process
+        # send_* methods can be called from aprocess : they don't block
+        # cancellation must be polled thru acancelled, no blocking call (database, redis...) may be made in the event loop
+        # Default implementation runs process within a thread :
+        await database_sync_to_async(self.process, thread_sensitive=False)(request_message, response_message)
+
     def postprocess(self, request_message: core_models.ChatSessionMessage, response_message: core_models.ChatSessionMessage) -> None:
         # This is a "hook" to change response_message after process is called
         pass
@@ -6,7 +6,7 @@ from django.utils.functional import classproperty
 
 import requests
 
-from ollama import Client
+from lib.ollama_pool import get_client
 
 from core.models import ChatSessionMessage, ChatSessionFile
 
@@ -27,7 +27,7 @@ class SearchUploadPipeline(BasePipeline, LlmTitleGeneratorMixin):
 
     def __init__(self, session):
         super(SearchUploadPipeline, self).__init__(session)
-        self.client = Client(host=settings.OLLAMA_BACKEND_URL)
+        self.client = get_client()
 
     @classproperty
     def pydantic_model(cls):
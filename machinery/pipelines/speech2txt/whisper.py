@@ -78,6 +78,9 @@ class WhisperPipeline(BasePipeline, LlmTitleGeneratorMixin):
         session_files = core_models.ChatSessionFile.objects.filter(session=self.session, favorite=True)
         outputs = []
         for session_file in session_files:
+            # a transcription can't be interrupted, but remaining files are skipped
+            if self.cancelled():
+                break
             payload = {
                 "audio": session_file.file.path,
             }
@@ -0,0 +1,53 @@
+# Results of deterministic pipelines (see BasePipeline.CACHEABLE), keyed by pipeline alias and cleaned payload.
+# Entries expire after pipeline CACHE_TTL, and the ones closest to expiration are evicted
+# once RESULT_CACHE_MAX_SIZE entries are stored
+import json
+import logging
+import time
+
+from django.conf import settings
+
+import django_rq
+
+from lib.utils import get_stable_hash
+
+logger = logging.getLogger("django")
+
+RESULT_CACHE_KEY_TPL = 'matcha:result_cache:{key}'
+RESULT_CACHE_INDEX_KEY = 'matcha:result_cache:index'  # sorted set : entry key -> expiration time
+DEFAULT_RESULT_CACHE_MAX_SIZE = 10000
+
+
+def get_connection():
+    return django_rq.get_connection('default')
+
+
+def get_result_key(pipeline_class, data: dict, user_id) -> str:
+    key_parts = [pipeline_class.alias, pipeline_class.PARAMS_HASH, pipeline_class.FORMAT_VERSION, data]
+    if pipeline_class.CACHE_PER_USER:
+        key_parts.append(user_id)
+    return RESULT_CACHE_KEY_TPL.format(key=get_stable_hash(key_parts))
+
+
+def get_cached_result(pipeline_class, data: dict, user_id) -> dict:
+    raw_result = get_connection().get(get_result_key(pipeline_class, data, user_id))
+    if raw_result is None:
+        return None
+    return json.loads(raw_result)
+
+
+def set_cached_result(pipeline_class, data: dict, user_id, result: dict) -> None:
+    connection = get_connection()
+    key = get_result_key(pipeline_class, data, user_id)
+    now = time.time()
+    max_size = getattr(settings, 'RESULT_CACHE_MAX_SIZE', DEFAULT_RESULT_CACHE_MAX_SIZE)
+    pipe = connection.pipeline()
+    pipe.set(key, json.dumps(result, default=str), ex=pipeline_class.CACHE_TTL)
+    pipe.zadd(RESULT_CACHE_INDEX_KEY, {key: now + pipeline_class.CACHE_TTL})
+    pipe.zremrangebyscore(RESULT_CACHE_INDEX_KEY, '-inf', now)
+    pipe.zcard(RESULT_CACHE_INDEX_KEY)
+    size = pipe.execute()[-1]
+    if size > max_size:
+        evicted = connection.zpopmin(RESULT_CACHE_INDEX_KEY, size - max_size)
+        connection.delete(*[evicted_key for evicted_key, _ in evicted])
+        logger.debug("Result cache : %s entries evicted", len(evicted))
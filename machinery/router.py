@@ -5,9 +5,10 @@ from collections import defaultdict
 from typing import Type
 
 from django.contrib.auth.models import User
+from django.core.cache import caches
 from django.db.models import Q
 
-from lib.config import get_config
+from lib.config import get_config, get_config_mtime
 
 logger = logging.getLogger("django")
 
@@ -16,12 +17,24 @@ import machinery.pipelines.base as pipelines_base
 
 
 # Don't use this value directy, use get_* methods instead
-PIPELINE_DICT = None
+PIPELINE_DICTS = {}  # registry cache : (user id, group ids) -> (registry version, pipeline dict)
 FACTORY_DICT = None
-PIPELINE_ALIASES = None
+
+# Shared between processes (backend, workers...) so that a DynamicPipeline change
+# made by one process also invalidates registries built by the others
+REGISTRY_VERSION_KEY = 'pipeline_registry_version'
+
+djangocache = caches['djangocache']
 
 PIPELINE_META_ATTR_NAMES = ['alias', 'label', 'description', 'generate_media', 'input', 'output']
 FACTORY_META_ATTR_NAMES = ['alias', 'label', 'description']
+# config.yaml key -> class attribute, for RQ job settings (see ChatSession.process)
+JOB_ATTR_NAMES = {
+    'queue': 'QUEUE',
+    'priority': 'PRIORITY',
+    'timeout': 'JOB_TIMEOUT',
+    'result_ttl': 'RESULT_TTL',
+}
 
 
 def extract_meta_infos(definition, attr_names):
@@ -37,11 +50,34 @@ def override_meta_info(cls, **infos):
         setattr(cls, key.upper(), value or current)
 
 
-def get_pipeline_dict(user: User, use_cache=True):
-    global PIPELINE_DICT
-    if use_cache and PIPELINE_DICT is not None:
-        return PIPELINE_DICT
-    from core.models import DynamicPipeline
+def override_job_info(cls, definition):
+    # unlike meta infos, job settings have no lowercase classproperty : only set what's defined
+    for key, attr_name in JOB_ATTR_NAMES.items():
+        value = definition.get(key)
+        if value is not None:
+            setattr(cls, attr_name, value)
+
+
+def get_registry_version() -> tuple:
+    # registry is outdated as soon as a DynamicPipeline changed or config.yaml has been modified
+    return djangocache.get(REGISTRY_VERSION_KEY, 0), get_config_mtime()
+
+
+def invalidate_pipeline_registry() -> None:
+    global PIPELINE_DICTS
+    PIPELINE_DICTS = {}
+    djangocache.add(REGISTRY_VERSION_KEY, 0, timeout=None)
+    djangocache.incr(REGISTRY_VERSION_KEY)
+
+
+def get_registry_key(user: User) -> tuple:
+    # available dynamic pipelines depend on user and on the groups the user belongs to
+    group_ids = tuple(sorted(user.groups.values_list('id', flat=True)))
+    return user.id, group_ids
+
+
+def get_static_pipeline_dict() -> dict:
+    # pipelines that don't depend on user : pipelines and factory instances defined in config
     result = {}
     config = get_config()
     # Handle normal pipelines :
@@ -52,20 +88,36 @@ def get_pipeline_dict(user: User, use_cache=True):
         cls = getattr(module, classname)
         infos = extract_meta_infos(pipeline_defn, PIPELINE_META_ATTR_NAMES)
         override_meta_info(cls, **infos)
+        override_job_info(cls, pipeline_defn)
         alias = pipeline_defn['alias']
         result[alias] = cls
     # Handle build pipelines :
+    get_factory_dict()  # factories job settings may be overridden in config
     for factory_instance_defn in config.factory_instance_list:
         factory = factory_instance_defn['factory']
         path, classname = factory.rsplit('.', 1)
         module = importlib.import_module(path)
         factory_kls = getattr(module, classname)
         params = factory_instance_defn['params']
-        cls = factory_kls.produce(**params)
+        alias = factory_instance_defn['alias']
+        cls = factory_kls.produce_cached(alias, **params)
         infos = extract_meta_infos(factory_instance_defn, PIPELINE_META_ATTR_NAMES)
         override_meta_info(cls, **infos)
-        alias = factory_instance_defn['alias']
+        factory_kls.apply_job_settings(cls)
+        override_job_info(cls, factory_instance_defn)
         result[alias] = cls
+    return result
+
+
+def get_pipeline_dict(user: User, use_cache=True):
+    registry_key = get_registry_key(user)
+    registry_version = get_registry_version()
+    if use_cache:
+        cached = PIPELINE_DICTS.get(registry_key)
+        if cached is not None and cached[0] == registry_version:
+            return cached[1]
+    from core.models import DynamicPipeline
+    result = get_static_pipeline_dict()
     # Handle dynamic pipelines
     # there's 3 conditions for a user to access DynamicPipeline :
     # - DynamicPipeline user and group are None
@@ -73,12 +125,12 @@ def get_pipeline_dict(user: User, use_cache=True):
     # - user belongs to DynamicPipeline group
     q_public = Q(user__isnull=True) & Q(group__isnull=True)
     q_user = Q(user=user)
-    q_group = Q(group_id__in=user.groups.values_list('id', flat=True))
+    q_group = Q(group_id__in=registry_key[1])
     clause = q_public | q_user | q_group
     for item in DynamicPipeline.objects.filter(clause):
         cls = item.pipeline_class  # Info : no need to "override" meta info, it's already done in pipeline_class method
         result[cls.ALIAS] = cls
-    PIPELINE_DICT = result
+    PIPELINE_DICTS[registry_key] = (registry_version, result)
     return result
 
 
@@ -94,14 +146,13 @@ def get_pipeline_class(pipeline_alias: str, user: User) -> Type[pipelines_base.B
 
 
 def get_pipeline_aliases(user: User) -> list[str]:
-    pipeline_dict = get_pipeline_dict(user, use_cache=False)
-    PIPELINE_ALIASES = pipeline_dict.keys()
-    return PIPELINE_ALIASES
+    pipeline_dict = get_pipeline_dict(user)
+    return list(pipeline_dict.keys())
 
 
 def get_output_kind_to_pipeline_dict(user: User) -> dict:
     result = defaultdict(list)
-    pipeline_dict = get_pipeline_dict(user, use_cache=False)
+    pipeline_dict = get_pipeline_dict(user)
     for _, kls in pipeline_dict.items():
         output = kls.output
         if output:
@@ -123,6 +174,7 @@ def get_factory_dict() -> dict:
         cls = getattr(module, classname)
         infos = extract_meta_infos(factory_defn, FACTORY_META_ATTR_NAMES)
         override_meta_info(cls, **infos)
+        override_job_info(cls, factory_defn)
         alias = factory_defn['alias']
         result[alias] = cls
     FACTORY_DICT = result
@@ -0,0 +1,128 @@
+import asyncio
+import concurrent.futures
+import logging
+import os
+import threading
+
+from asgiref.sync import sync_to_async
+from channels.layers import get_channel_layer
+
+from machinery.streams import record_event as record_stream_event
+
+logger = logging.getLogger("django")
+
+
+class AsyncChannelSender(object):
+    """
+    Sends channel messages from within an asyncio event loop (see core.asyncworker)\n
+    Messages are queued without blocking (from the loop thread or from any other thread)
+    and sent, in order, by a dedicated task
+    """
+
+    def __init__(self, channel_layer, channel_id: str):
+        self.channel_layer = channel_layer
+        self.channel_id = channel_id
+        self.loop = asyncio.get_running_loop()
+        self.loop_thread_id = threading.get_ident()
+        self.queue = asyncio.Queue()
+        self.task = self.loop.create_task(self.run())
+
+    def put(self, msg: dict) -> None:
+        if threading.get_ident() == self.loop_thread_id:
+            self.queue.put_nowait(msg)
+        else:
+            self.loop.call_soon_threadsafe(self.queue.put_nowait, msg)
+
+    async def run(self) -> None:
+        while True:
+            msg = await self.queue.get()
+            if msg is None:
+                break
+            try:
+                await sync_to_async(record_stream_event, thread_sensitive=False)(self.channel_id, msg)
+                await self.channel_layer.group_send(self.channel_id, msg)
+            except Exception:
+                logger.exception("Error while sending message to channel %s", self.channel_id)
+
+    async def close(self) -> None:
+        # sends pending messages then stops
+        self.put(None)
+        await self.task
+
+
+class ThreadedChannelSender(object):
+    """
+    Sends channel messages from synchronous code (e.g. RQ jobs) thru a single long-lived event loop thread\n
+    Messages are queued without blocking, then sent by batches : channels of a batch are sent to concurrently,
+    each channel receiving its messages in order. flush must be called at the end of each job
+    """
+
+    MAX_BATCH_SIZE = 100
+
+    def __init__(self, channel_layer):
+        self.channel_layer = channel_layer
+        self.loop = asyncio.new_event_loop()
+        self.queue = None
+        ready = threading.Event()
+        self.thread = threading.Thread(target=self.run_loop, args=(ready,), name='channel-sender', daemon=True)
+        self.thread.start()
+        ready.wait()
+
+    def run_loop(self, ready: threading.Event) -> None:
+        asyncio.set_event_loop(self.loop)
+        self.queue = asyncio.Queue()
+        self.loop.create_task(self.run())
+        ready.set()
+        self.loop.run_forever()
+
+    def put(self, channel_id: str, msg: dict) -> None:
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, (channel_id, msg))
+
+    async def run(self) -> None:
+        while True:
+            items = [await self.queue.get()]
+            while not self.queue.empty() and len(items) < self.MAX_BATCH_SIZE:
+                items.append(self.queue.get_nowait())
+            msgs_by_channel = {}
+            for channel_id, msg in items:
+                msgs_by_channel.setdefault(channel_id, []).append(msg)
+            await asyncio.gather(*[self.send_channel_msgs(channel_id, msgs) for channel_id, msgs in msgs_by_channel.items()])
+            for _item in items:
+                self.queue.task_done()
+
+    async def send_channel_msgs(self, channel_id: str, msgs: list[dict]) -> None:
+        for msg in msgs:
+            try:
+                # stream checkpoints are written by executor threads : blocking redis calls would serialize channels
+                await sync_to_async(record_stream_event, thread_sensitive=False)(channel_id, msg)
+                await self.channel_layer.group_send(channel_id, msg)
+            except Exception:
+                logger.exception("Error while sending message to channel %s", channel_id)
+
+    def flush(self, timeout: float = 10) -> None:
+        # blocks until queued messages are sent
+        future = asyncio.run_coroutine_threadsafe(self.queue.join(), self.loop)
+        try:
+            future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            logger.warning("Channel messages still pending after %s sec", timeout)
+
+
+# Don't use this value directly, use get_threaded_sender instead
+THREADED_SENDERS = {}  # process id -> sender : a forked process (e.g. RQ work horse) must start its own thread
+threaded_senders_lock = threading.Lock()
+
+
+def get_threaded_sender() -> ThreadedChannelSender:
+    pid = os.getpid()
+    with threaded_senders_lock:
+        sender = THREADED_SENDERS.get(pid)
+        if sender is None:
+            sender = THREADED_SENDERS[pid] = ThreadedChannelSender(get_channel_layer())
+    return sender
+
+
+def flush_threaded_sender() -> None:
+    sender = THREADED_SENDERS.get(os.getpid())
+    if sender is not None:
+        sender.flush()
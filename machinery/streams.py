@@ -0,0 +1,86 @@
+# Stream checkpoints : events of responses being streamed (partial, deltas, final message) are kept in redis
+# so that a client whose websocket dropped can resume (see runner.resume) and only receive what it missed
+import json
+import logging
+import time
+
+from django.conf import settings
+
+import django_rq
+
+logger = logging.getLogger("django")
+
+STREAM_KEY_TPL = 'matcha:stream:{channel_id}:{message_id}'  # list of events of a response message
+STREAM_INDEX_KEY_TPL = 'matcha:stream:{channel_id}'  # sorted set : streamed message ids, by start time
+DEFAULT_STREAM_CHECKPOINT_TTL = 60 * 60  # in sec
+STREAM_ENDED_TTL = 5 * 60  # ended streams are only kept for late reconnections
+STREAM_END_STATUSES = ('ended', 'cancelled')
+
+
+def get_connection():
+    return django_rq.get_connection('default')
+
+
+def get_message_id(event: dict) -> str:
+    # id of the response message a stream event belongs to, None for other events
+    if event['type'] == 'runner.delta':
+        return event['message']['id']
+    if event['type'] in ('runner.partial', 'runner.message'):
+        return event['message']['data'].get('id')
+    return None
+
+
+def is_stream_end(event: dict) -> bool:
+    data = event['message']['data']
+    return data.get('status') in STREAM_END_STATUSES or data.get('kind') == 'error'
+
+
+def record_event(channel_id: str, event: dict) -> None:
+    # called for each event sent to a channel, checkpoint errors must never break a pipeline
+    message_id = get_message_id(event)
+    if message_id is None:
+        return
+    try:
+        connection = get_connection()
+        key = STREAM_KEY_TPL.format(channel_id=channel_id, message_id=message_id)
+        index_key = STREAM_INDEX_KEY_TPL.format(channel_id=channel_id)
+        if event['type'] == 'runner.message':
+            # a message is only part of a stream if this stream exists (request messages are not)
+            if connection.zscore(index_key, message_id) is None:
+                return
+        ttl = getattr(settings, 'STREAM_CHECKPOINT_TTL', DEFAULT_STREAM_CHECKPOINT_TTL)
+        if event['type'] == 'runner.message' and is_stream_end(event):
+            ttl = min(ttl, STREAM_ENDED_TTL)
+        pipe = connection.pipeline(transaction=False)
+        pipe.rpush(key, json.dumps(event, default=str))
+        pipe.expire(key, ttl)
+        pipe.zadd(index_key, {message_id: time.time()}, nx=True)
+        pipe.expire(index_key, getattr(settings, 'STREAM_CHECKPOINT_TTL', DEFAULT_STREAM_CHECKPOINT_TTL))
+        pipe.execute()
+    except Exception:
+        logger.exception("Stream event could not be checkpointed for channel %s", channel_id)
+
+
+def get_missing_events(channel_id: str, last_seqs: dict) -> list[dict]:
+    # last_seqs : message id -> last delta seq received by the client.
+    # Streams the client doesn't know about are replayed from their partial
+    connection = get_connection()
+    index_key = STREAM_INDEX_KEY_TPL.format(channel_id=channel_id)
+    events = []
+    for message_id in connection.zrange(index_key, 0, -1):
+        message_id = message_id.decode()
+        raw_events = connection.lrange(STREAM_KEY_TPL.format(channel_id=channel_id, message_id=message_id), 0, -1)
+        if not raw_events:
+            # stream has expired
+            connection.zrem(index_key, message_id)
+            continue
+        last_seq = last_seqs.get(message_id)
+        for raw_event in raw_events:
+            event = json.loads(raw_event)
+            if last_seq is not None:
+                if event['type'] == 'runner.partial':
+                    continue
+                if event['type'] == 'runner.delta' and event['message']['seq'] <= last_seq:
+                    continue
+            events.append(event)
+    return events
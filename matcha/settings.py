@@ -27,7 +27,7 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 STACK_DIR = BASE_DIR.parent.parent
 sys.path.append(str(STACK_DIR))
 
-from lib.config import get_config  # noqa
+from lib.config import get_config, get_queue_aliases  # noqa
 config = get_config(os.path.join(BASE_DIR, 'config.yaml'))
 
 TIMEZONE = pytz.timezone('Europe/Paris')
@@ -237,6 +237,50 @@ RQ_QUEUES = {
     }
 }
 
+# pipelines (and factories) may be routed to their own queue, see "queue" in config.yaml
+for queue_alias in get_queue_aliases(config):
+    if queue_alias in RQ_QUEUES:
+        continue
+    queue_config = config.queues.get(queue_alias) or {}
+    RQ_QUEUES[queue_alias] = {
+        'HOST': config.common.redis.host or 'localhost',
+        'PORT': config.common.redis.port or 6379,
+        'DEFAULT_TIMEOUT': queue_config.get('timeout') or config.common.redis.db.timeout or 360,
+        'DB': config.common.redis.db.default or 1,
+    }
+
+# Prometheus /metrics access : bearer token or client IPs (behind a reverse proxy, REMOTE_ADDR is the proxy one)
+metrics_config = config.common.metrics or {}
+METRICS_TOKEN = metrics_config.get('token')
+METRICS_ALLOWED_IPS = metrics_config.get('allowed_ips') or []
+
+# asyncio worker (python manage.py asyncworker) : when enabled, pipelines implementing aprocess
+# are run concurrently by this worker instead of RQ workers
+async_worker_config = config.common.async_worker or {}
+ASYNC_WORKER_ENABLED = async_worker_config.get('enabled', False)
+ASYNC_WORKER_CONCURRENCY = async_worker_config.get('concurrency', 50)
+
+# fair scheduler (see core.scheduler) : caps in-flight jobs per user and per pipeline (0 or null means no limit),
+# waiting jobs are dispatched round-robin across users
+scheduler_config = config.common.scheduler or {}
+SCHEDULER_ENABLED = scheduler_config.get('enabled', False)
+SCHEDULER_MAX_JOBS_PER_USER = scheduler_config.get('max_jobs_per_user', 2)
+SCHEDULER_MAX_JOBS_PER_PIPELINE = scheduler_config.get('max_jobs_per_pipeline')
+
+# results of deterministic pipelines are cached in redis (see machinery.result_cache)
+RESULT_CACHE_MAX_SIZE = 10000
+
+# batch runs (see core.batch) : payloads of a batch are processed by a single job, concurrency threads at once
+BATCH_RUN_CONCURRENCY = 4
+BATCH_RUN_MAX_CONCURRENCY = 16
+BATCH_RUN_MAX_SIZE = 1000
+
+# fan-out calls (see core.models.get_fanout_aliases) : pipelines run concurrently on the same input
+FANOUT_MAX_PIPELINES = 4
+
+# chains (see machinery.factories.chain) : independent steps run in parallel
+CHAIN_MAX_PARALLEL_STEPS = 4
+
 SCHEDULER_CONFIG = {
     'EXECUTIONS_IN_PAGE': 20,
     'DEFAULT_RESULT_TTL': 500,
@@ -259,6 +303,23 @@ BACKEND_PORT = os.getenv('port') or config.processes.core.backend.settings.port
 REPLICATE_API_TOKEN = config.processes.core.backend.settings.replicate_api_token
 SEARCHAPP_BACKEND_URL = config.processes.core.search.computed.url
 OLLAMA_BACKEND_URL = config.processes.core.backend.computed.ollama_url
+# Ollama clients are shared by the process (see lib.ollama_pool)
+OLLAMA_POOL_MAX_CONNECTIONS = 20
+OLLAMA_POOL_MAX_KEEPALIVE = 10
+OLLAMA_CONNECT_TIMEOUT = 10  # in sec
+OLLAMA_READ_TIMEOUT = None  # in sec, None means no timeout
+OLLAMA_MAX_CONCURRENT_REQUESTS = 8  # per host
+# several Ollama backends (url and optional models list), OLLAMA_BACKEND_URL is used when none is defined
+OLLAMA_BACKENDS = config.common.ollama_backends or []
+OLLAMA_HEALTH_CHECK_INTERVAL = 15  # in sec, /api/tags and /api/ps probes of each backend (by the Ollama keeper)
+# backends health, in-flight requests and models usage are shared by all processes (Matcha and searchapp) in this database
+OLLAMA_REDIS = RQ_QUEUES['default']
+# Ollama keeper (python manage.py ollamakeeper), see core.ollama_keeper
+OLLAMA_KEEPER_INTERVAL = 60  # in sec
+OLLAMA_KEEPER_USAGE_WINDOW = 15 * 60  # in sec
+OLLAMA_KEEPER_HOT_THRESHOLD = 5  # models requested this many times within usage window stay loaded
+OLLAMA_KEEPER_PIN_DURATION = 10 * 60  # in sec
+OLLAMA_KEEPER_IDLE_TIMEOUT = 30 * 60  # in sec, models not requested for this long are unloaded
 
 # Optionnal URL (<=> depending on processes that have been activated or not)
 try:
@@ -275,6 +336,19 @@ TITLE_LLM = config.common.title_llm
 BIG_LLM = config.common.big_llm
 
 DATETIME_FORMAT = config.common.datetime_format
+
+# Streaming : appended text is coalesced before being sent thru channel (see ChannelMixin.send_delta)
+STREAM_DELTA_WINDOW = 0.05  # in seconds
+STREAM_DELTA_MAX_TOKENS = 20
+# websocket events received within this window (in sec) are sent as a single frame, 0 disables batching
+WEBSOCKET_SEND_BATCH_WINDOW = 0
+# streamed events are kept (in sec) so that clients can resume after a reconnection (see machinery.streams)
+STREAM_CHECKPOINT_TTL = 60 * 60
+# channel messages of RQ jobs are queued and sent in batches by a long-lived event loop thread (see ThreadedChannelSender)
+THREADED_CHANNEL_SENDER = True
+
+# Ollama chat history sent to models is trimmed (oldest turns first) to fit this budget
+OLLAMA_HISTORY_TOKEN_BUDGET = 4096
 SITE_ROOT = f'{BACKEND_PROTOCOL}://{BACKEND_HOSTNAME}:{BACKEND_PORT}'
 
 ALLOWED_HOSTS.append(config.common.hostname)
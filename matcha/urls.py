@@ -3,10 +3,13 @@ from django.conf.urls.static import static
 from django.urls import path, include
 from django.conf import settings
 
+from core import views as core_views
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path("api/", include("api.urls")),
     path('django-rq/', include('django_rq.urls')),
+    path('metrics', core_views.metrics, name='metrics'),  # Prometheus
 ]
 
 if settings.DEBUG:
@@ -0,0 +1,7 @@
+# Searchapp metrics, see lib.metrics (shared with Matcha)
+from lib.metrics import Counter, Histogram
+
+DOCUMENTS_PROCESSED = Counter('searchapp_documents_processed_total', 'Processed documents by final state')
+DOCUMENT_PARTS = Counter('searchapp_document_parts_total', 'Vectorized document parts')
+DOCUMENT_PROCESS_DURATION = Histogram('searchapp_document_process_duration_seconds', 'Document processing duration')
+DOCUMENT_STEP_DURATION = Histogram('searchapp_document_step_duration_seconds', 'Document processing duration by step')
@@ -1,6 +1,7 @@
 import uuid
 import os
 import logging
+import time
 
 from django.db import models
 from django.conf import settings
@@ -17,6 +18,8 @@ from lib.utils import convert_to_text, generate_summary
 from lib.tokenize import extract_parts
 from lib.vectorize import vectorize
 from lib import constants
+import lib.metrics as lib_metrics
+from core import metrics as core_metrics
 
 search_queue = get_queue('search')
 
@@ -117,25 +120,29 @@ class Document(models.Model):
 
     @classmethod
     def process(cls, document, data):
+        started_at = time.monotonic()
         document.state = constants.DOCUMENT_STATE_STARTPROCESS
         document.save()
         try:
             file_path = document.file.path
             relative_path = file_path.replace(settings.MEDIA_ROOT, '')
             # Convert document into text
-            text = convert_to_text(file_path)
+            with core_metrics.DOCUMENT_STEP_DURATION.time(step='convert'):
+                text = convert_to_text(file_path)
             document.state = constants.DOCUMENT_STATE_TEXTCONVERTED
             document.save()
 
             # Vectorize the document text
-            vector = vectorize(text)
+            with core_metrics.DOCUMENT_STEP_DURATION.time(step='vectorize'):
+                vector = vectorize(text)
             document.state = constants.DOCUMENT_STATE_VECTORIZED
             document.save()
 
             summary = ""
             # Generate a summary of the document text
             if data.get('generate_summary'):
-                summary = generate_summary(text)
+                with core_metrics.DOCUMENT_STEP_DURATION.time(step='summarize'):
+                    summary = generate_summary(text)
 
             # Update documnet with the extracted data
             document.url = '/media' + relative_path
@@ -153,20 +160,26 @@ class Document(models.Model):
                 parts = extract_parts(text, size=settings.PART_SIZE, overlap=settings.PART_OVERLAP)
 
             # Iterate over the parts and create Part instances
-            for content in parts:
-                vector = vectorize(content)
-                part = Part(
-                    document=document,
-                    content=content,
-                    embedding=vector
-                )
-                part.save()
+            with core_metrics.DOCUMENT_STEP_DURATION.time(step='parts'):
+                for content in parts:
+                    vector = vectorize(content)
+                    part = Part(
+                        document=document,
+                        content=content,
+                        embedding=vector
+                    )
+                    part.save()
+            core_metrics.DOCUMENT_PARTS.inc(len(parts))
             document.state = constants.DOCUMENT_STATE_FINALIZED
             document.save()
         except Exception as e:
             logger.info(str(e))
             document.state = constants.DOCUMENT_STATE_ERROR
             document.save()
+        finally:
+            core_metrics.DOCUMENTS_PROCESSED.inc(state=document.state)
+            core_metrics.DOCUMENT_PROCESS_DURATION.observe(time.monotonic() - started_at)
+            lib_metrics.flush()
 
     @property
     def group_rights(self) -> dict:
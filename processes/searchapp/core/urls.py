@@ -3,5 +3,6 @@ from django.urls import path
 from . import views
 
 urlpatterns = [
-    path("login/", views.login, name="login")
+    path("login/", views.login, name="login"),
+    path("metrics", views.metrics, name="metrics"),  # Prometheus
 ]
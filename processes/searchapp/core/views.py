@@ -1,12 +1,17 @@
 import logging
 
-from django.http import HttpResponse, HttpResponseBadRequest, JsonResponse
+from django.db.models import Count
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseForbidden, JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.translation import gettext as _
 
 from pydantic import ValidationError
+import django_rq
 
 from lib.auth import login_and_get_token
+import lib.metrics as lib_metrics
+from core import metrics as core_metrics  # noqa : metrics must be registered before being rendered
+from core.models import Document
 from .schema import LoginPayload
 
 logger = logging.getLogger("django")
@@ -33,3 +38,18 @@ def login(request):  # NOSONAR
             logger.info(str(e))
 
     return JsonResponse({'csrftoken': token})
+
+
+def metrics(request):
+    # Prometheus, ingestion backlog is given by documents states and search queue
+    if not lib_metrics.is_scrape_allowed(request):
+        return HttpResponseForbidden()
+    queue = django_rq.get_queue('search')
+    lines = []
+    lines += lib_metrics.render_gauge('searchapp_queue_jobs', 'Jobs waiting in queue', [({'queue': 'search'}, queue.count)])
+    lines += lib_metrics.render_gauge('searchapp_queue_started_jobs', 'Jobs being run', [({'queue': 'search'}, queue.started_job_registry.count)])
+    lines += lib_metrics.render_gauge('searchapp_queue_failed_jobs', 'Failed jobs', [({'queue': 'search'}, queue.failed_job_registry.count)])
+    states = Document.objects.values('state').annotate(count=Count('id'))
+    lines += lib_metrics.render_gauge('searchapp_documents', 'Documents by state', [({'state': item['state']}, item['count']) for item in states])
+    content = lib_metrics.render_metrics(extra_lines=lines)
+    return HttpResponse(content, content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -5,7 +5,7 @@ from django.conf import settings
 from django.utils.translation import gettext as _
 
 from langchain_community.document_loaders import UnstructuredFileLoader  # type: ignore
-from ollama import Client  # noqa
+from lib.ollama_pool import get_client
 
 
 def cluster(it, count):
@@ -78,7 +78,7 @@ def delete_file(path):
 
 def generate_summary(text):
     MODEL = settings.SUMMARY_MODEL
-    client = Client(host=settings.OLLAMA_BACKEND_URL, timeout=60)
+    client = get_client()
     preprompt = _("Generates a concise english summary of the following text in up to 50 words, gives the summary directly, do not add a commentary or introduction:")
     prompt_tpl = _('{preprompt}\n\n{text} \n\nConcise summary:')
     prompt = prompt_tpl.format(preprompt=preprompt, text=text)
@@ -160,6 +160,14 @@ RQ_QUEUES = {
     },
 }
 
+# metrics (see lib.metrics) are stored in search queue redis database
+METRICS_QUEUE = 'search'
+METRICS_KEY_PREFIX = 'searchapp:metrics:'
+# /metrics access (common.metrics in config.yaml) : bearer token or client IPs (behind a reverse proxy, REMOTE_ADDR is the proxy one)
+metrics_config = config.common.metrics or {}
+METRICS_TOKEN = metrics_config.get('token')
+METRICS_ALLOWED_IPS = metrics_config.get('allowed_ips') or []
+
 SCHEDULER_CONFIG = {
     'EXECUTIONS_IN_PAGE': 20,
     'DEFAULT_RESULT_TTL': 500,
@@ -178,6 +186,16 @@ MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 MEDIA_URL = '/media/'
 
 OLLAMA_BACKEND_URL = config.processes.core.backend.computed.ollama_url
+OLLAMA_BACKENDS = config.common.ollama_backends or []
+# Matcha default redis database, where backends health, in-flight requests and models usage are shared
+# (see lib.ollama_pool), so that the Ollama keeper knows when summary models are used
+OLLAMA_REDIS = {
+    'HOST': config.common.redis.host or 'localhost',
+    'PORT': config.common.redis.port or 6379,
+    'DB': config.common.redis.db.default or 1,
+}
+# summaries are generated within indexing jobs, they must not hang forever (see lib.ollama_pool)
+OLLAMA_READ_TIMEOUT = 60
 
 REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
@@ -1,60 +1,137 @@
 # chat/consumers.py
+import asyncio
 import json
 
-from channels.generic.websocket import WebsocketConsumer
-from asgiref.sync import async_to_sync
+from django.conf import settings
 
+from channels.generic.websocket import AsyncWebsocketConsumer, WebsocketConsumer
+from asgiref.sync import async_to_sync, sync_to_async
 
-class Consumer(WebsocketConsumer):
+from machinery.cancellation import request_cancellation
+from machinery.streams import get_missing_events
 
-    def connect(self):
+try:
+    import orjson
+except ImportError:  # json is used as fallback
+    orjson = None
+
+DEFAULT_WEBSOCKET_SEND_BATCH_WINDOW = 0  # in sec, 0 disables send batching
+
+
+def dumps(data) -> str:
+    if orjson is not None:
+        return orjson.dumps(data, default=str).decode('utf-8')
+    return json.dumps(data, default=str)
+
+
+def loads(text_data: str):
+    if orjson is not None:
+        return orjson.loads(text_data)
+    return json.loads(text_data)
+
+
+class Consumer(AsyncWebsocketConsumer):
+    """
+    Forwards runner.* events of a channel group to its websocket\n
+    Events may be batched (see WEBSOCKET_SEND_BATCH_WINDOW setting) : events received within the window
+    are then sent as a single frame holding a list of events
+    """
+
+    async def connect(self):
         self.channel_id = self.scope["url_route"]["kwargs"]["channel_id"]
+        self.pending_events = []
+        self.flush_task = None
+        self.send_batch_window = getattr(settings, 'WEBSOCKET_SEND_BATCH_WINDOW', DEFAULT_WEBSOCKET_SEND_BATCH_WINDOW)
         # Join room group
-        async_to_sync(self.channel_layer.group_add)(
-            self.channel_id, self.channel_name
-        )
-        self.accept()
+        await self.channel_layer.group_add(self.channel_id, self.channel_name)
+        await self.accept()
 
-    def disconnect(self, close_code):
+    async def disconnect(self, close_code):
+        if self.flush_task is not None:
+            self.flush_task.cancel()
         # Leave room group
-        async_to_sync(self.channel_layer.group_discard)(
-            self.channel_id, self.channel_name
-        )
+        await self.channel_layer.group_discard(self.channel_id, self.channel_name)
 
     # Receive message from WebSocket
+    async def receive(self, text_data=None, bytes_data=None):
+        data = loads(text_data)
+        if data['type'] == 'runner.checkstatus':
+            await self.channel_layer.group_send(self.channel_id, data)
+        elif data['type'] == 'runner.cancel':
+            # pipelines generating these responses poll their flag (see BasePipeline.cancelled)
+            for message_id in (data.get('message') or {}).get('ids') or []:
+                await sync_to_async(request_cancellation, thread_sensitive=False)(self.channel_id, message_id)
+        elif data['type'] == 'runner.resume':
+            # after a reconnection : only what the client missed is sent again
+            last_seqs = (data.get('message') or {}).get('seqs') or {}
+            events = await sync_to_async(get_missing_events, thread_sensitive=False)(self.channel_id, last_seqs)
+            for event in events:
+                await self.send_event(event)
+
+    async def dispatch(self, message):
+        # every runner.* event of the group is sent to the websocket as is
+        if message['type'].startswith('runner.'):
+            await self.send_event(message)
+        else:
+            await super(Consumer, self).dispatch(message)
+
+    async def send_event(self, event: dict) -> None:
+        if not self.send_batch_window:
+            await self.send(text_data=dumps(event))
+            return
+        self.pending_events.append(event)
+        if self.flush_task is None:
+            self.flush_task = asyncio.create_task(self.flush_events())
+
+    async def flush_events(self) -> None:
+        await asyncio.sleep(self.send_batch_window)
+        events, self.pending_events = self.pending_events, []
+        self.flush_task = None
+        await self.send(text_data=dumps(events))
+
+
+class SyncConsumer(WebsocketConsumer):
+    "Previous (synchronous) implementation, only kept to be compared with Consumer, see wsloadtest command"
+
+    def connect(self):
+        self.channel_id = self.scope["url_route"]["kwargs"]["channel_id"]
+        async_to_sync(self.channel_layer.group_add)(self.channel_id, self.channel_name)
+        self.accept()
+
+    def disconnect(self, close_code):
+        async_to_sync(self.channel_layer.group_discard)(self.channel_id, self.channel_name)
+
     def receive(self, text_data):
         data = json.loads(text_data)
         if data['type'] == 'runner.checkstatus':
             async_to_sync(self.channel_layer.group_send)(self.channel_id, data)
+        elif data['type'] == 'runner.cancel':
+            for message_id in (data.get('message') or {}).get('ids') or []:
+                request_cancellation(self.channel_id, message_id)
 
     def runner_status(self, event):
-        # Send message to WebSocket
         self.send(text_data=json.dumps(event))
 
     def runner_checkstatus(self, event):
-        # Send message to WebSocket
         self.send(text_data=json.dumps(event))
 
     def runner_log(self, event):
-        # Send message to WebSocket
         self.send(text_data=json.dumps(event))
 
     def runner_partial(self, event):
-        # Send message to WebSocket
+        self.send(text_data=json.dumps(event))
+
+    def runner_delta(self, event):
         self.send(text_data=json.dumps(event))
 
     def runner_result(self, event):
-        # Send message to WebSocket
         self.send(text_data=json.dumps(event))
 
     def runner_error(self, event):
-        # Send message to WebSocket
         self.send(text_data=json.dumps(event))
 
     def runner_message(self, event):
-        # Send message to WebSocket
         self.send(text_data=json.dumps(event))
 
     def runner_title(self, event):
-        # Send message to WebSocket
         self.send(text_data=json.dumps(event))